@@ -217,7 +217,7 @@ class OfferView(BaseAdminView):
             db.session.commit()
 
             # synchronize with external apis that generate playlists based on tags
-            search.async_index_offer_ids(offer_ids)
+            search.async_index_offer_ids(offer_ids, priority=search.IndexationPriority.BULK)
             return redirect(url)
 
         # Form didn't validate
@@ -0,0 +1,36 @@
+"""Add booking_outbox_event table
+
+Revision ID: e3a1c7d25f60
+Revises: d324e17d5314
+Create Date: 2021-09-08 14:27:05.918402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e3a1c7d25f60"
+down_revision = "d324e17d5314"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "booking_outbox_event",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("bookingId", sa.BigInteger(), nullable=False),
+        sa.Column("type", sa.Enum("BOOKED", name="booking_outbox_event_type"), nullable=False),
+        sa.Column("dateCreated", sa.DateTime(), server_default=sa.text("now()"), nullable=False),
+        sa.Column("lockedUntil", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["bookingId"], ["booking.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_booking_outbox_event_bookingId"), "booking_outbox_event", ["bookingId"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_booking_outbox_event_bookingId"), table_name="booking_outbox_event")
+    op.drop_table("booking_outbox_event")
+    op.execute("DROP TYPE booking_outbox_event_type")
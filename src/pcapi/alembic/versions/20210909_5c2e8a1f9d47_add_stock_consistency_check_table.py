@@ -0,0 +1,30 @@
+"""Add stock_consistency_check table
+
+Revision ID: 5c2e8a1f9d47
+Revises: e3a1c7d25f60
+Create Date: 2021-09-09 10:03:48.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5c2e8a1f9d47"
+down_revision = "e3a1c7d25f60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stock_consistency_check",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("lastBookingId", sa.BigInteger(), nullable=False),
+        sa.Column("dateChecked", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("stock_consistency_check")
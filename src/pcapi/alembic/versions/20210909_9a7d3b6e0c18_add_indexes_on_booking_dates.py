@@ -0,0 +1,43 @@
+"""Add indexes on booking.cancellationDate and booking.dateCreated
+
+Revision ID: 9a7d3b6e0c18
+Revises: 5c2e8a1f9d47
+Create Date: 2021-09-09 10:11:02.613490
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9a7d3b6e0c18"
+down_revision = "5c2e8a1f9d47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("COMMIT")
+    op.execute(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_booking_cancellationDate" ON booking ("cancellationDate")
+        """
+    )
+    op.execute(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_booking_dateCreated" ON booking ("dateCreated")
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("COMMIT")
+    op.execute(
+        """
+        DROP INDEX CONCURRENTLY IF EXISTS "ix_booking_dateCreated"
+        """
+    )
+    op.execute(
+        """
+        DROP INDEX CONCURRENTLY IF EXISTS "ix_booking_cancellationDate"
+        """
+    )
@@ -1,6 +1,10 @@
 import ftplib
 from io import BytesIO
+from io import TextIOWrapper
 import logging
+import tempfile
+from typing import BinaryIO
+from typing import Iterator
 from typing import Pattern
 from zipfile import ZipFile
 
@@ -25,14 +29,59 @@ def connect_to_titelive_ftp():
     return ftp_titelive
 
 
-def get_zip_file_from_ftp(zip_file_name: str, folder_name: str) -> ZipFile:
-    data_file = BytesIO()
-    data_file.name = zip_file_name
-    file_path = "RETR " + folder_name + "/" + zip_file_name
+class _SpooledDownload:
+    """A file that is kept in memory until it grows bigger than
+    ``max_size`` bytes, and is then moved to a temporary file on disk.
+
+    Unlike ``tempfile.SpooledTemporaryFile``, the returned file object
+    can be used by ``zipfile`` on Python < 3.11.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.file = BytesIO()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if isinstance(self.file, BytesIO) and self.size > self.max_size:
+            on_disk = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+            on_disk.write(self.file.getbuffer())
+            self.file = on_disk
+        self.file.write(data)
+
+
+def download_file_from_ftp(file_name: str, folder_name: str) -> BinaryIO:
+    """Download a file from the FTP of Titelive and return a file
+    object positioned at its start.
+
+    Files bigger than ``TITELIVE_FTP_SPOOL_MAX_SIZE`` bytes are spooled
+    to a temporary file on disk instead of being kept in memory.
+    """
+    download = _SpooledDownload(settings.TITELIVE_FTP_SPOOL_MAX_SIZE)
+    file_path = "RETR " + folder_name + "/" + file_name
     logger.info("Downloading file %s", file_path)
-    connect_to_titelive_ftp().retrbinary(file_path, data_file.write)
+    connect_to_titelive_ftp().retrbinary(file_path, download.write)
+    download.file.seek(0)
+    return download.file
+
+
+def get_zip_file_from_ftp(zip_file_name: str, folder_name: str) -> ZipFile:
+    data_file = download_file_from_ftp(zip_file_name, folder_name)
     # FIXME: this should be a with statement. Requires titelive sync to be rewritten
-    return ZipFile(data_file, "r")  # pylint: disable=consider-using-with
+    zip_file = ZipFile(data_file, "r")  # pylint: disable=consider-using-with
+    # Members are read from the downloaded file when they are opened,
+    # but we need the name of the file on the FTP to get its date.
+    zip_file.filename = zip_file_name
+    return zip_file
+
+
+def get_lines_from_ftp_file(file_name: str, folder_name: str, encoding: str) -> Iterator[str]:
+    """Download a text file from the FTP of Titelive and return an
+    iterator on its lines, that are decoded one by one when iterated.
+    """
+    data_file = download_file_from_ftp(file_name, folder_name)
+    return TextIOWrapper(data_file, encoding=encoding)
 
 
 def get_files_to_process_from_titelive_ftp(titelive_folder_name: str, date_regexp: Pattern[str]) -> list[str]:
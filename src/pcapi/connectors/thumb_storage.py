@@ -1,8 +1,18 @@
+import hashlib
+from typing import Optional
+
+from flask import current_app
+
 from pcapi.core import object_storage
 from pcapi.models.db import Model
 from pcapi.utils.image_conversion import standardize_image
 
 
+# Hashes of the source images of thumbs created by providers, by
+# storage id (see `HasThumbMixin.get_thumb_storage_id()`).
+REDIS_THUMB_SOURCE_HASHES_NAME = "thumbs:source-hashes"
+
+
 def create_thumb(
     model_with_thumb: Model,
     image_as_bytes: bytes,
@@ -27,3 +37,23 @@ def remove_thumb(
         bucket="thumbs",
         object_id=model_with_thumb.get_thumb_storage_id(image_index),
     )
+
+
+def get_source_hash(image_as_bytes: bytes) -> str:
+    return hashlib.sha256(image_as_bytes).hexdigest()
+
+
+def get_source_hashes(storage_ids: list[str]) -> list[Optional[str]]:
+    """Return the hash of the source image of each given thumb, or
+    None if it is not known.
+    """
+    if not storage_ids:
+        return []
+    hashes = current_app.redis_client.hmget(REDIS_THUMB_SOURCE_HASHES_NAME, storage_ids)
+    return [hash_.decode() if isinstance(hash_, bytes) else hash_ for hash_ in hashes]
+
+
+def set_source_hashes(hashes_by_storage_id: dict[str, str]) -> None:
+    if not hashes_by_storage_id:
+        return
+    current_app.redis_client.hset(REDIS_THUMB_SOURCE_HASHES_NAME, mapping=hashes_by_storage_id)
@@ -1,5 +1,6 @@
 import base64
 import datetime
+import functools
 import io
 import logging
 import typing
@@ -9,10 +10,14 @@ import pytz
 import qrcode
 import qrcode.image.svg
 
+from pcapi import settings
 from pcapi.core import search
 from pcapi.core.bookings import conf
+from pcapi.core.bookings import outbox
+from pcapi.core.bookings import repository as bookings_repository
 from pcapi.core.bookings.models import Booking
 from pcapi.core.bookings.models import BookingCancellationReasons
+from pcapi.core.bookings.models import BookingOutboxEventType
 from pcapi.core.bookings.models import BookingStatus
 from pcapi.core.bookings.models import IndividualBooking
 from pcapi.core.bookings.repository import generate_booking_token
@@ -23,10 +28,12 @@ from pcapi.core.users.external import update_external_user
 from pcapi.core.users.models import User
 from pcapi.domain import user_emails
 from pcapi.flask_app import db
+from pcapi.models.api_errors import ApiErrors
 from pcapi.models.feature import FeatureToggle
 from pcapi.repository import repository
 from pcapi.repository import transaction
 from pcapi.utils.mailing import MailServiceException
+from pcapi.workers.booking_outbox_job import process_booking_outbox_job
 from pcapi.workers.push_notification_job import send_cancel_booking_notification
 from pcapi.workers.user_emails_job import send_booking_cancellation_emails_to_user_and_offerer_job
 
@@ -44,6 +51,35 @@ QR_CODE_BOX_SIZE = 5
 QR_CODE_BOX_BORDER = 1
 
 
+def retry_on_booking_token_conflict(func: typing.Callable) -> typing.Callable:
+    """Call the decorated function again if the booking that it creates
+    could not be saved because its (random) token is already used by
+    another booking. The function must create the booking in a single
+    transaction, and have no side effect before it is committed.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except ApiErrors as error:
+                if "token" not in error.errors or attempt == conf.MAX_BOOKING_TOKEN_ATTEMPTS:
+                    raise
+                logger.warning(
+                    "Booking token is already used, trying again with another one",
+                    extra={
+                        "attempt": attempt,
+                        "token_space_occupancy": bookings_repository.estimate_token_space_occupancy(),
+                    },
+                )
+                attempt += 1
+
+    return wrapper
+
+
+@retry_on_booking_token_conflict
 def book_offer(
     beneficiary: User,
     stock_id: int,
@@ -51,7 +87,8 @@ def book_offer(
 ) -> Booking:
     """
     Return a booking or raise an exception if it's not possible.
-    Update a user's credit information on Batch.
+    E-mails and the update of the user's credit information on Batch
+    are processed asynchronously (see ``outbox``).
     """
     # The call to transaction here ensures we free the FOR UPDATE lock
     # on the stock if validation issues an exception
@@ -103,6 +140,9 @@ def book_offer(
                 booking.mark_as_used()
 
         stock.dnBookedQuantity += booking.quantity
+        # E-mails, reindexation and the update of the user in external
+        # services are processed later, outside of the request.
+        outbox.add_event(booking, BookingOutboxEventType.BOOKED)
 
         repository.save(booking, stock)
 
@@ -118,17 +158,12 @@ def book_offer(
     )
 
     try:
-        user_emails.send_booking_confirmation_email_to_offerer(booking)
-    except MailServiceException as error:
-        logger.exception("Could not send booking=%s confirmation email to offerer: %s", booking.id, error)
-    try:
-        user_emails.send_booking_confirmation_email_to_beneficiary(booking)
-    except MailServiceException as error:
-        logger.exception("Could not send booking=%s confirmation email to beneficiary: %s", booking.id, error)
-
-    search.async_index_offer_ids([stock.offerId])
-
-    update_external_user(beneficiary)
+        process_booking_outbox_job.delay()
+    except Exception as exc:  # pylint: disable=broad-except
+        if settings.IS_RUNNING_TESTS:
+            raise
+        # The event will be processed by the `pc_process_booking_outbox` cron.
+        logger.exception("Could not enqueue booking outbox job", extra={"booking": booking.id, "exc": str(exc)})
 
     return booking
 
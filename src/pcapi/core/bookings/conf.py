@@ -11,6 +11,9 @@ BOOKINGS_AUTO_EXPIRY_DELAY = datetime.timedelta(days=30)
 BOOKINGS_EXPIRY_NOTIFICATION_DELAY = datetime.timedelta(days=7)
 AUTO_USE_AFTER_EVENT_TIME_DELAY = datetime.timedelta(hours=48)
 
+BOOKING_TOKEN_LENGTH = 6
+MAX_BOOKING_TOKEN_ATTEMPTS = 5
+
 
 def _get_hours_from_timedelta(td: datetime.timedelta) -> float:
     return td.total_seconds() / 3600
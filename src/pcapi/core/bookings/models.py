@@ -14,6 +14,7 @@ from sqlalchemy import Numeric
 from sqlalchemy import String
 from sqlalchemy import and_
 from sqlalchemy import event
+from sqlalchemy import func
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import expression
@@ -60,7 +61,7 @@ class Booking(PcObject, Model):
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
 
-    dateCreated = Column(DateTime, nullable=False, default=datetime.utcnow)
+    dateCreated = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     dateUsed = Column(DateTime, nullable=True)
 
@@ -90,7 +91,7 @@ class Booking(PcObject, Model):
 
     isCancelled = Column(Boolean, nullable=False, server_default=expression.false(), default=False)
 
-    cancellationDate = Column(DateTime, nullable=True)
+    cancellationDate = Column(DateTime, nullable=True, index=True)
 
     isUsed = Column(Boolean, nullable=False, default=False, server_default=expression.false())
 
@@ -355,3 +356,31 @@ Booking.trig_update_cancellationDate_on_isCancelled_ddl = """
     """
 
 event.listen(Booking.__table__, "after_create", DDL(Booking.trig_update_cancellationDate_on_isCancelled_ddl))
+
+
+class BookingOutboxEventType(enum.Enum):
+    BOOKED = "BOOKED"
+
+
+class BookingOutboxEvent(PcObject, Model):
+    """A side effect of a booking (e-mails, reindexation of the offer,
+    update of the user in external services) that has not been
+    processed yet.
+
+    Events are inserted in the same transaction as the booking, and
+    processed later, by batches, outside of the HTTP request (see
+    ``pcapi.core.bookings.outbox``).
+    """
+
+    __tablename__ = "booking_outbox_event"
+
+    bookingId = Column(BigInteger, ForeignKey("booking.id", ondelete="CASCADE"), index=True, nullable=False)
+    booking = relationship("Booking", foreign_keys=[bookingId])
+
+    type = Column(Enum(BookingOutboxEventType, name="booking_outbox_event_type"), nullable=False)
+
+    dateCreated = Column(DateTime, nullable=False, default=datetime.utcnow, server_default=func.now())
+
+    # Set when a worker claims the event. If the worker dies before
+    # having processed it, the event is claimed again after this date.
+    lockedUntil = Column(DateTime, nullable=True)
@@ -0,0 +1,145 @@
+"""Process the side effects of bookings outside of the HTTP request.
+
+``book_offer()`` inserts a ``BookingOutboxEvent`` in the same
+transaction as the booking, so that side effects are never lost once
+the booking is committed, and never sent if it is rolled back. Events
+are then processed by ``process_booking_outbox()``, from a job that is
+enqueued after each booking and from a cron that catches up on events
+whose job could not be enqueued.
+
+Events are processed by batches: the offers of a batch are reindexed at
+once and users that have several bookings in a batch are only updated
+once in external services.
+"""
+import datetime
+import logging
+
+from sqlalchemy.orm import joinedload
+
+from pcapi import settings
+from pcapi.core import search
+from pcapi.core.bookings.models import Booking
+from pcapi.core.bookings.models import BookingOutboxEvent
+from pcapi.core.bookings.models import BookingOutboxEventType
+from pcapi.core.offers.models import Offer
+from pcapi.core.offers.models import Stock
+from pcapi.core.users.external import update_external_user
+from pcapi.domain import user_emails
+from pcapi.models.db import db
+from pcapi.utils.mailing import MailServiceException
+
+
+logger = logging.getLogger(__name__)
+
+# If a worker dies while processing a batch, its events are processed
+# again after this delay.
+CLAIM_DURATION = datetime.timedelta(minutes=10)
+
+CLAIM_EVENTS_QUERY = """
+    UPDATE booking_outbox_event
+    SET "lockedUntil" = :locked_until
+    WHERE id IN (
+        SELECT id
+        FROM booking_outbox_event
+        WHERE "lockedUntil" IS NULL OR "lockedUntil" < :now
+        ORDER BY id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+"""
+
+
+def add_event(booking: Booking, event_type: BookingOutboxEventType) -> None:
+    """Add an event to the session. It is committed along with the booking."""
+    db.session.add(BookingOutboxEvent(booking=booking, type=event_type))
+
+
+def _claim_events(batch_size: int) -> list[BookingOutboxEvent]:
+    now = datetime.datetime.utcnow()
+    rows = db.session.execute(
+        CLAIM_EVENTS_QUERY, {"now": now, "locked_until": now + CLAIM_DURATION, "batch_size": batch_size}
+    )
+    event_ids = [event_id for event_id, in rows]
+    # Commit now, so that the events stay claimed even though e-mails
+    # are saved (and committed) while the batch is processed.
+    db.session.commit()
+    if not event_ids:
+        return []
+    return (
+        BookingOutboxEvent.query.filter(BookingOutboxEvent.id.in_(event_ids))
+        .options(
+            joinedload(BookingOutboxEvent.booking).joinedload(Booking.user),
+            joinedload(BookingOutboxEvent.booking)
+            .joinedload(Booking.stock)
+            .joinedload(Stock.offer)
+            .joinedload(Offer.venue),
+        )
+        .order_by(BookingOutboxEvent.id)
+        .all()
+    )
+
+
+def _send_booking_emails(booking: Booking) -> None:
+    try:
+        user_emails.send_booking_confirmation_email_to_offerer(booking)
+    except MailServiceException as error:
+        logger.exception("Could not send booking=%s confirmation email to offerer: %s", booking.id, error)
+    try:
+        user_emails.send_booking_confirmation_email_to_beneficiary(booking)
+    except MailServiceException as error:
+        logger.exception("Could not send booking=%s confirmation email to beneficiary: %s", booking.id, error)
+
+
+def _process_batch(events: list[BookingOutboxEvent]) -> None:
+    # Sending e-mails commits the session: gather what we need first,
+    # so that objects are not loaded again for each event.
+    offer_ids = {event.booking.stock.offerId for event in events}
+    users = {event.booking.user.id: event.booking.user for event in events if event.booking.user}
+
+    for event in events:
+        try:
+            # The booking may have been cancelled since it was made: do
+            # not confirm it anymore.
+            if event.type == BookingOutboxEventType.BOOKED and not event.booking.isCancelled:
+                _send_booking_emails(event.booking)
+        except Exception as exc:  # pylint: disable=broad-except
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception(
+                "Could not process booking outbox event",
+                extra={"event": event.id, "booking": event.bookingId, "exc": str(exc)},
+            )
+
+    search.async_index_offer_ids(sorted(offer_ids))
+    for user in users.values():
+        try:
+            update_external_user(user)
+        except Exception as exc:  # pylint: disable=broad-except
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not update external user", extra={"user": user.id, "exc": str(exc)})
+
+
+def process_booking_outbox(batch_size: int = 100) -> int:
+    """Process pending events by batches, until there are none left,
+    and return the number of processed events.
+
+    Several workers may run this function concurrently: each event is
+    claimed by a single worker. Events are deleted once processed, even
+    if a side effect failed (failures are logged), so that a faulty
+    event is not processed forever.
+    """
+    processed = 0
+    while True:
+        events = _claim_events(batch_size)
+        if not events:
+            break
+        event_ids = [event.id for event in events]
+        _process_batch(events)
+        BookingOutboxEvent.query.filter(BookingOutboxEvent.id.in_(event_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        processed += len(event_ids)
+    if processed:
+        logger.info("Processed booking outbox events", extra={"count": processed})
+    return processed
@@ -34,6 +34,7 @@ from pcapi.models.db import db
 from pcapi.models.payment import Payment
 from pcapi.models.payment_status import TransactionStatus
 from pcapi.utils.date import get_department_timezone
+from pcapi.utils.token import ALPHABET
 from pcapi.utils.token import random_token
 
 
@@ -146,10 +147,6 @@ def find_bookings_eligible_for_payment_for_venue(venue_id: int, cutoff_date) ->
     )
 
 
-def token_exists(token: str) -> bool:
-    return db.session.query(Booking.query.filter_by(token=token.upper()).exists()).scalar()
-
-
 def find_not_used_and_not_cancelled() -> list[Booking]:
     return Booking.query.filter(Booking.isUsed.is_(False)).filter(Booking.isCancelled.is_(False)).all()
 
@@ -158,24 +155,6 @@ def find_used_by_token(token: str) -> Booking:
     return Booking.query.filter_by(token=token.upper(), isUsed=True).one_or_none()
 
 
-def find_expiring_bookings() -> Query:
-    today_at_midnight = datetime.combine(date.today(), time(0, 0))
-    return (
-        Booking.query.join(Stock)
-        .join(Offer)
-        .filter(
-            ~Booking.isCancelled,
-            ~Booking.isUsed,
-            (Booking.dateCreated + conf.BOOKINGS_AUTO_EXPIRY_DELAY) <= today_at_midnight,
-            Offer.canExpire,
-        )
-    )
-
-
-def find_expiring_bookings_ids() -> Query:
-    return find_expiring_bookings().order_by(Booking.id).with_entities(Booking.id)
-
-
 def find_soon_to_be_expiring_booking_ordered_by_user(given_date: date = None) -> Query:
     given_date = given_date or date.today()
     given_date = datetime.combine(given_date, time(0, 0)) + conf.BOOKINGS_EXPIRY_NOTIFICATION_DELAY
@@ -194,12 +173,24 @@ def find_soon_to_be_expiring_booking_ordered_by_user(given_date: date = None) ->
     )
 
 
-def generate_booking_token():
-    for _i in range(100):
-        token = random_token()
-        if not token_exists(token):
-            return token
-    raise ValueError("Could not generate new booking token")
+def generate_booking_token() -> str:
+    """Return a random token for a new booking.
+
+    The token is not checked against existing bookings: the unique
+    constraint on ``booking.token`` rejects duplicates, and callers
+    try again with another token (see
+    ``api.retry_on_booking_token_conflict``).
+    """
+    return random_token(conf.BOOKING_TOKEN_LENGTH)
+
+
+def estimate_token_space_occupancy() -> float:
+    """Return an estimate of the share of possible booking tokens that
+    are already used, from PostgreSQL statistics (which is much cheaper
+    than counting bookings).
+    """
+    bookings_count = db.session.execute("SELECT reltuples FROM pg_class WHERE relname = 'booking'").scalar()
+    return max(bookings_count or 0, 0) / len(ALPHABET) ** conf.BOOKING_TOKEN_LENGTH
 
 
 def find_expired_bookings_ordered_by_user(expired_on: date = None) -> Query:
@@ -213,6 +204,27 @@ def find_expired_bookings_ordered_by_user(expired_on: date = None) -> Query:
     )
 
 
+def find_by_ids_ordered_by_user(booking_ids: list[int]) -> list[Booking]:
+    return (
+        Booking.query.filter(Booking.id.in_(booking_ids))
+        .options(joinedload(Booking.user))
+        .options(joinedload(Booking.stock).joinedload(Stock.offer))
+        .order_by(Booking.userId, Booking.id)
+        .all()
+    )
+
+
+def find_by_ids_ordered_by_offerer(booking_ids: list[int]) -> list[Booking]:
+    return (
+        Booking.query.filter(Booking.id.in_(booking_ids))
+        .options(
+            joinedload(Booking.stock).joinedload(Stock.offer).joinedload(Offer.venue).joinedload(Venue.managingOfferer)
+        )
+        .order_by(Booking.offererId, Booking.id)
+        .all()
+    )
+
+
 def find_expired_bookings_ordered_by_offerer(expired_on: date = None) -> Query:
     expired_on = expired_on or date.today()
     return (
@@ -7,6 +7,7 @@ from pcapi.core import search
 from pcapi.core.bookings import models as bookings_models
 from pcapi.core.bookings import repository as bookings_repository
 from pcapi.core.bookings.api import compute_cancellation_limit_date
+from pcapi.core.bookings.api import retry_on_booking_token_conflict
 from pcapi.core.educational import exceptions
 from pcapi.core.educational import repository as educational_repository
 from pcapi.core.educational import validation
@@ -38,6 +39,7 @@ def create_redactor_from_email(redactor_email: str) -> EducationalRedactor:
     return redactor
 
 
+@retry_on_booking_token_conflict
 def book_educational_offer(redactor_email: str, uai_code: str, stock_id: int) -> EducationalBooking:
     redactor = educational_repository.find_redactor_by_email(redactor_email)
     if not redactor:
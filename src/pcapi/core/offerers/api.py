@@ -70,7 +70,7 @@ def update_venue(venue: Venue, **attrs: typing.Any) -> Venue:
     indexing_modifications_fields = set(modifications.keys()) & set(VENUE_ALGOLIA_INDEXED_FIELDS)
 
     if indexing_modifications_fields:
-        search.async_index_venue_ids([venue.id])
+        search.async_index_venue_ids([venue.id], venue_fields_only=True)
 
     return venue
 
@@ -255,7 +255,7 @@ def batch_update_offers(query, update_fields):
         query_to_update.update(update_fields, synchronize_session=False)
         db.session.commit()
 
-        search.async_index_offer_ids(offer_ids_batch)
+        search.async_index_offer_ids(offer_ids_batch, priority=search.IndexationPriority.BULK)
 
 
 def _create_stock(
@@ -628,7 +628,7 @@ def add_criteria_to_offers(criteria: list[Criterion], isbn: Optional[str] = None
     db.session.bulk_save_objects(offer_criteria)
     db.session.commit()
 
-    search.async_index_offer_ids(offer_ids)
+    search.async_index_offer_ids(offer_ids, priority=search.IndexationPriority.BULK)
 
     return True
 
@@ -659,7 +659,7 @@ def deactivate_inappropriate_products(isbn: str) -> bool:
         extra={"isbn": isbn, "products": [p.id for p in products], "offers": offer_ids},
     )
 
-    search.async_index_offer_ids(offer_ids)
+    search.async_index_offer_ids(offer_ids, priority=search.IndexationPriority.BULK)
 
     return True
 
@@ -758,19 +758,12 @@ def unindex_expired_offers(process_all_expired: bool = False):
     if process_all_expired:
         interval[0] = datetime.datetime(2000, 1, 1)  # arbitrary old date
 
-    page = 0
-    limit = settings.ALGOLIA_DELETING_OFFERS_CHUNK_SIZE
-    while True:
-        offers = offers_repository.get_expired_offers(interval)
-        offers = offers.offset(page * limit).limit(limit)
-        offer_ids = [offer_id for offer_id, in offers.with_entities(Offer.id)]
-
-        if not offer_ids:
-            break
-
+    offers = offers_repository.get_expired_offers(interval)
+    for offer_ids in offer_queries.get_offer_ids_in_batches(
+        offers, batch_size=settings.ALGOLIA_DELETING_OFFERS_CHUNK_SIZE
+    ):
         logger.info("[ALGOLIA] Found %d expired offers to unindex", len(offer_ids))
         search.unindex_offer_ids(offer_ids)
-        page += 1
 
 
 def is_activation_code_applicable(stock: Stock):
@@ -713,3 +713,20 @@ class OfferReport(PcObject, Model):
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}#{self.id} userId={self.userId}, offerId={self.offerId}, when={self.when}"
+
+
+class StockConsistencyCheck(Model):
+    """The watermark of the incremental check of ``Stock.dnBookedQuantity``
+    (see ``pcapi.core.offers.stock_consistency.check_recent_stock_consistency``).
+    This table has a single row.
+    """
+
+    __tablename__ = "stock_consistency_check"
+
+    id = Column(Integer, primary_key=True)
+
+    # Bookings created after this one have not been checked yet.
+    lastBookingId = Column(BigInteger, nullable=False)
+
+    # Bookings cancelled after this date have not been checked yet.
+    dateChecked = Column(DateTime, nullable=False)
@@ -1,6 +1,7 @@
 from datetime import datetime
 from datetime import time
 from datetime import timedelta
+from typing import Iterable
 from typing import Optional
 
 from sqlalchemy import and_
@@ -256,17 +257,42 @@ def get_and_lock_stock(stock_id: int) -> Stock:
     return stock
 
 
-def check_stock_consistency() -> list[int]:
-    return [
-        item[0]
-        for item in db.session.query(Stock.id)
+def _get_inconsistent_stock_ids_query() -> Query:
+    return (
+        db.session.query(Stock.id)
         .outerjoin(Stock.bookings)
         .group_by(Stock.id)
         .having(
             Stock.dnBookedQuantity != func.coalesce(func.sum(Booking.quantity).filter(Booking.isCancelled == False), 0)
         )
-        .all()
-    ]
+    )
+
+
+def check_stock_consistency() -> list[int]:
+    return [item[0] for item in _get_inconsistent_stock_ids_query().all()]
+
+
+def find_inconsistent_stock_ids(stock_ids: Iterable[int]) -> list[int]:
+    query = _get_inconsistent_stock_ids_query().filter(Stock.id.in_(list(stock_ids)))
+    return [item[0] for item in query.order_by(Stock.id)]
+
+
+def find_inconsistent_stock_ids_between(min_id: int, max_id: int) -> list[int]:
+    query = _get_inconsistent_stock_ids_query().filter(Stock.id.between(min_id, max_id))
+    return [item[0] for item in query.order_by(Stock.id)]
+
+
+def find_stock_ids_of_bookings_changed_since(booking_id: int, date: datetime) -> set[int]:
+    """Return the ids of stocks that have been booked after
+    ``booking_id`` or since ``date``, or whose bookings have been
+    cancelled since ``date``.
+    """
+    query = (
+        db.session.query(Booking.stockId)
+        .filter(or_(Booking.id > booking_id, Booking.dateCreated >= date, Booking.cancellationDate >= date))
+        .distinct()
+    )
+    return {stock_id for stock_id, in query}
 
 
 def find_tomorrow_event_stock_ids() -> set[int]:
@@ -0,0 +1,135 @@
+"""Check that the booked quantity of stocks (``Stock.dnBookedQuantity``)
+matches their bookings.
+
+Checking all stocks takes longer as the number of stocks grows. Instead,
+``check_recent_stock_consistency()`` only checks stocks whose bookings
+have changed since the previous check: stocks that have been booked
+since the last booking seen by the previous check (or shortly before
+it), and stocks whose bookings have been cancelled since then. This
+watermark is stored in the ``StockConsistencyCheck`` table.
+
+Other changes (e.g. a booking that is uncancelled, or a stock whose
+quantity is edited in the database) are not seen by the incremental
+check: ``check_all_stocks_consistency()`` checks all stocks, by chunks
+of ids, and should be run from time to time.
+"""
+import datetime
+import logging
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+from sqlalchemy import func
+
+from pcapi.core.bookings.api import recompute_dnBookedQuantity
+from pcapi.core.bookings.models import Booking
+from pcapi.core.offers.models import Stock
+from pcapi.core.offers.models import StockConsistencyCheck
+import pcapi.core.offers.repository as offers_repository
+from pcapi.models.db import db
+
+
+logger = logging.getLogger(__name__)
+
+# The id and the cancellation date of a booking are set before the
+# transaction is committed: a booking may be created (with an id lower
+# than the watermark) or cancelled "before" the previous check but only
+# be visible after it. Look back a bit further to catch it.
+CHECK_OVERLAP = datetime.timedelta(hours=1)
+
+
+def _get_watermark() -> Optional[StockConsistencyCheck]:
+    """Return the watermark of the previous check, or initialize it
+    (and return None) on the first run.
+    """
+    check = StockConsistencyCheck.query.one_or_none()
+    if check:
+        return check
+    # Start from now: older bookings are covered by the full check.
+    check = StockConsistencyCheck(
+        lastBookingId=db.session.query(func.coalesce(func.max(Booking.id), 0)).scalar(),
+        dateChecked=datetime.datetime.utcnow(),
+    )
+    db.session.add(check)
+    db.session.commit()
+    logger.info("Initialized stock consistency check", extra={"last_booking": check.lastBookingId})
+    return None
+
+
+def _handle_inconsistent_stocks(stock_ids: list[int], repair: bool) -> None:
+    if not stock_ids:
+        return
+    logger.error(
+        "Found inconsistent stocks: %s",
+        ", ".join(str(stock_id) for stock_id in stock_ids),
+        extra={"stocks": stock_ids, "repair": repair},
+    )
+    if repair:
+        recompute_dnBookedQuantity(stock_ids)
+
+
+def _check_chunks(chunks: Iterable, find_inconsistent: Callable[..., list[int]], repair: bool) -> list[int]:
+    inconsistent_stock_ids = []
+    for chunk in chunks:
+        stock_ids = find_inconsistent(chunk)
+        _handle_inconsistent_stocks(stock_ids, repair)
+        db.session.commit()
+        inconsistent_stock_ids.extend(stock_ids)
+    return inconsistent_stock_ids
+
+
+def check_recent_stock_consistency(repair: bool = False, batch_size: int = 1_000) -> list[int]:
+    """Check stocks whose bookings have changed since the previous
+    check, and return the ids of inconsistent stocks. If ``repair`` is
+    true, their booked quantity is computed again from bookings.
+
+    The first run only records where the next one should start.
+    """
+    started_at = datetime.datetime.utcnow()
+    check = _get_watermark()
+    if not check:
+        return []
+    last_booking_id = check.lastBookingId
+    since = check.dateChecked - CHECK_OVERLAP
+    # Read the new watermark before touched stocks, so that bookings
+    # made in-between are checked again next time.
+    new_last_booking_id = db.session.query(func.coalesce(func.max(Booking.id), last_booking_id)).scalar()
+
+    touched_stock_ids = sorted(offers_repository.find_stock_ids_of_bookings_changed_since(last_booking_id, since))
+    chunks = (touched_stock_ids[i : i + batch_size] for i in range(0, len(touched_stock_ids), batch_size))
+    inconsistent_stock_ids = _check_chunks(chunks, offers_repository.find_inconsistent_stock_ids, repair)
+
+    # Move the watermark forward, unless a concurrent check already
+    # did so (in which case both have checked the same stocks).
+    StockConsistencyCheck.query.filter(
+        StockConsistencyCheck.id == check.id,
+        StockConsistencyCheck.lastBookingId == last_booking_id,
+    ).update({"lastBookingId": new_last_booking_id, "dateChecked": started_at}, synchronize_session=False)
+    db.session.commit()
+
+    logger.info(
+        "Checked recent stock consistency",
+        extra={
+            "checked": len(touched_stock_ids),
+            "inconsistent": len(inconsistent_stock_ids),
+            "last_booking": new_last_booking_id,
+        },
+    )
+    return inconsistent_stock_ids
+
+
+def check_all_stocks_consistency(repair: bool = False, batch_size: int = 10_000) -> list[int]:
+    """Check all stocks, by chunks of ``batch_size`` ids, and return the
+    ids of inconsistent stocks. If ``repair`` is true, their booked
+    quantity is computed again from bookings.
+    """
+    max_stock_id = db.session.query(func.max(Stock.id)).scalar() or 0
+    chunks = ((start, start + batch_size - 1) for start in range(1, max_stock_id + 1, batch_size))
+    inconsistent_stock_ids = _check_chunks(
+        chunks, lambda bounds: offers_repository.find_inconsistent_stock_ids_between(*bounds), repair
+    )
+    logger.info(
+        "Checked consistency of all stocks",
+        extra={"max_stock": max_stock_id, "inconsistent": len(inconsistent_stock_ids)},
+    )
+    return inconsistent_stock_ids
@@ -1,4 +1,6 @@
+import csv
 from datetime import datetime
+import io
 import logging
 from typing import Iterable
 from typing import Optional
@@ -10,7 +12,6 @@ from pcapi.core.offers.models import Offer
 from pcapi.core.offers.models import Stock
 from pcapi.core.offers.repository import get_offers_map_by_id_at_providers
 from pcapi.core.offers.repository import get_products_map_by_id_at_providers
-from pcapi.core.offers.repository import get_stocks_by_id_at_providers
 from pcapi.core.providers.exceptions import NoSiretSpecified
 from pcapi.core.providers.exceptions import ProviderNotFound
 from pcapi.core.providers.exceptions import ProviderWithoutApiImplementation
@@ -33,6 +34,88 @@ from pcapi.validation.models.entity_validator import validate
 
 logger = logging.getLogger(__name__)
 
+# Dropped at the end of the transaction. It is truncated before use in
+# case it already exists (if `synchronize_stocks()` is called twice in
+# the same transaction, e.g. in tests).
+CREATE_PROVIDER_STOCK_TABLE_QUERY = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS provider_stock (
+      "idAtProviders" VARCHAR(70) NOT NULL,
+      "offerId" BIGINT NOT NULL,
+      quantity INTEGER NOT NULL,
+      price NUMERIC(10, 2) NOT NULL
+    ) ON COMMIT DROP
+"""
+
+COPY_PROVIDER_STOCK_QUERY = 'COPY provider_stock ("idAtProviders", "offerId", quantity, price) FROM STDIN (FORMAT csv)'
+
+UPSERT_STOCKS_QUERY = """
+    WITH existing AS (
+      SELECT
+        stock.id,
+        stock."idAtProviders",
+        stock.quantity,
+        stock.price,
+        COALESCE(SUM(booking.quantity), 0) AS booking_quantity
+      FROM stock
+      JOIN provider_stock ON provider_stock."idAtProviders" = stock."idAtProviders"
+      -- The `NOT isCancelled` condition MUST be part of the JOIN (see
+      -- `recompute_dnBookedQuantity()`).
+      LEFT OUTER JOIN booking
+        ON booking."stockId" = stock.id
+        AND NOT booking."isCancelled"
+      GROUP BY stock.id
+    ),
+    upserted AS (
+      INSERT INTO stock (
+        "idAtProviders",
+        "offerId",
+        quantity,
+        "rawProviderQuantity",
+        price,
+        "lastProviderId",
+        "dateCreated",
+        "dateModified",
+        "dateModifiedAtLastProvider"
+      )
+      SELECT
+        provider_stock."idAtProviders",
+        provider_stock."offerId",
+        provider_stock.quantity + COALESCE(existing.booking_quantity, 0),
+        provider_stock.quantity,
+        provider_stock.price,
+        CAST(:provider_id AS BIGINT),
+        :now,
+        :now,
+        :now
+      FROM provider_stock
+      LEFT OUTER JOIN existing ON existing."idAtProviders" = provider_stock."idAtProviders"
+      -- Do not create stocks that the provider does not have.
+      WHERE existing.id IS NOT NULL OR provider_stock.quantity > 0
+      ON CONFLICT ("idAtProviders") DO UPDATE
+      SET
+        quantity = EXCLUDED.quantity,
+        "rawProviderQuantity" = EXCLUDED."rawProviderQuantity",
+        price = EXCLUDED.price,
+        "lastProviderId" = EXCLUDED."lastProviderId"
+      WHERE
+        (stock.quantity, stock."rawProviderQuantity", stock.price, stock."lastProviderId")
+        IS DISTINCT FROM
+        (EXCLUDED.quantity, EXCLUDED."rawProviderQuantity", EXCLUDED.price, EXCLUDED."lastProviderId")
+      RETURNING stock.id, stock."idAtProviders", stock."offerId", stock.price
+    )
+    SELECT
+      upserted.id,
+      upserted."idAtProviders",
+      upserted."offerId",
+      upserted.price,
+      existing.id IS NULL AS is_new,
+      existing.quantity AS previous_quantity,
+      existing.price AS previous_price,
+      existing.booking_quantity
+    FROM upserted
+    LEFT OUTER JOIN existing ON existing."idAtProviders" = upserted."idAtProviders"
+"""
+
 
 def create_venue_provider(
     provider_id: int, venue_id: int, payload: VenueProviderCreationPayload = VenueProviderCreationPayload()
@@ -147,8 +230,7 @@ def synchronize_stocks(
     offers_provider_references = [stock_detail["offers_provider_reference"] for stock_detail in stock_details]
     offers_by_provider_reference = get_offers_map_by_id_at_providers(offers_provider_references)
 
-    offers_update_mapping = _get_offers_update_mapping(offers_by_provider_reference.values(), provider_id)
-    db.session.bulk_update_mappings(Offer, offers_update_mapping)
+    _update_offers_last_provider(offers_by_provider_reference.values(), provider_id)
 
     new_offers = _build_new_offers_from_stock_details(
         stock_details, offers_by_provider_reference, products_by_provider_reference, venue, provider_id
@@ -160,28 +242,59 @@ def synchronize_stocks(
     new_offers_by_provider_reference = get_offers_map_by_id_at_providers(new_offers_references)
     offers_by_provider_reference = {**offers_by_provider_reference, **new_offers_by_provider_reference}
 
-    stocks_provider_references = [stock["stocks_provider_reference"] for stock in stock_details]
-    stocks_by_provider_reference = get_stocks_by_id_at_providers(stocks_provider_references)
-    update_stock_mapping, new_stocks, offer_ids = _get_stocks_to_upsert(
-        stock_details,
-        stocks_by_provider_reference,
-        offers_by_provider_reference,
-        products_by_provider_reference,
-        provider_id,
-    )
-
-    db.session.bulk_save_objects(new_stocks)
-    db.session.bulk_update_mappings(Stock, update_stock_mapping)
+    stock_rows = _get_stock_rows_to_upsert(stock_details, offers_by_provider_reference, products_by_provider_reference)
+    upserted_stocks = _upsert_stocks(stock_rows, provider_id)
 
     db.session.commit()
 
-    search.async_index_offer_ids(offer_ids)
+    stock_rows_by_provider_reference = {row["idAtProviders"]: row for row in stock_rows}
+    offer_ids = set()
+    new_stocks_count = 0
+    for stock in upserted_stocks:
+        if stock["is_new"]:
+            new_stocks_count += 1
+            offer_ids.add(stock["offerId"])
+            continue
+        row = stock_rows_by_provider_reference[stock["idAtProviders"]]
+        # FIXME (dbaty, 2021-05-18): analyze logs to see if the
+        # provider sometimes stops sending a price after having
+        # sent a specific price before. Should we keep the
+        # possibly specific price that we have received before? Or
+        # should we override with the (generic) product price?
+        if row["isProductPrice"] and stock["previous_price"] != stock["price"]:
+            logger.warning(
+                "Stock specific price has been overriden by product price because provider price is missing",
+                extra={
+                    "stock": stock["id"],
+                    "previous_stock_price": float(stock["previous_price"]),
+                    "new_price": float(stock["price"]),
+                },
+            )
+        previous_stock = {
+            "price": stock["previous_price"],
+            "quantity": stock["previous_quantity"],
+            "booking_quantity": stock["booking_quantity"],
+        }
+        if _should_reindex_offer(row["quantity"], stock["price"], previous_stock):
+            offer_ids.add(stock["offerId"])
 
-    return {"new_offers": len(new_offers), "new_stocks": len(new_stocks), "updated_stocks": len(update_stock_mapping)}
+    search.async_index_offer_ids(offer_ids, priority=search.IndexationPriority.BULK)
 
+    return {
+        "new_offers": len(new_offers),
+        "new_stocks": new_stocks_count,
+        "updated_stocks": len(upserted_stocks) - new_stocks_count,
+    }
 
-def _get_offers_update_mapping(offer_id_list: Iterable[int], provider_id: Optional[int]) -> list[dict]:
-    return [{"id": offer_id, "lastProviderId": provider_id} for offer_id in offer_id_list]
+
+def _update_offers_last_provider(offer_ids: Iterable[int], provider_id: Optional[int]) -> None:
+    offer_ids = list(offer_ids)
+    if not offer_ids:
+        return
+    Offer.query.filter(
+        Offer.id.in_(offer_ids),
+        Offer.lastProviderId.is_distinct_from(provider_id),
+    ).update({"lastProviderId": provider_id}, synchronize_session=False)
 
 
 def _build_new_offers_from_stock_details(
@@ -215,82 +328,65 @@ def _build_new_offers_from_stock_details(
     return new_offers
 
 
-def _get_stocks_to_upsert(
+def _get_stock_rows_to_upsert(
     stock_details: list[dict],
-    stocks_by_provider_reference: dict[str, dict],
     offers_by_provider_reference: dict[str, int],
     products_by_provider_reference: dict[str, Product],
-    provider_id: Optional[int],
-) -> tuple[list[dict], list[Stock], set[int]]:
-    update_stock_mapping = []
-    new_stocks = []
-    offer_ids = set()
+) -> list[dict]:
+    rows_by_provider_reference = {}
 
     for stock_detail in stock_details:
-        stock_provider_reference = stock_detail["stocks_provider_reference"]
+        offer_id = offers_by_provider_reference.get(stock_detail["offers_provider_reference"])
+        if offer_id is None:
+            # The offer has not been created because the provider has
+            # no quantity, or because it is invalid.
+            continue
         product = products_by_provider_reference[stock_detail["products_provider_reference"]]
         book_price = stock_detail.get("price") or float(product.extraData["prix_livre"])
-        if stock_provider_reference in stocks_by_provider_reference:
-            stock = stocks_by_provider_reference[stock_provider_reference]
-
-            # FIXME (dbaty, 2021-05-18): analyze logs to see if the
-            # provider sometimes stops sending a price after having
-            # sent a specific price before. Should we keep the
-            # possibly specific price that we have received before? Or
-            # should we override with the (generic) product price?
-            if not stock_detail.get("price") and float(stock["price"]) != book_price:
-                logger.warning(
-                    "Stock specific price has been overriden by product price because provider price is missing",
-                    extra={
-                        "stock": stock["id"],
-                        "previous_stock_price": float(stock["price"]),
-                        "new_price": book_price,
-                    },
-                )
-
-            update_stock_mapping.append(
-                {
-                    "id": stock["id"],
-                    "quantity": stock_detail["available_quantity"] + stock["booking_quantity"],
-                    "rawProviderQuantity": stock_detail["available_quantity"],
-                    "price": book_price,
-                    "lastProviderId": provider_id,
-                }
-            )
-            if _should_reindex_offer(stock_detail["available_quantity"], book_price, stock):
-                offer_ids.add(offers_by_provider_reference[stock_detail["offers_provider_reference"]])
-
-        else:
-            if not stock_detail["available_quantity"]:
-                continue
-            stock = _build_stock_from_stock_detail(
-                stock_detail,
-                offers_by_provider_reference[stock_detail["offers_provider_reference"]],
-                book_price,
-                provider_id,
+        stock_provider_reference = stock_detail["stocks_provider_reference"]
+        if stock_detail["available_quantity"] < 0 or book_price < 0:
+            logger.exception(
+                "[SYNC] errors while trying to add stock or offer with ref %s: %s",
+                stock_provider_reference,
+                {"quantity": stock_detail["available_quantity"], "price": book_price},
             )
-            if not _validate_stock_or_offer(stock):
-                continue
-
-            new_stocks.append(stock)
-            offer_ids.add(stock.offerId)
-
-    return update_stock_mapping, new_stocks, offer_ids
-
-
-def _build_stock_from_stock_detail(
-    stock_detail: dict, offers_id: int, price: float, provider_id: Optional[int]
-) -> Stock:
-    return Stock(
-        quantity=stock_detail["available_quantity"],
-        rawProviderQuantity=stock_detail["available_quantity"],
-        bookingLimitDatetime=None,
-        offerId=offers_id,
-        price=price,
-        dateModified=datetime.now(),
-        idAtProviders=stock_detail["stocks_provider_reference"],
-        lastProviderId=provider_id,
-    )
+            continue
+
+        rows_by_provider_reference[stock_provider_reference] = {
+            "idAtProviders": stock_provider_reference,
+            "offerId": offer_id,
+            "quantity": stock_detail["available_quantity"],
+            "price": book_price,
+            "isProductPrice": not stock_detail.get("price"),
+        }
+
+    return list(rows_by_provider_reference.values())
+
+
+def _upsert_stocks(stock_rows: list[dict], provider_id: Optional[int]) -> list[dict]:
+    """Insert new stocks (with a quantity) and update existing stocks
+    whose quantity or price has changed, in a single statement.
+
+    Rows are first loaded with COPY into a temporary table. Existing
+    stocks that have not changed are not updated at all. Return the
+    stocks that have been inserted or updated, along with their
+    previous quantity, price and booking quantity.
+    """
+    if not stock_rows:
+        return []
+
+    db.session.execute(CREATE_PROVIDER_STOCK_TABLE_QUERY)
+    db.session.execute("TRUNCATE provider_stock")
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for row in stock_rows:
+        writer.writerow((row["idAtProviders"], row["offerId"], row["quantity"], row["price"]))
+    data.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(COPY_PROVIDER_STOCK_QUERY, data)
+
+    result = db.session.execute(UPSERT_STOCKS_QUERY, {"provider_id": provider_id, "now": datetime.utcnow()})
+    return [dict(stock) for stock in result]
 
 
 def _validate_stock_or_offer(model: Union[Offer, Stock]) -> bool:
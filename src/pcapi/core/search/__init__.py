@@ -1,14 +1,29 @@
+import contextlib
+import dataclasses
+import functools
 import logging
 from typing import Iterable
+from typing import Optional
+
+import flask
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import joinedload
 
 from pcapi import settings
+from pcapi.core.search.backends.base import IndexationPriority
 from pcapi.models import Offer
+from pcapi.models import Venue
 from pcapi.repository import offer_queries
+from pcapi.repository import venue_queries
 from pcapi.utils.module_loading import import_string
 
 
 logger = logging.getLogger(__name__)
 
+# Buffered ids are enqueued as soon as there are this many of them,
+# without waiting for the end of the HTTP request or job.
+INDEXATION_BUFFER_MAX_SIZE = 10_000
+
 
 # FIXME (dbaty, 2021-06-24): during the migration, we'll have a double
 # run with two backends on prod. Once it's done, there will be one and
@@ -18,21 +33,141 @@ logger = logging.getLogger(__name__)
 #   start with `_`);
 # - remove `backend` from "extra" log argument
 def _get_backends():
-    backend_classes = [import_string(path) for path in settings.SEARCH_BACKEND.split(",")]
-    return [backend_class() for backend_class in backend_classes]
+    # Backends are instantiated once per process (and per value of
+    # the setting, which may be overriden in tests).
+    return _instantiate_backends(settings.SEARCH_BACKEND)
+
+
+@functools.lru_cache(maxsize=None)
+def _instantiate_backends(setting: str) -> tuple:
+    backend_classes = [import_string(path) for path in setting.split(",")]
+    return tuple(backend_class() for backend_class in backend_classes)
+
+
+@dataclasses.dataclass
+class _IndexationBuffer:
+    offer_ids: dict[IndexationPriority, set[int]] = dataclasses.field(
+        default_factory=lambda: {priority: set() for priority in IndexationPriority}
+    )
+    venue_ids: set[int] = dataclasses.field(default_factory=set)
+    venue_ids_fields_only: set[int] = dataclasses.field(default_factory=set)
+
+    def __len__(self) -> int:
+        return (
+            sum(len(offer_ids) for offer_ids in self.offer_ids.values())
+            + len(self.venue_ids)
+            + len(self.venue_ids_fields_only)
+        )
+
+
+def _get_indexation_buffer() -> Optional[_IndexationBuffer]:
+    if not flask.has_app_context():
+        return None
+    return flask.g.get("search_indexation_buffer")
+
+
+def start_buffering_indexation_requests() -> bool:
+    """Buffer the ids that are given to ``async_index_offer_ids`` and
+    ``async_index_venue_ids`` until ``flush_indexation_requests`` is
+    called (or until there are ``INDEXATION_BUFFER_MAX_SIZE`` of them),
+    instead of enqueuing them right away.
+
+    The buffer lives in the current application context (i.e. the
+    current HTTP request or job). Return False if ids were already
+    being buffered: the caller must then leave the flush to whoever
+    started the buffering.
+    """
+    if not flask.has_app_context() or _get_indexation_buffer() is not None:
+        return False
+    flask.g.search_indexation_buffer = _IndexationBuffer()
+    return True
 
 
-def async_index_offer_ids(offer_ids: Iterable[int]) -> None:
+def flush_indexation_requests() -> None:
+    """Enqueue all buffered ids, with one Redis round trip per backend,
+    and stop buffering.
+    """
+    buffer = _get_indexation_buffer()
+    if buffer is None:
+        return
+    del flask.g.search_indexation_buffer
+    _enqueue_buffered_ids(buffer)
+
+
+def _flush_indexation_buffer_if_full(buffer: _IndexationBuffer) -> None:
+    # Long jobs (e.g. provider synchronizations) may request the
+    # reindexation of many offers: do not keep them all in memory, and
+    # do not wait for the end of the job to enqueue them.
+    if len(buffer) < INDEXATION_BUFFER_MAX_SIZE:
+        return
+    flask.g.search_indexation_buffer = _IndexationBuffer()
+    _enqueue_buffered_ids(buffer)
+
+
+def _enqueue_buffered_ids(buffer: _IndexationBuffer) -> None:
+    # An offer that must be reindexed in real time should not also
+    # wait in a lower priority lane.
+    already_enqueued = set()
+    offer_ids_by_priority = {}
+    for priority in IndexationPriority:
+        offer_ids_by_priority[priority] = buffer.offer_ids[priority] - already_enqueued
+        already_enqueued |= buffer.offer_ids[priority]
+    # Likewise, a full reindexation includes venue fields.
+    venue_ids_fields_only = buffer.venue_ids_fields_only - buffer.venue_ids
+    if not already_enqueued and not buffer.venue_ids and not venue_ids_fields_only:
+        return
+    for backend in _get_backends():
+        try:
+            backend.enqueue_ids(offer_ids_by_priority, buffer.venue_ids, venue_ids_fields_only)
+        except Exception:  # pylint: disable=broad-except
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception(
+                "Could not enqueue offer and venue ids to index",
+                extra={
+                    "offers": already_enqueued,
+                    "venues": buffer.venue_ids | venue_ids_fields_only,
+                    "backend": str(backend),
+                },
+            )
+
+
+@contextlib.contextmanager
+def buffered_indexation_requests():
+    """Buffer indexation requests within the block and enqueue them
+    all at once when leaving it (see
+    ``start_buffering_indexation_requests``).
+    """
+    started = start_buffering_indexation_requests()
+    try:
+        yield
+    finally:
+        if started:
+            flush_indexation_requests()
+
+
+def async_index_offer_ids(offer_ids: Iterable[int], priority: IndexationPriority = IndexationPriority.REALTIME) -> None:
     """Ask for an asynchronous reindexation of the given list of
     ``Offer.id``.
 
     This function returns quickly. The "real" reindexation will be
-    done later through a cron job.
+    done later through a cron job. Offers enqueued with the
+    ``REALTIME`` priority are processed before those that have been
+    enqueued with the ``BULK`` priority (which should be used by
+    provider synchronizations and batch updates).
+
+    Within an HTTP request or a job, ids are buffered and enqueued
+    at the end (see ``start_buffering_indexation_requests``).
     """
+    buffer = _get_indexation_buffer()
+    if buffer is not None:
+        buffer.offer_ids[priority].update(offer_ids)
+        _flush_indexation_buffer_if_full(buffer)
+        return
     backends = _get_backends()
     for backend in backends:
         try:
-            backend.enqueue_offer_ids(offer_ids)
+            backend.enqueue_offer_ids(offer_ids, priority=priority)
         except Exception:  # pylint: disable=broad-except
             if settings.IS_RUNNING_TESTS:
                 raise
@@ -41,17 +176,34 @@ def async_index_offer_ids(offer_ids: Iterable[int]) -> None:
             )
 
 
-def async_index_venue_ids(venue_ids: Iterable[int]) -> None:
+def async_index_venue_ids(venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
     """Ask for an asynchronous reindexation of the given list of
     ``Venue.id``.
 
     This function returns quickly. The "real" reindexation will be
     done later through a cron job.
+
+    If ``venue_fields_only`` is True, only the fields that come from
+    the venue (name, position, etc.) and its offerer are updated in
+    the documents of its offers, which is much faster than a full
+    reindexation (if the backend supports it). It must only be used
+    when nothing else than these fields has changed.
+
+    Within an HTTP request or a job, ids are buffered and enqueued
+    at the end (see ``start_buffering_indexation_requests``).
     """
+    buffer = _get_indexation_buffer()
+    if buffer is not None:
+        if venue_fields_only:
+            buffer.venue_ids_fields_only.update(venue_ids)
+        else:
+            buffer.venue_ids.update(venue_ids)
+        _flush_indexation_buffer_if_full(buffer)
+        return
     backends = _get_backends()
     for backend in backends:
         try:
-            backend.enqueue_venue_ids(venue_ids)
+            backend.enqueue_venue_ids(venue_ids, venue_fields_only=venue_fields_only)
         except Exception:  # pylint: disable=broad-except
             if settings.IS_RUNNING_TESTS:
                 raise
@@ -77,9 +229,15 @@ def index_offers_in_queue(stop_only_when_empty: bool = False, from_error_queue:
     If ``stop_only_when_empty`` is True (i.e. if called from the
     ``process_offers`` Flask command), we pop from the queue and stop
     only when the queue is empty.
+
+    The queue is split into lanes (see ``IndexationPriority``). Each
+    chunk is popped from the lane with the highest priority that is
+    not empty.
     """
     backends = _get_backends()
     for backend in backends:
+        if not from_error_queue:
+            _log_offer_queue_stats(backend)
         try:
             _index_offers_in_queue(
                 backend, stop_only_when_empty=stop_only_when_empty, from_error_queue=from_error_queue
@@ -101,15 +259,13 @@ def _index_offers_in_queue(backend, stop_only_when_empty: bool = False, from_err
         # 4. Cron job 2 finishes processing the batch and also deletes
         #    the first 1.000 offers from the queue. Not OK, these are
         #    not the same offers it just processed!
-        offer_ids = backend.pop_offer_ids_from_queue(
-            count=settings.REDIS_OFFER_IDS_CHUNK_SIZE, from_error_queue=from_error_queue
-        )
+        offer_ids = _pop_offer_ids_from_queue(backend, from_error_queue=from_error_queue)
         if not offer_ids:
             break
 
         logger.info("Fetched offers from indexation queue", extra={"count": len(offer_ids), "backend": str(backend)})
         try:
-            _reindex_offer_ids(backend, offer_ids)
+            skipped = _reindex_offer_ids(backend, offer_ids)
         except Exception as exc:  # pylint: disable=broad-except
             if settings.IS_RUNNING_TESTS:
                 raise
@@ -124,7 +280,12 @@ def _index_offers_in_queue(backend, stop_only_when_empty: bool = False, from_err
         else:
             logger.info(
                 "Reindexed offers from queue",
-                extra={"count": len(offer_ids), "from_error_queue": from_error_queue, "backend": str(backend)},
+                extra={
+                    "count": len(offer_ids),
+                    "skipped_unchanged": skipped,
+                    "from_error_queue": from_error_queue,
+                    "backend": str(backend),
+                },
             )
 
         left_to_process = backend.count_offers_to_index_from_queue(from_error_queue=from_error_queue)
@@ -132,8 +293,48 @@ def _index_offers_in_queue(backend, stop_only_when_empty: bool = False, from_err
             break
 
 
+def _pop_offer_ids_from_queue(backend, from_error_queue: bool) -> set[int]:
+    count = settings.REDIS_OFFER_IDS_CHUNK_SIZE
+    if from_error_queue:
+        return backend.pop_offer_ids_from_queue(count=count, from_error_queue=True)
+    for priority in IndexationPriority:
+        offer_ids = backend.pop_offer_ids_from_queue(count=count, priority=priority)
+        if offer_ids:
+            return offer_ids
+    return set()
+
+
+def get_offer_queue_stats() -> dict[str, dict]:
+    """Return the number of offers and the age (in seconds) of the
+    oldest offer in each lane of the indexation queue, for each
+    backend.
+    """
+    stats = {}
+    for backend in _get_backends():
+        try:
+            stats[str(backend)] = backend.get_offer_queue_stats()
+        except Exception:  # pylint: disable=broad-except
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not get stats of indexation queue", extra={"backend": str(backend)})
+    return stats
+
+
+def _log_offer_queue_stats(backend) -> None:
+    try:
+        stats = backend.get_offer_queue_stats()
+    except Exception:  # pylint: disable=broad-except
+        if settings.IS_RUNNING_TESTS:
+            raise
+        logger.exception("Could not get stats of indexation queue", extra={"backend": str(backend)})
+        return
+    logger.info("Indexation queue stats", extra={"lanes": stats, "backend": str(backend)})
+
+
 def index_venues_in_queue():
-    """Pop venues from indexation queue and reindex their offers."""
+    """Pop venues from indexation queues and reindex their offers
+    (fully or only venue fields).
+    """
     backends = _get_backends()
     for backend in backends:
         try:
@@ -142,26 +343,51 @@ def index_venues_in_queue():
             if settings.IS_RUNNING_TESTS:
                 raise
             logger.exception("Could not index venues from queue", extra={"backend": str(backend)})
+        try:
+            _update_venue_fields_in_queue(backend)
+        except Exception:  # pylint: disable=broad-except
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not update venue fields from queue", extra={"backend": str(backend)})
 
 
 def _index_venues_in_queue(backend):
     venue_ids = backend.get_venue_ids_from_queue(count=settings.REDIS_VENUE_IDS_CHUNK_SIZE)
     for venue_id in venue_ids:
-        page = 0
+        skipped = 0
         logger.info("Starting to index offers of venue", extra={"venue": venue_id, "backend": str(backend)})
-        while True:
-            offer_ids = offer_queries.get_paginated_offer_ids_by_venue_id(
-                limit=settings.ALGOLIA_OFFERS_BY_VENUE_CHUNK_SIZE, page=page, venue_id=venue_id
-            )
-            if not offer_ids:
-                break
-            _reindex_offer_ids(backend, offer_ids)
-            page += 1
-        logger.info("Finished indexing offers of venue", extra={"venue": venue_id, "backend": str(backend)})
+        for offer_ids in offer_queries.get_offer_ids_by_venue_id_in_batches(
+            venue_id, batch_size=settings.ALGOLIA_OFFERS_BY_VENUE_CHUNK_SIZE
+        ):
+            skipped += _reindex_offer_ids(backend, offer_ids)
+        logger.info(
+            "Finished indexing offers of venue",
+            extra={"venue": venue_id, "skipped_unchanged": skipped, "backend": str(backend)},
+        )
 
     backend.delete_venue_ids_from_queue(venue_ids)
 
 
+def _update_venue_fields_in_queue(backend):
+    venue_ids = backend.get_venue_ids_from_queue(
+        count=settings.REDIS_VENUE_IDS_CHUNK_SIZE,
+        venue_fields_only=True,
+    )
+    if not venue_ids:
+        return
+    for venue in venue_queries.get_indexed_fields_by_ids(venue_ids):
+        logger.info("Starting to update venue fields of offers", extra={"venue": venue.id, "backend": str(backend)})
+        # Inactive offers are not indexed, no need to update them.
+        query = Offer.query.filter(Offer.venueId == venue.id, Offer.isActive == True)
+        for offer_ids in offer_queries.get_offer_ids_in_batches(
+            query, batch_size=settings.ALGOLIA_OFFERS_BY_VENUE_CHUNK_SIZE
+        ):
+            backend.update_venue_fields(venue, offer_ids)
+        logger.info("Finished updating venue fields of offers", extra={"venue": venue.id, "backend": str(backend)})
+
+    backend.delete_venue_ids_from_queue(venue_ids, venue_fields_only=True)
+
+
 def reindex_offer_ids(offer_ids: Iterable[int]):
     """Given a list of `Offer.id`, reindex or unindex each offer
     (i.e. request the external indexation service an update or a
@@ -181,13 +407,31 @@ def reindex_offer_ids(offer_ids: Iterable[int]):
             logger.exception("Could not reindex offers", extra={"offers": offer_ids, "backend": str(backend)})
 
 
-def _reindex_offer_ids(backend, offer_ids: Iterable[int]):
+def get_base_query_for_offer_indexation() -> Query:
+    """Return a query that loads offers along with everything that is
+    needed to serialize them (stocks, venue, offerer, criteria,
+    mediations and product).
+
+    That way, serializing a chunk of offers costs a single SQL query,
+    instead of multiple queries for each offer.
+    """
+    return (
+        Offer.query.options(joinedload(Offer.venue).joinedload(Venue.managingOfferer))
+        .options(joinedload(Offer.criteria))
+        .options(joinedload(Offer.mediations))
+        .options(joinedload(Offer.product))
+        .options(joinedload(Offer.stocks))
+    )
+
+
+def _reindex_offer_ids(backend, offer_ids: Iterable[int]) -> int:
+    """Reindex or unindex the given offers and return the number of
+    offers that have been skipped because their document has not
+    changed since the last indexation.
+    """
     to_add = []
     to_delete = []
-    # FIXME (dbaty, 2021-07-05): join-load Stock, Venue, Offerer,
-    # etc. to avoid N+1 queries on each offer. See related comment in
-    # test_serialize_appsearch:test_check_number_of_sql_queries
-    offers = Offer.query.filter(Offer.id.in_(offer_ids))
+    offers = get_base_query_for_offer_indexation().filter(Offer.id.in_(offer_ids))
     for offer in offers:
         if offer and offer.isBookable:
             to_add.append(offer)
@@ -203,8 +447,9 @@ def _reindex_offer_ids(backend, offer_ids: Iterable[int]):
             )
 
     # Handle new or updated available offers
+    skipped = 0
     try:
-        backend.index_offers(to_add)
+        skipped = backend.index_offers(to_add)
     except Exception as exc:  # pylint: disable=broad-except
         if settings.IS_RUNNING_TESTS:
             raise
@@ -228,6 +473,8 @@ def _reindex_offer_ids(backend, offer_ids: Iterable[int]):
         )
         backend.enqueue_offer_ids_in_error([offer.id for offer in to_delete])
 
+    return skipped
+
 
 def unindex_offer_ids(offer_ids: Iterable[int]):
     backends = _get_backends()
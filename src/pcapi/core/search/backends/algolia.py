@@ -1,5 +1,6 @@
 import logging
 from typing import Iterable
+from typing import Optional
 
 import algoliasearch.search_client
 from flask import current_app
@@ -15,15 +16,25 @@ from pcapi.utils.human_ids import humanize
 logger = logging.getLogger(__name__)
 
 REDIS_LIST_OFFER_IDS_NAME = "offer_ids"
+REDIS_LIST_BULK_OFFER_IDS_NAME = "offer_ids:bulk"
 REDIS_LIST_OFFER_IDS_IN_ERROR_NAME = "offer_ids_in_error"
 REDIS_LIST_VENUE_IDS_NAME = "venue_ids"
+# This hashmap holds the fingerprint of the last indexed document of
+# each offer (see `SearchBackend.filter_unchanged_documents()`).
 REDIS_HASHMAP_INDEXED_OFFERS_NAME = "indexed_offers"
 
+REDIS_LIST_OFFER_IDS_NAMES = {
+    base.IndexationPriority.REALTIME: REDIS_LIST_OFFER_IDS_NAME,
+    base.IndexationPriority.BULK: REDIS_LIST_BULK_OFFER_IDS_NAME,
+}
+
 DEFAULT_LONGITUDE_FOR_NUMERIC_OFFER = 2.409289
 DEFAULT_LATITUDE_FOR_NUMERIC_OFFER = 47.158459
 
 
 class AlgoliaBackend(base.SearchBackend):
+    redis_fingerprints_name = REDIS_HASHMAP_INDEXED_OFFERS_NAME
+
     def __init__(self):
         super().__init__()
         client = algoliasearch.search_client.SearchClient.create(
@@ -32,11 +43,13 @@ class AlgoliaBackend(base.SearchBackend):
         self.algolia_client = client.init_index(settings.ALGOLIA_INDEX_NAME)
         self.redis_client = current_app.redis_client
 
-    def enqueue_offer_ids(self, offer_ids: Iterable[int]) -> None:
+    def enqueue_offer_ids(
+        self, offer_ids: Iterable[int], priority: base.IndexationPriority = base.IndexationPriority.REALTIME
+    ) -> None:
         if not offer_ids:
             return
         try:
-            self.redis_client.rpush(REDIS_LIST_OFFER_IDS_NAME, *offer_ids)
+            self.redis_client.rpush(REDIS_LIST_OFFER_IDS_NAMES[priority], *offer_ids)
         except redis.exceptions.RedisError:
             if settings.IS_RUNNING_TESTS:
                 raise
@@ -52,7 +65,9 @@ class AlgoliaBackend(base.SearchBackend):
                 raise
             logger.exception("Could not add offers to error queue", extra={"offers": offer_ids})
 
-    def enqueue_venue_ids(self, venue_ids: Iterable[int]) -> None:
+    # Partial updates are not supported: venues are always fully
+    # reindexed, whatever the value of `venue_fields_only`.
+    def enqueue_venue_ids(self, venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
         if not venue_ids:
             return
         try:
@@ -62,7 +77,38 @@ class AlgoliaBackend(base.SearchBackend):
                 raise
             logger.exception("Could not add venues to indexation queue", extra={"venues": venue_ids})
 
-    def pop_offer_ids_from_queue(self, count: int, from_error_queue: bool = False) -> set[int]:
+    def enqueue_ids(
+        self,
+        offer_ids_by_priority: dict[base.IndexationPriority, Iterable[int]],
+        venue_ids: Iterable[int],
+        venue_ids_fields_only: Iterable[int] = (),
+    ) -> None:
+        venue_ids = set(venue_ids) | set(venue_ids_fields_only)
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for priority, offer_ids in offer_ids_by_priority.items():
+            if offer_ids:
+                pipeline.rpush(REDIS_LIST_OFFER_IDS_NAMES[priority], *offer_ids)
+        if venue_ids:
+            pipeline.rpush(REDIS_LIST_VENUE_IDS_NAME, *venue_ids)
+        try:
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception(
+                "Could not add offers and venues to indexation queues",
+                extra={
+                    "offers": [offer_id for offer_ids in offer_ids_by_priority.values() for offer_id in offer_ids],
+                    "venues": venue_ids,
+                },
+            )
+
+    def pop_offer_ids_from_queue(
+        self,
+        count: int,
+        from_error_queue: bool = False,
+        priority: base.IndexationPriority = base.IndexationPriority.REALTIME,
+    ) -> set[int]:
         # Here we should use `LPOP` but its `count` argument has been
         # added in Redis 6.2. GCP currently has an earlier version of
         # Redis (5.0), where we can pop only one item at once. As a
@@ -77,7 +123,7 @@ class AlgoliaBackend(base.SearchBackend):
         if from_error_queue:
             redis_list_name = REDIS_LIST_OFFER_IDS_IN_ERROR_NAME
         else:
-            redis_list_name = REDIS_LIST_OFFER_IDS_NAME
+            redis_list_name = REDIS_LIST_OFFER_IDS_NAMES[priority]
 
         offer_ids = set()
         try:
@@ -94,7 +140,9 @@ class AlgoliaBackend(base.SearchBackend):
             pipeline.reset()
         return offer_ids
 
-    def get_venue_ids_from_queue(self, count: int) -> set[int]:
+    def get_venue_ids_from_queue(self, count: int, venue_fields_only: bool = False) -> set[int]:
+        if venue_fields_only:  # see `enqueue_venue_ids()`
+            return set()
         try:
             venue_ids = self.redis_client.lrange(REDIS_LIST_VENUE_IDS_NAME, 0, count - 1)
             return {int(venue_id) for venue_id in venue_ids}  # str -> int
@@ -104,8 +152,8 @@ class AlgoliaBackend(base.SearchBackend):
             logger.exception("Could not get venue ids to index from queue")
             return set()
 
-    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int]) -> None:
-        if not venue_ids:
+    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
+        if not venue_ids or venue_fields_only:
             return
         try:
             for venue_id in venue_ids:
@@ -116,19 +164,31 @@ class AlgoliaBackend(base.SearchBackend):
                 raise
             logger.exception("Could not delete indexed venue ids from queue")
 
-    def count_offers_to_index_from_queue(self, from_error_queue: bool = False) -> int:
+    def count_offers_to_index_from_queue(
+        self, from_error_queue: bool = False, priority: Optional[base.IndexationPriority] = None
+    ) -> int:
         if from_error_queue:
-            redis_list_name = REDIS_LIST_OFFER_IDS_IN_ERROR_NAME
+            redis_list_names = [REDIS_LIST_OFFER_IDS_IN_ERROR_NAME]
+        elif priority:
+            redis_list_names = [REDIS_LIST_OFFER_IDS_NAMES[priority]]
         else:
-            redis_list_name = REDIS_LIST_OFFER_IDS_NAME
+            redis_list_names = list(REDIS_LIST_OFFER_IDS_NAMES.values())
         try:
-            return self.redis_client.llen(redis_list_name)
+            return sum(self.redis_client.llen(redis_list_name) for redis_list_name in redis_list_names)
         except redis.exceptions.RedisError:
             if settings.IS_RUNNING_TESTS:
                 raise
             logger.exception("Could not count offers left to index from queue")
             return 0
 
+    def get_offer_queue_stats(self) -> dict[str, dict]:
+        # Lists do not hold the date at which offers have been
+        # enqueued, so we cannot tell the age of the oldest offer.
+        return {
+            priority.value: {"count": self.count_offers_to_index_from_queue(priority=priority), "oldest_age": None}
+            for priority in base.IndexationPriority
+        }
+
     def check_offer_is_indexed(self, offer: offers_models.Offer) -> bool:
         try:
             return self.redis_client.hexists(REDIS_HASHMAP_INDEXED_OFFERS_NAME, offer.id)
@@ -142,49 +202,25 @@ class AlgoliaBackend(base.SearchBackend):
             # cache so that we do perform a request to Algolia.
             return True
 
-    def index_offers(self, offers: Iterable[offers_models.Offer]) -> None:
+    def index_offers(self, offers: Iterable[offers_models.Offer], skip_unchanged: bool = True) -> int:
         if not offers:
-            return
-        objects = [self.serialize_offer(offer) for offer in offers]
-        self.algolia_client.save_objects(objects)
-        try:
-            # We used to store a summary of each offer, which is why
-            # we used hashmap and not a set. But since we don't need
-            # the value anymore, we can store the lightest object
-            # possible to make Redis use less memory. In the future,
-            # we may even remove the hashmap if it's not proven useful
-            # (see log in reindex_offer_ids)
-            offer_ids = [offer.id for offer in offers]
-            pipeline = self.redis_client.pipeline(transaction=True)
-            for offer_id in offer_ids:
-                pipeline.hset(REDIS_HASHMAP_INDEXED_OFFERS_NAME, offer_id, "")
-            pipeline.execute()
-        except Exception:  # pylint: disable=broad-except
-            logger.exception("Could not add to list of indexed offers", extra={"offers": offer_ids})
-        finally:
-            pipeline.reset()
+            return 0
+        documents = {offer.id: self.serialize_offer(offer) for offer in offers}
+        to_index, fingerprints = self.filter_unchanged_documents(documents, skip_unchanged=skip_unchanged)
+        if to_index:
+            self.algolia_client.save_objects(list(to_index.values()))
+            self.store_document_fingerprints(fingerprints)
+        return len(documents) - len(to_index)
 
     def unindex_offer_ids(self, offer_ids: Iterable[int]) -> None:
         if not offer_ids:
             return
         self.algolia_client.delete_objects(offer_ids)
-        try:
-            self.redis_client.hdel(REDIS_HASHMAP_INDEXED_OFFERS_NAME, *offer_ids)
-        except redis.exceptions.RedisError:
-            if settings.IS_RUNNING_TESTS:
-                raise
-            logger.exception("Could not remove offers from indexed offers set", extra={"offers": offer_ids})
+        self.delete_document_fingerprints(offer_ids)
 
     def unindex_all_offers(self) -> None:
         self.algolia_client.clear_objects()
-        try:
-            self.redis_client.delete(REDIS_HASHMAP_INDEXED_OFFERS_NAME)
-        except redis.exceptions.RedisError:
-            if settings.IS_RUNNING_TESTS:
-                raise
-            logger.exception(
-                "Could not clear indexed offers cache",
-            )
+        self.delete_all_document_fingerprints()
 
     @classmethod
     def serialize_offer(cls, offer: offers_models.Offer) -> dict:
@@ -1,12 +1,16 @@
+import concurrent.futures
 import datetime
 import decimal
 import json
 import logging
+import time
 from typing import Iterable
+from typing import Optional
 import urllib.parse
 
 from flask import current_app
 import redis
+from requests.adapters import HTTPAdapter
 
 from pcapi import settings
 import pcapi.core.offers.models as offers_models
@@ -16,9 +20,21 @@ import pcapi.utils.date as date_utils
 from . import base
 
 
-REDIS_OFFER_IDS_TO_INDEX = "search:appsearch:offer-ids-to-index"
+# Offers to index are stored in sorted sets (one per priority lane),
+# scored by the timestamp at which they have been enqueued.
+REDIS_OFFER_IDS_TO_INDEX = {
+    base.IndexationPriority.REALTIME: "search:appsearch:offer-ids-to-index:realtime",
+    base.IndexationPriority.BULK: "search:appsearch:offer-ids-to-index:bulk",
+}
+# FIXME: remove once this queue (a plain set, used before priority
+# lanes were introduced) has been drained in all environments. Until
+# then, it is popped as part of the realtime lane.
+REDIS_LEGACY_OFFER_IDS_TO_INDEX = "search:appsearch:offer-ids-to-index"
 REDIS_OFFER_IDS_IN_ERROR_TO_INDEX = "search:appsearch:offer-ids-in-error-to-index"
 REDIS_VENUE_IDS_TO_INDEX = "search:appsearch:venue-ids-to-index"
+# Venues whose offers only need an update of venue-related fields.
+REDIS_VENUE_IDS_TO_PARTIALLY_INDEX = "search:appsearch:venue-ids-to-partially-index"
+REDIS_INDEXED_OFFER_FINGERPRINTS = "search:appsearch:indexed-offer-fingerprints"
 
 ENGINE_NAME = "offers"
 ENGINE_LANGUAGE = "fr"
@@ -93,22 +109,75 @@ def url_path(url):
     return path
 
 
+def _get_venue_queue_name(venue_fields_only: bool) -> str:
+    return REDIS_VENUE_IDS_TO_PARTIALLY_INDEX if venue_fields_only else REDIS_VENUE_IDS_TO_INDEX
+
+
+def serialize_venue_fields(
+    name: str,
+    public_name: Optional[str],
+    latitude: Optional[decimal.Decimal],
+    longitude: Optional[decimal.Decimal],
+    department_code: Optional[str],
+    offerer_name: str,
+) -> dict:
+    if longitude is not None and latitude is not None:
+        # It's important to send the position as text, not as an
+        # array of floats. That way, App Search includes the field
+        # in search results (even though the documentation says
+        # that `geolocation` fields are not included).
+        position = f"{latitude},{longitude}"
+    else:
+        position = None
+    return {
+        "offerer_name": offerer_name,
+        "venue_department_code": department_code,
+        "venue_name": name,
+        "venue_position": position,
+        "venue_public_name": public_name,
+    }
+
+
 def get_batches(iterable, size=1):
     for i in range(0, len(iterable), size):
         yield iterable[i : i + size]
 
 
+class AppSearchPushError(Exception):
+    """Raised when one or more batches of documents could not be sent
+    to App Search. Other batches may have been successfully sent.
+    """
+
+    def __init__(self, failed_ids: list, errors: list[str]):
+        self.failed_ids = failed_ids
+        self.errors = errors
+        super().__init__(f"{len(errors)} batch(es) could not be sent to App Search")
+
+
 class AppSearchBackend(base.SearchBackend):
+    redis_fingerprints_name = REDIS_INDEXED_OFFER_FINGERPRINTS
+
     def __init__(self):
         super().__init__()
-        self.appsearch_client = AppSearchApiClient(host=settings.APPSEARCH_HOST, api_key=settings.APPSEARCH_API_KEY)
+        self.appsearch_client = AppSearchApiClient(
+            host=settings.APPSEARCH_HOST,
+            api_key=settings.APPSEARCH_API_KEY,
+            max_concurrent_requests=settings.APPSEARCH_MAX_CONCURRENT_REQUESTS,
+        )
         self.redis_client = current_app.redis_client
 
-    def enqueue_offer_ids(self, offer_ids: Iterable[int]):
+    def enqueue_offer_ids(
+        self, offer_ids: Iterable[int], priority: base.IndexationPriority = base.IndexationPriority.REALTIME
+    ):
         if not offer_ids:
             return
+        now = time.time()
         try:
-            self.redis_client.sadd(REDIS_OFFER_IDS_TO_INDEX, *offer_ids)
+            # Do not update the score of offers that are already in
+            # the queue, so that we keep track of the oldest request.
+            self.redis_client.zadd(
+                REDIS_OFFER_IDS_TO_INDEX[priority], {offer_id: now for offer_id in offer_ids}, nx=True
+            )
         except redis.exceptions.RedisError:
             logger.exception("Could not add offers to indexation queue", extra={"offers": offer_ids})
 
@@ -120,55 +189,110 @@ class AppSearchBackend(base.SearchBackend):
         except redis.exceptions.RedisError:
             logger.exception("Could not add offers to error queue", extra={"offers": offer_ids})
 
-    def enqueue_venue_ids(self, venue_ids: Iterable[int]):
+    def enqueue_venue_ids(self, venue_ids: Iterable[int], venue_fields_only: bool = False):
         if not venue_ids:
             return
         try:
-            self.redis_client.sadd(REDIS_VENUE_IDS_TO_INDEX, *venue_ids)
+            self.redis_client.sadd(_get_venue_queue_name(venue_fields_only), *venue_ids)
         except redis.exceptions.RedisError:
             logger.exception("Could not add venues to indexation queue", extra={"venues": venue_ids})
 
-    def pop_offer_ids_from_queue(self, count: int, from_error_queue: bool = False) -> set[int]:
-        if from_error_queue:
-            redis_set_name = REDIS_OFFER_IDS_IN_ERROR_TO_INDEX
-        else:
-            redis_set_name = REDIS_OFFER_IDS_TO_INDEX
-
+    def enqueue_ids(
+        self,
+        offer_ids_by_priority: dict[base.IndexationPriority, Iterable[int]],
+        venue_ids: Iterable[int],
+        venue_ids_fields_only: Iterable[int] = (),
+    ):
+        now = time.time()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for priority, offer_ids in offer_ids_by_priority.items():
+            if offer_ids:
+                pipeline.zadd(REDIS_OFFER_IDS_TO_INDEX[priority], {offer_id: now for offer_id in offer_ids}, nx=True)
+        if venue_ids:
+            pipeline.sadd(REDIS_VENUE_IDS_TO_INDEX, *venue_ids)
+        if venue_ids_fields_only:
+            pipeline.sadd(REDIS_VENUE_IDS_TO_PARTIALLY_INDEX, *venue_ids_fields_only)
+        try:
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            logger.exception(
+                "Could not add offers and venues to indexation queues",
+                extra={
+                    "offers": [offer_id for offer_ids in offer_ids_by_priority.values() for offer_id in offer_ids],
+                    "venues": list(venue_ids) + list(venue_ids_fields_only),
+                },
+            )
+
+    def pop_offer_ids_from_queue(
+        self,
+        count: int,
+        from_error_queue: bool = False,
+        priority: base.IndexationPriority = base.IndexationPriority.REALTIME,
+    ) -> set[int]:
         try:
-            offer_ids = self.redis_client.spop(redis_set_name, count)
+            if from_error_queue:
+                offer_ids = self.redis_client.spop(REDIS_OFFER_IDS_IN_ERROR_TO_INDEX, count)
+            else:
+                offer_ids = []
+                if priority == base.IndexationPriority.REALTIME:
+                    offer_ids = self.redis_client.spop(REDIS_LEGACY_OFFER_IDS_TO_INDEX, count)
+                if not offer_ids:
+                    # Pop the oldest offers first.
+                    items = self.redis_client.zpopmin(REDIS_OFFER_IDS_TO_INDEX[priority], count)
+                    offer_ids = [offer_id for offer_id, _score in items]
             return {int(offer_id) for offer_id in offer_ids}  # str -> int
         except redis.exceptions.RedisError:
             logger.exception("Could not pop offer ids to index from queue")
             return []
 
-    def get_venue_ids_from_queue(self, count: int) -> set[int]:
+    def get_venue_ids_from_queue(self, count: int, venue_fields_only: bool = False) -> set[int]:
         try:
-            venue_ids = self.redis_client.srandmember(REDIS_VENUE_IDS_TO_INDEX, count)
+            venue_ids = self.redis_client.srandmember(_get_venue_queue_name(venue_fields_only), count)
             return {int(venue_id) for venue_id in venue_ids}  # str -> int
         except redis.exceptions.RedisError:
             logger.exception("Could not get venue ids to index from queue")
             return set()
 
-    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int]) -> None:
+    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
         if not venue_ids:
             return
         try:
-            self.redis_client.srem(REDIS_VENUE_IDS_TO_INDEX, *venue_ids)
+            self.redis_client.srem(_get_venue_queue_name(venue_fields_only), *venue_ids)
         except redis.exceptions.RedisError:
             logger.exception("Could not delete indexed venue ids from queue")
 
-    def count_offers_to_index_from_queue(self, from_error_queue: bool = False) -> int:
-        if from_error_queue:
-            redis_set_name = REDIS_OFFER_IDS_IN_ERROR_TO_INDEX
-        else:
-            redis_set_name = REDIS_OFFER_IDS_TO_INDEX
-
+    def count_offers_to_index_from_queue(
+        self, from_error_queue: bool = False, priority: Optional[base.IndexationPriority] = None
+    ) -> int:
         try:
-            return self.redis_client.scard(redis_set_name)
+            if from_error_queue:
+                return self.redis_client.scard(REDIS_OFFER_IDS_IN_ERROR_TO_INDEX)
+            legacy_count = 0
+            if priority in (None, base.IndexationPriority.REALTIME):
+                legacy_count = self.redis_client.scard(REDIS_LEGACY_OFFER_IDS_TO_INDEX)
+            if priority:
+                return legacy_count + self.redis_client.zcard(REDIS_OFFER_IDS_TO_INDEX[priority])
+            return legacy_count + sum(
+                self.redis_client.zcard(redis_set_name) for redis_set_name in REDIS_OFFER_IDS_TO_INDEX.values()
+            )
         except redis.exceptions.RedisError:
             logger.exception("Could not count offers left to index from queue")
             return 0
 
+    def get_offer_queue_stats(self) -> dict[str, dict]:
+        now = time.time()
+        stats = {}
+        for priority, redis_set_name in REDIS_OFFER_IDS_TO_INDEX.items():
+            try:
+                count = self.redis_client.zcard(redis_set_name)
+                oldest = self.redis_client.zrange(redis_set_name, 0, 0, withscores=True)
+            except redis.exceptions.RedisError:
+                logger.exception("Could not get stats of indexation queue", extra={"priority": priority.value})
+                continue
+            oldest_age = round(now - oldest[0][1]) if oldest else None
+            stats[priority.value] = {"count": count, "oldest_age": oldest_age}
+        return stats
+
     def check_offer_is_indexed(self, offer: offers_models.Offer) -> bool:
         # FIXME (dbaty, 2021-07-15): this is a no-op on App Search.
         # Once we have removed the Algolia backend, we can remove this
@@ -179,19 +303,65 @@ class AppSearchBackend(base.SearchBackend):
         # good idea.
         return True
 
-    def index_offers(self, offers: Iterable[offers_models.Offer]) -> None:
+    def index_offers(self, offers: Iterable[offers_models.Offer], skip_unchanged: bool = True) -> int:
         if not offers:
-            return
-        documents = [self.serialize_offer(offer) for offer in offers]
-        self.appsearch_client.create_or_update_documents(documents)
+            return 0
+        documents = {offer.id: self.serialize_offer(offer) for offer in offers}
+        to_index, fingerprints = self.filter_unchanged_documents(documents, skip_unchanged=skip_unchanged)
+        try:
+            self.appsearch_client.create_or_update_documents(list(to_index.values()))
+        except AppSearchPushError as exc:
+            logger.warning(
+                "Could not reindex some offers, will automatically retry",
+                extra={"errors": exc.errors, "offers": exc.failed_ids},
+            )
+            self.enqueue_offer_ids_in_error(exc.failed_ids)
+            for offer_id in exc.failed_ids:
+                fingerprints.pop(offer_id, None)
+        self.store_document_fingerprints(fingerprints)
+        return len(documents) - len(to_index)
 
     def unindex_offer_ids(self, offer_ids: Iterable[int]) -> None:
         if not offer_ids:
             return
-        self.appsearch_client.delete_documents(offer_ids)
+        try:
+            self.appsearch_client.delete_documents(offer_ids)
+        except AppSearchPushError as exc:
+            logger.warning(
+                "Could not unindex some offers, will automatically retry",
+                extra={"errors": exc.errors, "offers": exc.failed_ids},
+            )
+            self.enqueue_offer_ids_in_error(exc.failed_ids)
+        self.delete_document_fingerprints(offer_ids)
+
+    def update_venue_fields(self, venue, offer_ids: Iterable[int]) -> None:
+        if not offer_ids:
+            return
+        fields = serialize_venue_fields(
+            name=venue.name,
+            public_name=venue.publicName,
+            latitude=venue.latitude,
+            longitude=venue.longitude,
+            department_code=venue.departementCode,
+            offerer_name=venue.offererName,
+        )
+        try:
+            self.appsearch_client.update_documents([{"id": offer_id, **fields} for offer_id in offer_ids])
+        except AppSearchPushError as exc:
+            logger.warning(
+                "Could not update venue fields of some offers, will automatically retry",
+                extra={"errors": exc.errors, "offers": exc.failed_ids, "venue": venue.id},
+            )
+            self.enqueue_offer_ids_in_error(exc.failed_ids)
+        # Stored fingerprints have been computed from full documents
+        # that do not match the indexed documents anymore (or, on
+        # failure, that may hold outdated venue fields): make sure that
+        # the next full push of these offers is not skipped.
+        self.delete_document_fingerprints(offer_ids)
 
     def unindex_all_offers(self) -> None:
         self.appsearch_client.delete_all_documents()
+        self.delete_all_document_fingerprints()
 
     def serialize_offer(self, offer: offers_models.Offer) -> dict:
         stocks = offer.bookableStocks
@@ -213,15 +383,6 @@ class AppSearchBackend(base.SearchBackend):
         artist = " ".join(extra_data.get(key, "") for key in ("author", "performer", "speaker", "stageDirector"))
 
         venue = offer.venue
-        if venue.longitude is not None and venue.latitude is not None:
-            # It's important to send the position as text, not as an
-            # array of floats. That way, App Search includes the field
-            # in search results (even though the documentation says
-            # that `geolocation` fields are not included).
-            position = f"{venue.latitude},{venue.longitude}"
-        else:
-            position = None
-
         return {
             "subcategory_label": offer.subcategory.app_label,
             "artist": artist.strip() or None,
@@ -245,19 +406,36 @@ class AppSearchBackend(base.SearchBackend):
             "tags": [criterion.name for criterion in offer.criteria],
             "times": times,
             "thumb_url": url_path(offer.thumbUrl),
-            "offerer_name": venue.managingOfferer.name,
-            "venue_department_code": venue.departementCode,
             "venue_id": venue.id,
-            "venue_name": venue.name,
-            "venue_position": position,
-            "venue_public_name": venue.publicName,
+            **serialize_venue_fields(
+                name=venue.name,
+                public_name=venue.publicName,
+                latitude=venue.latitude,
+                longitude=venue.longitude,
+                department_code=venue.departementCode,
+                offerer_name=venue.managingOfferer.name,
+            ),
         }
 
 
 class AppSearchApiClient:
-    def __init__(self, host: str, api_key: str):
+    def __init__(self, host: str, api_key: str, max_concurrent_requests: int = 1):
         self.host = host.rstrip("/")
         self.api_key = api_key
+        self.max_concurrent_requests = max(max_concurrent_requests, 1)
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        # A single session is used for all requests sent to the host,
+        # so that connections are kept alive between batches. The
+        # pool is large enough to hold one connection per request in
+        # flight.
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrent_requests)
+            self._session.mount(self.host, adapter)
+        return self._session
 
     @property
     def headers(self):
@@ -302,27 +480,84 @@ class AppSearchApiClient:
         path = f"/api/as/v1/engines/{ENGINE_NAME}/documents"
         return f"{self.host}{path}"
 
-    def create_or_update_documents(self, documents: Iterable[dict]):
-        # Error handling is done by the caller.
-        for batch in get_batches(documents, size=DOCUMENTS_PER_REQUEST_LIMIT):
+    def _send_batches(self, method: str, batches: list[list]) -> tuple[list, list[list], list[str]]:
+        """Send each batch of documents (or document ids) in its own
+        request, with up to ``max_concurrent_requests`` requests in
+        flight.
+
+        A failing request does not stop the others. Return the
+        responses of successful requests, the failed batches and the
+        related errors.
+        """
+
+        def send(batch):
             data = json.dumps(batch, cls=AppSearchJsonEncoder)
-            response = requests.post(self.documents_url, headers=self.headers, data=data)
+            response = self.session.request(method, self.documents_url, headers=self.headers, data=data)
             response.raise_for_status()
+            return response
+
+        responses = []
+        failed_batches = []
+        errors = []
+        if not batches:
+            return responses, failed_batches, errors
+
+        max_workers = min(self.max_concurrent_requests, len(batches))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(send, batch): batch for batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    responses.append(future.result())
+                except Exception as exc:  # pylint: disable=broad-except
+                    failed_batches.append(futures[future])
+                    errors.append(str(exc))
+        return responses, failed_batches, errors
+
+    def create_or_update_documents(self, documents: Iterable[dict]):
+        # Error handling is done by the caller. If some requests fail,
+        # the ids of their documents are given by the raised
+        # `AppSearchPushError`.
+        batches = list(get_batches(documents, size=DOCUMENTS_PER_REQUEST_LIMIT))
+        responses, failed_batches, errors = self._send_batches("POST", batches)
+        for response in responses:
             # Except here when App Search returns a 200 OK response
             # even if *some* documents cannot be processed. In that
             # case we log it here. It denotes a bug on our side: type
             # mismatch on a field, bogus JSON serialization, etc.
             response_data = response.json()
-            errors = [item for item in response_data if item["errors"]]
-            if errors:
-                logger.error("Some offers could not be indexed, possible typing bug", extra={"errors": errors})
+            document_errors = [item for item in response_data if item["errors"]]
+            if document_errors:
+                logger.error("Some offers could not be indexed, possible typing bug", extra={"errors": document_errors})
+        if errors:
+            failed_ids = [document["id"] for batch in failed_batches for document in batch]
+            raise AppSearchPushError(failed_ids, errors)
+
+    def update_documents(self, documents: Iterable[dict]):
+        # Partial update: only the given fields are updated. Error
+        # handling is done by the caller, as in
+        # `create_or_update_documents()`.
+        batches = list(get_batches(documents, size=DOCUMENTS_PER_REQUEST_LIMIT))
+        responses, failed_batches, errors = self._send_batches("PATCH", batches)
+        for response in responses:
+            # Documents of offers that are not indexed (e.g. because
+            # they are not bookable) cannot be updated. That's
+            # expected and harmless.
+            document_errors = [item for item in response.json() if item["errors"]]
+            if document_errors:
+                logger.info("Some offers could not be partially updated", extra={"errors": document_errors})
+        if errors:
+            failed_ids = [document["id"] for batch in failed_batches for document in batch]
+            raise AppSearchPushError(failed_ids, errors)
 
     def delete_documents(self, offer_ids: Iterable[int]):
-        # Error handling is done by the caller.
-        for batch in get_batches(offer_ids, size=DOCUMENTS_PER_REQUEST_LIMIT):
-            data = json.dumps(batch)
-            response = requests.delete(self.documents_url, headers=self.headers, data=data)
-            response.raise_for_status()
+        # Error handling is done by the caller. If some requests fail,
+        # the ids of their documents are given by the raised
+        # `AppSearchPushError`.
+        batches = list(get_batches(list(offer_ids), size=DOCUMENTS_PER_REQUEST_LIMIT))
+        _responses, failed_batches, errors = self._send_batches("DELETE", batches)
+        if errors:
+            failed_ids = [offer_id for batch in failed_batches for offer_id in batch]
+            raise AppSearchPushError(failed_ids, errors)
 
     def delete_all_documents(self):
         if settings.IS_PROD:
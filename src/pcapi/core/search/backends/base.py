@@ -1,42 +1,194 @@
+import enum
+import hashlib
+import json
+import logging
 from typing import Iterable
+from typing import Optional
 
+import redis
+
+from pcapi import settings
 import pcapi.core.offers.models as offers_models
 
 
+logger = logging.getLogger(__name__)
+
+
+class IndexationPriority(enum.Enum):
+    """The indexation queue of offers is split into lanes, one per
+    priority. Lanes are drained in the order in which they are
+    declared here: a lane is processed only when all previous lanes
+    are empty.
+    """
+
+    REALTIME = "realtime"  # bookings, cancellations, edits by pro users, etc.
+    BULK = "bulk"  # provider synchronizations, batch updates, etc.
+
+
 class SearchBackend:
+    # Name of the Redis hashmap that holds, for each indexed offer,
+    # the fingerprint of the last document that has been sent to the
+    # external search service. Subclasses that use Redis must define
+    # it.
+    redis_fingerprints_name: str = None
+
     def __str__(self):  # useful in logs
         return str(self.__class__.__name__)
 
-    def enqueue_offer_ids(self, offer_ids: Iterable[int]) -> None:
+    @staticmethod
+    def get_document_fingerprint(document: dict) -> str:
+        data = json.dumps(document, sort_keys=True, default=str)
+        return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+    def filter_unchanged_documents(
+        self, documents: dict[int, dict], skip_unchanged: bool = True
+    ) -> tuple[dict[int, dict], dict[int, str]]:
+        """Given a mapping of ``Offer.id`` to serialized documents,
+        return the documents that differ from the last pushed
+        version, along with their new fingerprint.
+
+        If ``skip_unchanged`` is False, all documents are returned
+        (e.g. to repair an index that has drifted from stored
+        fingerprints).
+
+        Fingerprints should be stored with
+        ``store_document_fingerprints()`` once the documents have
+        been successfully sent.
+        """
+        if not documents:
+            return {}, {}
+        offer_ids = list(documents)
+        fingerprints = {offer_id: self.get_document_fingerprint(documents[offer_id]) for offer_id in offer_ids}
+        if not skip_unchanged:
+            return documents, fingerprints
+        try:
+            stored = self.redis_client.hmget(self.redis_fingerprints_name, offer_ids)
+        except redis.exceptions.RedisError:
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not get fingerprints of indexed offers", extra={"offers": offer_ids})
+            return documents, fingerprints
+        changed = {}
+        for offer_id, previous in zip(offer_ids, stored):
+            if isinstance(previous, bytes):  # the Redis client of tests does not decode responses
+                previous = previous.decode()
+            if previous != fingerprints[offer_id]:
+                changed[offer_id] = documents[offer_id]
+        return changed, {offer_id: fingerprints[offer_id] for offer_id in changed}
+
+    def store_document_fingerprints(self, fingerprints: dict[int, str]) -> None:
+        if not fingerprints:
+            return
+        try:
+            self.redis_client.hset(self.redis_fingerprints_name, mapping=fingerprints)
+        except redis.exceptions.RedisError:
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not store fingerprints of indexed offers", extra={"offers": list(fingerprints)})
+
+    def delete_document_fingerprints(self, offer_ids: Iterable[int]) -> None:
+        if not offer_ids:
+            return
+        try:
+            self.redis_client.hdel(self.redis_fingerprints_name, *offer_ids)
+        except redis.exceptions.RedisError:
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not delete fingerprints of unindexed offers", extra={"offers": offer_ids})
+
+    def delete_all_document_fingerprints(self) -> None:
+        try:
+            self.redis_client.delete(self.redis_fingerprints_name)
+        except redis.exceptions.RedisError:
+            if settings.IS_RUNNING_TESTS:
+                raise
+            logger.exception("Could not delete fingerprints of indexed offers")
+
+    def enqueue_offer_ids(
+        self, offer_ids: Iterable[int], priority: IndexationPriority = IndexationPriority.REALTIME
+    ) -> None:
         raise NotImplementedError()
 
     def enqueue_offer_ids_in_error(self, offer_ids: Iterable[int]) -> None:
         raise NotImplementedError()
 
-    def enqueue_venue_ids(self, venue_ids: Iterable[int]) -> None:
+    def enqueue_venue_ids(self, venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
+        """Add venues to the indexation queue.
+
+        If ``venue_fields_only`` is True, only the fields of the
+        documents that come from the venue (and its offerer) will be
+        updated, if the backend supports it. Otherwise, all offers of
+        the venues will be fully reindexed.
+        """
+        raise NotImplementedError()
+
+    def enqueue_ids(
+        self,
+        offer_ids_by_priority: dict[IndexationPriority, Iterable[int]],
+        venue_ids: Iterable[int],
+        venue_ids_fields_only: Iterable[int] = (),
+    ) -> None:
+        """Add offers (in the lane of their priority) and venues to
+        the indexation queues in a single round trip.
+        """
         raise NotImplementedError()
 
-    def pop_offer_ids_from_queue(self, count: int, from_error_queue: bool = False) -> set[int]:
+    def pop_offer_ids_from_queue(
+        self,
+        count: int,
+        from_error_queue: bool = False,
+        priority: IndexationPriority = IndexationPriority.REALTIME,
+    ) -> set[int]:
         raise NotImplementedError()
 
-    def get_venue_ids_from_queue(self, count: int) -> set[int]:
+    def get_venue_ids_from_queue(self, count: int, venue_fields_only: bool = False) -> set[int]:
         raise NotImplementedError()
 
-    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int]) -> None:
+    def delete_venue_ids_from_queue(self, venue_ids: Iterable[int], venue_fields_only: bool = False) -> None:
         raise NotImplementedError()
 
-    def count_offers_to_index_from_queue(self, from_error_queue: bool = False) -> int:
+    def count_offers_to_index_from_queue(
+        self, from_error_queue: bool = False, priority: Optional[IndexationPriority] = None
+    ) -> int:
+        """Return the number of offers in the error queue, in the
+        lane of the given priority or (if no priority is given) in
+        all lanes.
+        """
+        raise NotImplementedError()
+
+    def get_offer_queue_stats(self) -> dict[str, dict]:
+        """Return the number of offers and the age (in seconds) of the
+        oldest offer in each lane of the indexation queue.
+
+        The age is None if the lane is empty or if the backend cannot
+        tell.
+        """
         raise NotImplementedError()
 
     def check_offer_is_indexed(self, offer: offers_models.Offer) -> bool:
         raise NotImplementedError()
 
-    def index_offers(self, offers: Iterable[offers_models.Offer]) -> None:
+    def index_offers(self, offers: Iterable[offers_models.Offer], skip_unchanged: bool = True) -> int:
+        """Index the given offers, skipping those whose document has
+        not changed since the last indexation (unless
+        ``skip_unchanged`` is False). Return the number of skipped
+        offers.
+        """
         raise NotImplementedError()
 
     def unindex_offer_ids(self, offers: Iterable[int]) -> None:
         raise NotImplementedError()
 
+    def update_venue_fields(self, venue, offer_ids: Iterable[int]) -> None:
+        """Update the fields that come from the venue (and its
+        offerer) in the documents of the given offers, without
+        touching other fields.
+
+        ``venue`` is a row returned by
+        ``venue_queries.get_indexed_fields_by_ids()``.
+        """
+        raise NotImplementedError()
+
     def unindex_all_offers(self) -> None:
         raise NotImplementedError()
 
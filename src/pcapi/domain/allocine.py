@@ -1,5 +1,9 @@
+import concurrent.futures
+import contextlib
 import logging
+import threading
 from typing import Callable
+from typing import Optional
 
 from pcapi.connectors.api_allocine import get_movie_poster_from_allocine
 from pcapi.connectors.api_allocine import get_movies_showtimes_from_allocine
@@ -24,8 +28,48 @@ def get_movies_showtimes(
     return iter(filtered_movies_showtimes)
 
 
+# Poster URL -> future of the poster (see `movie_posters_cache()`).
+_posters_cache: Optional[dict[str, concurrent.futures.Future]] = None
+_posters_cache_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def movie_posters_cache():
+    """Download each movie poster only once within this context, even
+    if it is requested by several threads (i.e. theaters) at the same
+    time.
+    """
+    global _posters_cache  # pylint: disable=global-statement
+    _posters_cache = {}
+    try:
+        yield
+    finally:
+        _posters_cache = None
+
+
 def get_movie_poster(poster_url: str, get_movie_poster_from_api: Callable = get_movie_poster_from_allocine) -> bytes:
-    return get_movie_poster_from_api(poster_url)
+    cache = _posters_cache
+    if cache is None:
+        return get_movie_poster_from_api(poster_url)
+
+    with _posters_cache_lock:
+        future = cache.get(poster_url)
+        is_downloader = future is None
+        if is_downloader:
+            future = cache[poster_url] = concurrent.futures.Future()
+    if not is_downloader:
+        return future.result()
+
+    try:
+        poster = get_movie_poster_from_api(poster_url)
+    except Exception as exc:
+        # Do not keep errors: the next theater will try again.
+        with _posters_cache_lock:
+            del cache[poster_url]
+        future.set_exception(exc)
+        raise
+    future.set_result(poster)
+    return poster
 
 
 def _exclude_movie_showtimes_with_special_event_type(movies_showtime: list) -> list:
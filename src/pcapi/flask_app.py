@@ -155,6 +155,22 @@ jwt = JWTManager(app)
 rate_limiter.init_app(app)
 
 
+@app.before_request
+def buffer_search_indexation_requests() -> None:
+    from pcapi.core import search  # avoid circular import
+
+    search.start_buffering_indexation_requests()
+
+
+@app.teardown_request
+def flush_search_indexation_requests(
+    exc: typing.Optional[Exception] = None,  # pylint: disable=unused-argument
+) -> None:
+    from pcapi.core import search  # avoid circular import
+
+    search.flush_indexation_requests()
+
+
 @app.teardown_request
 def remove_db_session(
     exc: typing.Optional[Exception] = None,  # pylint: disable=unused-argument
@@ -37,6 +37,7 @@ ORIGINAL_VERSION_SUFFIX = "VO"
 class AllocineStocks(LocalProvider):
     name = "Allociné"
     can_create = True
+    current_element_attributes = ("movie_information", "filtered_movie_showtimes")
 
     def __init__(self, allocine_venue_provider: AllocineVenueProvider):
         super().__init__(allocine_venue_provider)
@@ -1,22 +1,53 @@
+from collections import defaultdict
+from typing import Iterable
 from typing import Optional
 
 from pcapi.local_providers.providable_info import ProvidableInfo
 from pcapi.models.db import Model
+from pcapi.models.db import db
 from pcapi.repository.providable_queries import get_existing_object
+from pcapi.repository.providable_queries import get_existing_objects
+from pcapi.repository.providable_queries import get_update_mappings
 from pcapi.repository.providable_queries import insert_chunk
 from pcapi.repository.providable_queries import update_chunk
 
 
 def get_existing_pc_obj(
-    providable_info: ProvidableInfo, chunk_to_insert: dict, chunk_to_update: dict
+    providable_info: ProvidableInfo,
+    chunk_to_insert: dict,
+    chunk_to_update: dict,
+    prefetched_objects: Optional[dict[str, Optional[Model]]] = None,
 ) -> Optional[Model]:
     object_in_current_chunk = get_object_from_current_chunks(providable_info, chunk_to_insert, chunk_to_update)
     if object_in_current_chunk is None:
+        chunk_key = f"{providable_info.id_at_providers}|{providable_info.type.__name__}"
+        if prefetched_objects is not None and chunk_key in prefetched_objects:
+            return prefetched_objects[chunk_key]
         return get_existing_object(providable_info.type, providable_info.id_at_providers)
 
     return object_in_current_chunk
 
 
+def prefetch_existing_pc_objs(providable_infos: Iterable[ProvidableInfo]) -> dict[str, Optional[Model]]:
+    """Look up the existing objects of the given providables, with one
+    query per model type.
+
+    The returned dictionary uses the same keys as chunks. Its value is
+    None for providables that do not exist in the database (yet).
+    """
+    ids_at_providers_by_type = defaultdict(set)
+    for providable_info in providable_infos:
+        ids_at_providers_by_type[providable_info.type].add(providable_info.id_at_providers)
+
+    prefetched_objects = {}
+    for model_type, ids_at_providers in ids_at_providers_by_type.items():
+        for id_at_providers in ids_at_providers:
+            prefetched_objects[f"{id_at_providers}|{model_type.__name__}"] = None
+        for pc_object in get_existing_objects(model_type, ids_at_providers):
+            prefetched_objects[f"{pc_object.idAtProviders}|{model_type.__name__}"] = pc_object
+    return prefetched_objects
+
+
 def get_object_from_current_chunks(
     providable_info: ProvidableInfo, chunk_to_insert: dict, chunk_to_update: dict
 ) -> Optional[Model]:
@@ -30,9 +61,16 @@ def get_object_from_current_chunks(
     return None
 
 
-def save_chunks(chunk_to_insert: dict[str, Model], chunk_to_update: dict[str, Model]):
+def save_chunks(chunk_to_insert: dict[str, Model], chunk_to_update: dict[str, Model]) -> set[str]:
+    """Save both chunks in one transaction and return the keys of the
+    objects of ``chunk_to_update`` that have not been updated because
+    they have not changed.
+    """
+    # Changes must be collected before anything is committed.
+    mappings_by_mapper, unchanged_keys = get_update_mappings(chunk_to_update)
+
     if len(chunk_to_insert) > 0:
         insert_chunk(chunk_to_insert)
-
-    if len(chunk_to_update) > 0:
-        update_chunk(chunk_to_update)
+    update_chunk(mappings_by_mapper)
+    db.session.commit()
+    return unchanged_keys
@@ -1,16 +1,29 @@
 from abc import abstractmethod
 from collections.abc import Iterator
+import copy
 from datetime import datetime
+import itertools
 import logging
 
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.sql import sqltypes
+
+from pcapi import settings
 from pcapi.connectors.thumb_storage import create_thumb
+from pcapi.connectors.thumb_storage import get_source_hash
+from pcapi.connectors.thumb_storage import set_source_hashes
 from pcapi.core import search
 from pcapi.core.offers.models import Offer
 from pcapi.core.offers.models import Stock
 from pcapi.core.providers.repository import get_provider_by_local_class
 from pcapi.local_providers.chunk_manager import get_existing_pc_obj
+from pcapi.local_providers.chunk_manager import prefetch_existing_pc_objs
 from pcapi.local_providers.chunk_manager import save_chunks
 from pcapi.local_providers.providable_info import ProvidableInfo
+from pcapi.local_providers.provider_event_buffer import ProviderEventBuffer
+from pcapi.local_providers.thumbs_pipeline import ThumbsPipeline
+from pcapi.local_providers.thumbs_pipeline import get_thumb_indexes_to_upload
 from pcapi.models import ApiErrors
 from pcapi.models.db import Model
 from pcapi.models.db import db
@@ -26,12 +39,24 @@ logger = logging.getLogger(__name__)
 
 
 CHUNK_MAX_SIZE = 1000
+# Number of elements (i.e. of calls to `LocalProvider.__next__()`)
+# that are read before their existing objects are looked up at once.
+WINDOW_SIZE = 100
 
 
 class LocalProvider(Iterator):
+    # Attributes that `__next__()` sets to describe the element it
+    # returns, and that are read when this element is processed (by
+    # `fill_object_attributes()`, `get_object_thumb()`, etc.). Since
+    # elements are read by windows and processed afterwards, these
+    # attributes are saved along with each element and restored
+    # before it is processed.
+    current_element_attributes: tuple[str, ...] = ()
+
     def __init__(self, venue_provider=None, **options):
         self.venue_provider = venue_provider
         self.updatedObjects = 0
+        self.unchangedObjects = 0
         self.createdObjects = 0
         self.checkedObjects = 0
         self.erroredObjects = 0
@@ -40,6 +65,9 @@ class LocalProvider(Iterator):
         self.checkedThumbs = 0
         self.erroredThumbs = 0
         self.provider = get_provider_by_local_class(self.__class__.__name__)
+        self.thumbs_pipeline = None
+        self.event_buffer = ProviderEventBuffer()
+        self.pending_events: list[LocalProviderEvent] = []
 
     @property
     @abstractmethod
@@ -73,7 +101,7 @@ class LocalProvider(Iterator):
     def name(self):
         pass
 
-    def _handle_thumb(self, pc_object: Model):
+    def _handle_thumb(self, pc_object: Model, chunk_key: str = None):
         new_thumb_index = self.get_object_thumb_index()
         if new_thumb_index == 0:
             return
@@ -83,8 +111,60 @@ class LocalProvider(Iterator):
         if not new_thumb:
             return
 
-        _save_same_thumb_from_thumb_count_to_index(pc_object, new_thumb_index, new_thumb)
-        self.createdThumbs += new_thumb_index
+        if self.thumbs_pipeline:
+            # The thumb count is updated when the pipeline is joined.
+            self.thumbs_pipeline.submit(pc_object, chunk_key, new_thumb, new_thumb_index)
+            return
+
+        thumb_count = pc_object.thumbCount or 0
+        source_hash = get_source_hash(new_thumb)
+        indexes = _save_same_thumb_from_thumb_count_to_index(pc_object, new_thumb_index, new_thumb, source_hash)
+        self._count_uploaded_thumbs(thumb_count, indexes)
+        set_source_hashes({pc_object.get_thumb_storage_id(index): source_hash for index in indexes})
+
+    def _count_uploaded_thumbs(self, thumb_count: int, indexes: list[int]) -> None:
+        # Thumbs that have been skipped because their source image has
+        # not changed are only counted as checked.
+        for index in indexes:
+            if index < thumb_count:
+                self.updatedThumbs += 1
+            else:
+                self.createdThumbs += 1
+
+    def _join_thumbs_pipeline(self, chunk_to_insert: dict, chunk_to_update: dict) -> None:
+        if not self.thumbs_pipeline:
+            return
+        jobs = self.thumbs_pipeline.join()
+        set_source_hashes(
+            {
+                storage_id: source_hash
+                for job, exception in jobs
+                if not exception
+                for storage_id, source_hash in job.get_source_hashes_by_storage_id().items()
+            }
+        )
+        for job, exception in jobs:
+            if exception:
+                self.log_provider_event(
+                    LocalProviderEventType.SyncError,
+                    exception.__class__.__name__,
+                    sample_id=job.pc_object.idAtProviders,
+                )
+                self.erroredThumbs += 1
+                logger.info("ERROR during handle thumb: %s", exception, exc_info=exception)
+                continue
+            pc_object = job.pc_object
+            pc_object_has_new_thumbs = pc_object.thumbCount != job.new_thumb_count
+            pc_object.thumbCount = job.new_thumb_count
+            self._count_uploaded_thumbs(job.thumb_count, job.indexes)
+            if pc_object_has_new_thumbs and job.key not in chunk_to_insert:
+                errors = entity_validator.validate(pc_object)
+                if errors and len(errors.errors) > 0:
+                    self.log_provider_event(
+                        LocalProviderEventType.SyncError, "ApiErrors", sample_id=pc_object.idAtProviders
+                    )
+                    continue
+                chunk_to_update[job.key] = pc_object
 
     def _create_object(self, providable_info: ProvidableInfo) -> Model:
         pc_object = providable_info.type()
@@ -97,7 +177,9 @@ class LocalProvider(Iterator):
 
         errors = entity_validator.validate(pc_object)
         if errors and len(errors.errors) > 0:
-            self.log_provider_event(LocalProviderEventType.SyncError, "ApiErrors")
+            self.log_provider_event(
+                LocalProviderEventType.SyncError, "ApiErrors", sample_id=providable_info.id_at_providers
+            )
             self.erroredObjects += 1
             raise errors
 
@@ -105,7 +187,9 @@ class LocalProvider(Iterator):
         return pc_object
 
     def _handle_update(self, pc_object, providable_info):
+        json_values = _get_json_values(pc_object)
         self.fill_object_attributes(pc_object)
+        _flag_modified_json_values(pc_object, json_values)
 
         pc_object.lastProviderId = self.provider.id
         pc_object.dateModifiedAtLastProvider = providable_info.date_modified_at_provider
@@ -115,31 +199,57 @@ class LocalProvider(Iterator):
             # expire pc_object because we may have modified it during fill_object_attributes
             # and we don't want it to be pushed to the DB if there is any error
             db.session.expire(pc_object)
-            self.log_provider_event(LocalProviderEventType.SyncError, "ApiErrors")
+            self.log_provider_event(
+                LocalProviderEventType.SyncError, "ApiErrors", sample_id=providable_info.id_at_providers
+            )
             self.erroredObjects += 1
             raise errors
 
         self.updatedObjects += 1
 
-    def log_provider_event(self, event_type, event_payload=None):
-        local_provider_event = LocalProviderEvent()
-        local_provider_event.type = event_type
-        local_provider_event.payload = str(event_payload)
-        local_provider_event.provider = self.provider
-        db.session.add(local_provider_event)
+    def log_provider_event(self, event_type, event_payload=None, sample_id=None):
+        """Log a provider event.
+
+        Events are kept in memory until the next chunk is saved, and
+        committed along with it (or at the end of the synchronization,
+        even if it fails). Errors are aggregated (see
+        `ProviderEventBuffer`).
+        """
+        if event_type == LocalProviderEventType.SyncError:
+            self.event_buffer.add(event_type, str(event_payload), sample_id)
+            return
+        # Keep errors before the event that follows them.
+        self.pending_events.extend(self.event_buffer.pop_events(self.provider))
+        self.pending_events.append(
+            LocalProviderEvent(
+                type=event_type,
+                payload=str(event_payload),
+                providerId=self.provider.id,
+            )
+        )
+
+    def flush_provider_events(self) -> None:
+        self._write_buffered_provider_events()
         db.session.commit()
 
+    def _write_buffered_provider_events(self) -> None:
+        events = self.pending_events + self.event_buffer.pop_events(self.provider)
+        self.pending_events = []
+        if events:
+            db.session.bulk_save_objects(events)
+
     def _print_objects_summary(self):
         # FIXME (dbaty, 2020-02-05): I don't know how we could end up
         # here with no venue_provider, but there are checks elsewhere
         # so I do the same here.
         venue_id = self.venue_provider.venueId if self.venue_provider else "none"
         logger.info(
-            "Synchronization of objects of venue=%s, checked=%d, created=%d, updated=%d, errors=%s",
+            "Synchronization of objects of venue=%s, checked=%d, created=%d, updated=%d (unchanged=%d), errors=%s",
             venue_id,
             self.checkedObjects,
             self.createdObjects,
             self.updatedObjects,
+            self.unchangedObjects,
             self.erroredObjects,
         )
         logger.info(
@@ -151,8 +261,32 @@ class LocalProvider(Iterator):
             self.erroredThumbs,
         )
 
+    def _save_current_element(self) -> dict:
+        return {name: getattr(self, name, None) for name in self.current_element_attributes}
+
+    def _restore_current_element(self, element: dict) -> None:
+        for name, value in element.items():
+            setattr(self, name, value)
+
+    def _read_windows(self, limit: int = None) -> Iterator[list[tuple[list[ProvidableInfo], dict]]]:
+        while True:
+            window_size = WINDOW_SIZE
+            if limit:
+                # Do not read (much) more than needed: `__next__()`
+                # may have side effects.
+                window_size = min(window_size, limit - self.checkedObjects)
+                if window_size <= 0:
+                    return
+            window = [
+                (providable_infos, self._save_current_element())
+                for providable_infos in itertools.islice(self, window_size)
+            ]
+            if window:
+                yield window
+            if len(window) < window_size:  # exhausted
+                return
+
     def updateObjects(self, limit=None):
-        # pylint: disable=too-many-nested-blocks
         if self.venue_provider and not self.venue_provider.isActive:
             logger.info("Venue provider %s is inactive", self.venue_provider)
             return
@@ -164,98 +298,181 @@ class LocalProvider(Iterator):
 
         # TODO (asaunier,2021-03-18): We may replace this log in BDD with logs in the monitoring system
         self.log_provider_event(LocalProviderEventType.SyncStart)
+        self.flush_provider_events()
+
+        if settings.THUMBS_PIPELINE_PROCESSES > 0:
+            self.thumbs_pipeline = ThumbsPipeline(
+                processes=settings.THUMBS_PIPELINE_PROCESSES,
+                upload_threads=settings.THUMBS_PIPELINE_UPLOAD_THREADS,
+                max_pending=settings.THUMBS_PIPELINE_MAX_PENDING,
+            )
+        try:
+            # Updated objects are written by `save_chunks()`, which
+            # only writes the columns that have changed: do not let
+            # queries flush them before.
+            with db.session.no_autoflush:
+                self._update_objects_by_chunks(limit)
+        except Exception:
+            # The current chunk is lost, but not the events that have
+            # been logged so far (see below).
+            db.session.rollback()
+            raise
+        finally:
+            if self.thumbs_pipeline:
+                self.thumbs_pipeline.shutdown()
+                self.thumbs_pipeline = None
+            self.flush_provider_events()
 
-        chunk_to_insert = {}
-        chunk_to_update = {}
+        self._print_objects_summary()
+        self.log_provider_event(LocalProviderEventType.SyncEnd)
+        self.flush_provider_events()
 
-        for providable_infos in self:
-            objects_limit_reached = limit and self.checkedObjects >= limit
-            if objects_limit_reached:
-                break
+        if self.venue_provider is not None:
+            self.venue_provider.lastSyncDate = datetime.utcnow()
+            repository.save(self.venue_provider)
 
-            has_no_providables_info = len(providable_infos) == 0
-            if has_no_providables_info:
-                self.checkedObjects += 1
-                continue
+    def _update_objects_by_chunks(self, limit=None):
+        # pylint: disable=too-many-nested-blocks
+        chunk_to_insert = {}
+        chunk_to_update = {}
 
-            for providable_info in providable_infos:
-                chunk_key = providable_info.id_at_providers + "|" + str(providable_info.type.__name__)
-                pc_object = get_existing_pc_obj(providable_info, chunk_to_insert, chunk_to_update)
-
-                if pc_object is None:
-                    if not self.can_create:
-                        continue
-
-                    try:
-                        pc_object = self._create_object(providable_info)
-                        chunk_to_insert[chunk_key] = pc_object
-                    except ApiErrors:
-                        continue
-                else:
-                    last_update_for_current_provider = get_last_update_for_provider(self.provider.id, pc_object)
-                    object_need_update = (
-                        last_update_for_current_provider is None
-                        or last_update_for_current_provider < providable_info.date_modified_at_provider
+        for window in self._read_windows(limit):
+            # Look up existing objects of the whole window at once,
+            # instead of one query per providable.
+            prefetched_objects = prefetch_existing_pc_objs(
+                providable_info for providable_infos, _element in window for providable_info in providable_infos
+            )
+
+            for providable_infos, element in window:
+                objects_limit_reached = limit and self.checkedObjects >= limit
+                if objects_limit_reached:
+                    break
+
+                has_no_providables_info = len(providable_infos) == 0
+                if has_no_providables_info:
+                    self.checkedObjects += 1
+                    continue
+
+                self._restore_current_element(element)
+
+                for providable_info in providable_infos:
+                    chunk_key = providable_info.id_at_providers + "|" + str(providable_info.type.__name__)
+                    pc_object = get_existing_pc_obj(
+                        providable_info, chunk_to_insert, chunk_to_update, prefetched_objects
                     )
 
-                    if object_need_update:
-                        try:
-                            self._handle_update(pc_object, providable_info)
-                            if chunk_key in chunk_to_insert:
-                                chunk_to_insert[chunk_key] = pc_object
-                            else:
-                                chunk_to_update[chunk_key] = pc_object
-                        except ApiErrors:
+                    if pc_object is None:
+                        if not self.can_create:
                             continue
 
-                if isinstance(pc_object, HasThumbMixin):
-                    initial_thumb_count = pc_object.thumbCount
-                    try:
-                        self._handle_thumb(pc_object)
-                    except Exception as e:  # pylint: disable=broad-except
-                        self.log_provider_event(LocalProviderEventType.SyncError, e.__class__.__name__)
-                        self.erroredThumbs += 1
-                        logger.info("ERROR during handle thumb: %s", e, exc_info=True)
-                    pc_object_has_new_thumbs = pc_object.thumbCount != initial_thumb_count
-                    if pc_object_has_new_thumbs:
-                        errors = entity_validator.validate(pc_object)
-                        if errors and len(errors.errors) > 0:
-                            self.log_provider_event(LocalProviderEventType.SyncError, "ApiErrors")
+                        try:
+                            pc_object = self._create_object(providable_info)
+                            chunk_to_insert[chunk_key] = pc_object
+                        except ApiErrors:
                             continue
+                    else:
+                        last_update_for_current_provider = get_last_update_for_provider(self.provider.id, pc_object)
+                        object_need_update = (
+                            last_update_for_current_provider is None
+                            or last_update_for_current_provider < providable_info.date_modified_at_provider
+                        )
+
+                        if object_need_update:
+                            try:
+                                self._handle_update(pc_object, providable_info)
+                                if chunk_key in chunk_to_insert:
+                                    chunk_to_insert[chunk_key] = pc_object
+                                else:
+                                    chunk_to_update[chunk_key] = pc_object
+                            except ApiErrors:
+                                continue
+
+                    if isinstance(pc_object, HasThumbMixin):
+                        initial_thumb_count = pc_object.thumbCount
+                        try:
+                            self._handle_thumb(pc_object, chunk_key)
+                        except Exception as e:  # pylint: disable=broad-except
+                            self.log_provider_event(
+                                LocalProviderEventType.SyncError,
+                                e.__class__.__name__,
+                                sample_id=providable_info.id_at_providers,
+                            )
+                            self.erroredThumbs += 1
+                            logger.info("ERROR during handle thumb: %s", e, exc_info=True)
+                        pc_object_has_new_thumbs = pc_object.thumbCount != initial_thumb_count
+                        if pc_object_has_new_thumbs:
+                            errors = entity_validator.validate(pc_object)
+                            if errors and len(errors.errors) > 0:
+                                self.log_provider_event(
+                                    LocalProviderEventType.SyncError,
+                                    "ApiErrors",
+                                    sample_id=providable_info.id_at_providers,
+                                )
+                                continue
+
+                            chunk_to_update[chunk_key] = pc_object
+
+                    self.checkedObjects += 1
+
+                    if len(chunk_to_insert) + len(chunk_to_update) >= CHUNK_MAX_SIZE:
+                        self._save_chunks(chunk_to_insert, chunk_to_update)
+                        # Objects that have just been inserted are not
+                        # attached to the session: they must be looked
+                        # up again if they show up later in the window.
+                        for inserted_chunk_key in chunk_to_insert:
+                            prefetched_objects.pop(inserted_chunk_key, None)
+                        chunk_to_insert = {}
+                        chunk_to_update = {}
+
+        self._save_chunks(chunk_to_insert, chunk_to_update)
+
+    def _save_chunks(self, chunk_to_insert: dict, chunk_to_update: dict) -> None:
+        self._join_thumbs_pipeline(chunk_to_insert, chunk_to_update)
+        # Provider events are committed along with the chunks.
+        self._write_buffered_provider_events()
+        if len(chunk_to_insert) + len(chunk_to_update) == 0:
+            db.session.commit()
+            return
+        unchanged_keys = save_chunks(chunk_to_insert, chunk_to_update)
+        self.unchangedObjects += len(unchanged_keys)
+        _reindex_offers(
+            list(chunk_to_insert.values())
+            + [pc_object for key, pc_object in chunk_to_update.items() if key not in unchanged_keys]
+        )
 
-                        chunk_to_update[chunk_key] = pc_object
 
-                self.checkedObjects += 1
+def _save_same_thumb_from_thumb_count_to_index(
+    pc_object: Model, thumb_index: int, image_as_bytes: bytes, source_hash: str = None
+) -> list[int]:
+    """Create the thumb at ``thumb_index`` (and missing thumbs before it)
+    and return the indexes of the thumbs that have been uploaded.
 
-                if len(chunk_to_insert) + len(chunk_to_update) >= CHUNK_MAX_SIZE:
-                    save_chunks(chunk_to_insert, chunk_to_update)
-                    _reindex_offers(list(chunk_to_insert.values()) + list(chunk_to_update.values()))
-                    chunk_to_insert = {}
-                    chunk_to_update = {}
+    If ``source_hash`` is given, thumbs that have already been uploaded
+    from the same source image are skipped.
+    """
+    indexes, new_thumb_count = get_thumb_indexes_to_upload(pc_object, pc_object.thumbCount, thumb_index, source_hash)
+    for index in indexes:
+        create_thumb(pc_object, image_as_bytes, index)
+    pc_object.thumbCount = new_thumb_count
+    return indexes
 
-        if len(chunk_to_insert) + len(chunk_to_update) > 0:
-            save_chunks(chunk_to_insert, chunk_to_update)
-            _reindex_offers(list(chunk_to_insert.values()) + list(chunk_to_update.values()))
 
-        self._print_objects_summary()
-        self.log_provider_event(LocalProviderEventType.SyncEnd)
-
-        if self.venue_provider is not None:
-            self.venue_provider.lastSyncDate = datetime.utcnow()
-            repository.save(self.venue_provider)
+def _get_json_values(pc_object: Model) -> dict:
+    state = inspect(pc_object)
+    return {
+        attribute.key: copy.deepcopy(state.dict[attribute.key])
+        for attribute in state.mapper.column_attrs
+        if isinstance(attribute.columns[0].type, sqltypes.JSON) and attribute.key in state.dict
+    }
 
 
-def _save_same_thumb_from_thumb_count_to_index(pc_object: Model, thumb_index: int, image_as_bytes: bytes):
-    if pc_object.thumbCount is None:  # handle unsaved object
-        pc_object.thumbCount = 0
-    if thumb_index <= pc_object.thumbCount:
-        # replace existing thumb
-        create_thumb(pc_object, image_as_bytes, thumb_index)
-    else:
-        # add new thumb
-        for index in range(pc_object.thumbCount, thumb_index):
-            create_thumb(pc_object, image_as_bytes, index)
-            pc_object.thumbCount += 1
+def _flag_modified_json_values(pc_object: Model, previous_values: dict) -> None:
+    # JSON values may be modified in place (e.g. `obj.extraData["visa"] = ...`),
+    # which is not tracked by SQLAlchemy. Only changed columns are
+    # written by `save_chunks()`, so we must flag them.
+    for key, previous_value in previous_values.items():
+        if getattr(pc_object, key) != previous_value:
+            flag_modified(pc_object, key)
 
 
 def _reindex_offers(created_or_updated_objects):
@@ -265,4 +482,4 @@ def _reindex_offers(created_or_updated_objects):
             offer_ids.add(obj.offerId)
         elif isinstance(obj, Offer):
             offer_ids.add(obj.id)
-    search.async_index_offer_ids(offer_ids)
+    search.async_index_offer_ids(offer_ids, priority=search.IndexationPriority.BULK)
@@ -1,7 +1,17 @@
+from collections import Counter
+from collections import defaultdict
+from collections import deque
+import concurrent.futures
 import logging
+from typing import Callable
+from typing import Hashable
+from typing import Iterable
+from typing import Optional
 
+from flask import current_app
 from sqlalchemy.orm.util import aliased
 
+from pcapi import settings
 import pcapi.connectors.notion as notion_connector
 from pcapi.core.providers.models import Provider
 from pcapi.core.providers.models import VenueProvider
@@ -13,7 +23,17 @@ from . import synchronize_provider_api
 logger = logging.getLogger(__name__)
 
 
-def synchronize_stocks() -> None:
+def synchronize_stocks(pool_size: Optional[int] = None, max_workers_per_provider: Optional[int] = None) -> None:
+    """Synchronize stocks of all active venue providers whose provider
+    implements the provider API.
+
+    If ``pool_size`` is greater than 1, venue providers are
+    synchronized in parallel by a pool of threads (most of the time
+    is spent waiting for the provider API), each with its own
+    database session. No more than ``max_workers_per_provider``
+    venue providers of the same provider are synchronized at the same
+    time, so that we do not overload the API of the provider.
+    """
     # Alias for provider table, and explicit "on" clause for the "join", are mandatory because
     # VenueProvider model already has a "select" on the provider table for its polymorphic query
     provider_alias = aliased(Provider)
@@ -26,22 +46,96 @@ def synchronize_stocks() -> None:
         .all()
     )
 
+    if pool_size is None:
+        pool_size = settings.PROVIDERS_SYNC_WORKERS_POOL_SIZE
+    if max_workers_per_provider is None:
+        max_workers_per_provider = settings.PROVIDERS_SYNC_MAX_WORKERS_PER_PROVIDER
+
+    # Threads use their own connection and would not see the data of
+    # the (never committed) transaction of tests.
+    if pool_size <= 1 or settings.IS_RUNNING_TESTS:
+        for venue_provider in venue_providers:
+            _synchronize_venue_provider(venue_provider)
+        return
+
+    venue_provider_ids_by_provider = defaultdict(list)
     for venue_provider in venue_providers:
-        # We need to stock these values inside variables to prevent a crash
-        # if the session is broken and we need to log them
-        venue_id = venue_provider.venueId
-        venue_provider_id = venue_provider.id
-        venue_id_at_offer_provider = venue_provider.venueIdAtOfferProvider
-        provider_name = venue_provider.provider.name
+        venue_provider_ids_by_provider[venue_provider.providerId].append(venue_provider.id)
+    # Release the connection of the main thread while workers run.
+    db.session.remove()
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    run_in_pool(
+        lambda venue_provider_id: _synchronize_venue_provider_in_worker(app, venue_provider_id),
+        venue_provider_ids_by_provider,
+        pool_size=pool_size,
+        max_workers_per_key=max_workers_per_provider,
+    )
+
 
+def _synchronize_venue_provider(venue_provider: VenueProvider) -> None:
+    # We need to stock these values inside variables to prevent a crash
+    # if the session is broken and we need to log them
+    venue_id = venue_provider.venueId
+    venue_provider_id = venue_provider.id
+    venue_id_at_offer_provider = venue_provider.venueIdAtOfferProvider
+    provider_name = venue_provider.provider.name
+
+    try:
+        synchronize_provider_api.synchronize_venue_provider(venue_provider)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("Could not synchronize venue_provider=%s: %s", venue_provider_id, exc)
+        notion_connector.add_to_synchronization_error_database(
+            exception=exc,
+            provider_name=provider_name,
+            venue_id=venue_id,
+            venue_id_at_offer_provider=venue_id_at_offer_provider,
+        )
+        db.session.rollback()
+
+
+def _synchronize_venue_provider_in_worker(app, venue_provider_id: int) -> None:
+    # `db.session` is scoped by thread: each worker gets its own
+    # session (and connection), that we close when we are done.
+    with app.app_context():
         try:
-            synchronize_provider_api.synchronize_venue_provider(venue_provider)
-        except Exception as exc:  # pylint: disable=broad-except
-            logger.exception("Could not synchronize venue_provider=%s: %s", venue_provider_id, exc)
-            notion_connector.add_to_synchronization_error_database(
-                exception=exc,
-                provider_name=provider_name,
-                venue_id=venue_id,
-                venue_id_at_offer_provider=venue_id_at_offer_provider,
-            )
-            db.session.rollback()
+            venue_provider = VenueProvider.query.get(venue_provider_id)
+            _synchronize_venue_provider(venue_provider)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not synchronize venue_provider=%s", venue_provider_id)
+        finally:
+            db.session.remove()
+
+
+def run_in_pool(
+    func: Callable,
+    items_by_key: dict[Hashable, Iterable],
+    pool_size: int,
+    max_workers_per_key: int,
+) -> None:
+    """Call ``func`` on each item, in a pool of ``pool_size`` threads,
+    with no more than ``max_workers_per_key`` items of the same key
+    being processed at the same time.
+
+    Keys are served in turn, so that a key with many items does not
+    delay all others.
+    """
+    pending = {key: deque(items) for key, items in items_by_key.items()}
+    running = {}  # future -> key
+    running_per_key = Counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+        while True:
+            submitted = True
+            while submitted and len(running) < pool_size:
+                submitted = False
+                for key, items in pending.items():
+                    if items and running_per_key[key] < max_workers_per_key and len(running) < pool_size:
+                        running[executor.submit(func, items.popleft())] = key
+                        running_per_key[key] += 1
+                        submitted = True
+            if not running:
+                break
+            done, _not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                running_per_key[running.pop(future)] -= 1
+                future.result()  # errors must be handled by `func`, let them surface otherwise
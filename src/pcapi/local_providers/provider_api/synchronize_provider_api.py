@@ -12,10 +12,15 @@ from pcapi.core.providers.models import Provider
 from pcapi.core.providers.models import VenueProvider
 from pcapi.infrastructure.repository.stock_provider.provider_api import ProviderAPI
 from pcapi.repository import repository
+from pcapi.utils.iterators import prefetch
 
 
 logger = logging.getLogger(__name__)
 
+# Number of pages of stocks that are fetched from the provider API
+# while the current page is being saved.
+PAGES_READ_AHEAD = 1
+
 
 def synchronize_venue_provider(venue_provider: VenueProvider) -> None:
     venue = venue_provider.venue
@@ -27,9 +32,8 @@ def synchronize_venue_provider(venue_provider: VenueProvider) -> None:
     provider_api = provider.getProviderAPI()
 
     stats = Counter()
-    for raw_stocks in _get_stocks_by_batch(
-        venue_provider.venueIdAtOfferProvider, provider_api, venue_provider.lastSyncDate
-    ):
+    pages = _get_stocks_by_batch(venue_provider.venueIdAtOfferProvider, provider_api, venue_provider.lastSyncDate)
+    for raw_stocks in prefetch(pages, read_ahead=PAGES_READ_AHEAD):
         stock_details = _build_stock_details_from_raw_stocks(
             raw_stocks, venue_provider.venueIdAtOfferProvider, provider
         )
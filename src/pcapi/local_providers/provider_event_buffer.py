@@ -0,0 +1,76 @@
+"""Aggregate the errors of provider synchronizations.
+
+A single file may produce thousands of errors of the same kind. Instead
+of inserting (and committing) one ``LocalProviderEvent`` for each of
+them, errors are aggregated by type and payload, and one event is
+inserted for each group when the buffer is flushed, with the number of
+errors in its payload. A few ids of the objects in error are logged
+along with each group.
+"""
+from dataclasses import dataclass
+from dataclasses import field
+import logging
+from typing import Optional
+
+from pcapi.core.providers.models import Provider
+from pcapi.models.local_provider_event import LocalProviderEvent
+from pcapi.models.local_provider_event import LocalProviderEventType
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLE_IDS = 10
+PAYLOAD_MAX_LENGTH = LocalProviderEvent.payload.type.length
+
+
+@dataclass
+class AggregatedEvent:
+    count: int = 0
+    sample_ids: list[str] = field(default_factory=list)
+
+
+def format_payload(payload: str, count: int) -> str:
+    if count == 1:
+        return payload[:PAYLOAD_MAX_LENGTH]
+    suffix = f" (x{count})"
+    return payload[: PAYLOAD_MAX_LENGTH - len(suffix)] + suffix
+
+
+class ProviderEventBuffer:
+    def __init__(self):
+        self._events: dict[tuple[LocalProviderEventType, str], AggregatedEvent] = {}
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(self, event_type: LocalProviderEventType, payload: str, sample_id: Optional[str] = None) -> None:
+        event = self._events.setdefault((event_type, payload), AggregatedEvent())
+        event.count += 1
+        if sample_id is not None and len(event.sample_ids) < MAX_SAMPLE_IDS:
+            event.sample_ids.append(sample_id)
+
+    def pop_events(self, provider: Provider) -> list[LocalProviderEvent]:
+        """Return one (unsaved) event for each group of errors, and
+        empty the buffer.
+        """
+        events = []
+        for (event_type, payload), aggregated_event in self._events.items():
+            logger.info(
+                "Provider synchronization error: %s",
+                payload,
+                extra={
+                    "provider": provider.id,
+                    "event_type": event_type.value,
+                    "count": aggregated_event.count,
+                    "sample_ids": aggregated_event.sample_ids,
+                },
+            )
+            events.append(
+                LocalProviderEvent(
+                    type=event_type,
+                    payload=format_payload(payload, aggregated_event.count),
+                    providerId=provider.id,
+                )
+            )
+        self._events = {}
+        return events
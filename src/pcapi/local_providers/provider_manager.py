@@ -1,11 +1,17 @@
+import concurrent.futures
 import logging
 from typing import Callable
 from typing import Optional
 
+from flask import current_app
+
+from pcapi import settings
 from pcapi.core.providers.models import VenueProvider
+from pcapi.domain.allocine import movie_posters_cache
 import pcapi.local_providers
 from pcapi.local_providers.local_provider import LocalProvider
 from pcapi.local_providers.provider_api import synchronize_provider_api
+from pcapi.models import db
 from pcapi.repository.venue_provider_queries import get_active_venue_providers_for_specific_provider
 from pcapi.scheduled_tasks.logger import CronStatus
 from pcapi.scheduled_tasks.logger import build_cron_log_message
@@ -23,43 +29,98 @@ def synchronize_data_for_provider(provider_name: str, limit: Optional[int] = Non
         logger.exception(build_cron_log_message(name=provider_name, status=CronStatus.FAILED))
 
 
-def synchronize_venue_providers_for_provider(provider_id: int, limit: Optional[int] = None) -> None:
+def synchronize_venue_providers_for_provider(provider_id: int, limit: Optional[int] = None, pool_size: int = 1) -> None:
+    """Synchronize all active venue providers of the provider.
+
+    If ``pool_size`` is greater than 1, venue providers are
+    synchronized in parallel by a pool of threads, each with its own
+    database session. Only the Allociné synchronization asks for it.
+    Movie posters are downloaded only once for all venue providers.
+    """
     venue_providers = get_active_venue_providers_for_specific_provider(provider_id)
-    for venue_provider in venue_providers:
-        synchronize_venue_provider(venue_provider, limit)
 
+    with movie_posters_cache():
+        # Threads use their own connection and would not see the data of
+        # the (never committed) transaction of tests.
+        if pool_size <= 1 or settings.IS_RUNNING_TESTS:
+            for venue_provider in venue_providers:
+                synchronize_venue_provider(venue_provider, limit)
+            return
+
+        venue_provider_ids = [venue_provider.id for venue_provider in venue_providers]
+        # Release the connection of the main thread while workers run.
+        db.session.remove()
+
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+            results = executor.map(
+                lambda venue_provider_id: _synchronize_venue_provider_in_worker(app, venue_provider_id, limit),
+                venue_provider_ids,
+            )
+            failed_venue_provider_ids = [
+                venue_provider_id
+                for venue_provider_id, synchronized in zip(venue_provider_ids, results)
+                if not synchronized
+            ]
+
+        # Venue providers that show the same new movie may have tried
+        # to create the same product at the same time: all but one have
+        # failed. Products now exist, try again one after another.
+        for venue_provider_id in failed_venue_provider_ids:
+            logger.info("Retrying synchronization of venue_provider=%s", venue_provider_id)
+            synchronize_venue_provider(VenueProvider.query.get(venue_provider_id), limit)
+
+
+def _synchronize_venue_provider_in_worker(app, venue_provider_id: int, limit: Optional[int]) -> bool:
+    # `db.session` is scoped by thread: each worker gets its own
+    # session (and connection), that we close when we are done.
+    with app.app_context():
+        try:
+            venue_provider = VenueProvider.query.get(venue_provider_id)
+            return synchronize_venue_provider(venue_provider, limit)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not synchronize venue_provider=%s", venue_provider_id)
+            return False
+        finally:
+            db.session.remove()
 
-def do_update(provider: LocalProvider, limit: Optional[int]):
+
+def do_update(provider: LocalProvider, limit: Optional[int]) -> bool:
     try:
         provider.updateObjects(limit)
     except Exception:  # pylint: disable=broad-except
         logger.exception(build_cron_log_message(name=provider.__class__.__name__, status=CronStatus.STARTED))
+        return False
+    return True
 
 
 def get_local_provider_class_by_name(class_name: str) -> Callable:
     return getattr(pcapi.local_providers, class_name)
 
 
-def synchronize_venue_provider(venue_provider: VenueProvider, limit: Optional[int] = None):
+def synchronize_venue_provider(venue_provider: VenueProvider, limit: Optional[int] = None) -> bool:
+    """Return False if the synchronization has failed."""
     if venue_provider.provider.implements_provider_api:
         synchronize_provider_api.synchronize_venue_provider(venue_provider)
+        return True
 
-    else:
-        assert venue_provider.provider.localClass == "AllocineStocks", "Only AllocineStocks should reach this code"
-        provider_class = get_local_provider_class_by_name(venue_provider.provider.localClass)
+    assert venue_provider.provider.localClass == "AllocineStocks", "Only AllocineStocks should reach this code"
+    provider_class = get_local_provider_class_by_name(venue_provider.provider.localClass)
 
-        logger.info(
-            "Starting synchronization of venue_provider=%s with provider=%s",
-            venue_provider.id,
-            venue_provider.provider.localClass,
-        )
-        try:
-            provider = provider_class(venue_provider)
-            do_update(provider, limit)
-        except Exception:  # pylint: disable=broad-except
-            logger.exception(build_cron_log_message(name=provider_class.__name__, status=CronStatus.FAILED))
-        logger.info(
-            "Ended synchronization of venue_provider=%s with provider=%s",
-            venue_provider.id,
-            venue_provider.provider.localClass,
-        )
+    logger.info(
+        "Starting synchronization of venue_provider=%s with provider=%s",
+        venue_provider.id,
+        venue_provider.provider.localClass,
+    )
+    try:
+        provider = provider_class(venue_provider)
+        synchronized = do_update(provider, limit)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception(build_cron_log_message(name=provider_class.__name__, status=CronStatus.FAILED))
+        synchronized = False
+    logger.info(
+        "Ended synchronization of venue_provider=%s with provider=%s",
+        venue_provider.id,
+        venue_provider.provider.localClass,
+    )
+    return synchronized
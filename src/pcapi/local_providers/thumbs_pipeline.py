@@ -0,0 +1,140 @@
+"""Create thumbs in parallel during provider synchronizations.
+
+Images are standardized (decoded, resized and encoded again) by a pool
+of processes, since it is CPU-bound, and then uploaded to the object
+storage by a pool of threads. Workers never touch database objects:
+the new ``thumbCount`` of each object is applied by the caller when it
+joins the pipeline, before saving its chunks.
+
+Thumbs whose source image has not changed since they were last
+uploaded (according to its hash) are skipped.
+
+No more than ``max_pending`` thumbs are in the pipeline at the same
+time: submitting a thumb blocks until the oldest one is done, so that
+we do not hold all images of a zip file in memory.
+"""
+from collections import deque
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Any
+from typing import Optional
+
+from pcapi.connectors import thumb_storage
+from pcapi.core import object_storage
+from pcapi.models.db import Model
+from pcapi.utils.image_conversion import standardize_image
+
+
+@dataclass
+class ThumbJob:
+    pc_object: Model
+    key: Any
+    thumb_count: int
+    new_thumb_count: int
+    indexes: list[int]  # indexes of the thumbs to upload
+    source_hash: str
+    future: concurrent.futures.Future
+
+    def get_source_hashes_by_storage_id(self) -> dict[str, str]:
+        return {self.pc_object.get_thumb_storage_id(index): self.source_hash for index in self.indexes}
+
+
+def get_thumb_indexes_to_create(thumb_count: Optional[int], thumb_index: int) -> tuple[list[int], int]:
+    """Return the indexes of the thumbs that must be (re)created when
+    receiving a new thumb for ``thumb_index``, and the new thumb count
+    of the object.
+
+    ``thumb_index`` starts at 1 (it is the position of the thumb),
+    whereas indexes of thumbs in the storage start at 0. An existing
+    thumb is replaced. Otherwise, the new thumb is also used for all
+    missing indexes from the current thumb count.
+    """
+    thumb_count = thumb_count or 0
+    if thumb_index <= thumb_count:
+        return [thumb_index - 1], thumb_count
+    return list(range(thumb_count, thumb_index)), thumb_index
+
+
+def get_thumb_indexes_to_upload(
+    pc_object: Model, thumb_count: Optional[int], thumb_index: int, source_hash: Optional[str]
+) -> tuple[list[int], int]:
+    """Same as ``get_thumb_indexes_to_create``, without the thumbs that
+    have already been uploaded from a source image with the same hash.
+    """
+    indexes, new_thumb_count = get_thumb_indexes_to_create(thumb_count, thumb_index)
+    if source_hash is None:
+        return indexes, new_thumb_count
+    stored_hashes = thumb_storage.get_source_hashes([pc_object.get_thumb_storage_id(index) for index in indexes])
+    indexes = [index for index, stored_hash in zip(indexes, stored_hashes) if stored_hash != source_hash]
+    return indexes, new_thumb_count
+
+
+def _create_thumbs(
+    process_executor: concurrent.futures.ProcessPoolExecutor,
+    image_as_bytes: bytes,
+    storage_ids: list[str],
+) -> None:
+    standardized_image = process_executor.submit(standardize_image, image_as_bytes).result()
+    for storage_id in storage_ids:
+        object_storage.store_public_object(
+            bucket="thumbs",
+            object_id=storage_id,
+            blob=standardized_image,
+            content_type="image/jpeg",
+        )
+
+
+class ThumbsPipeline:
+    def __init__(self, processes: int, upload_threads: int, max_pending: int):
+        self.max_pending = max_pending
+        self._process_executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+        # Each thread waits for the standardization of its image before
+        # uploading it, so there must be enough threads to keep all
+        # processes busy.
+        self._thread_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(upload_threads, processes))
+        self._pending: deque[ThumbJob] = deque()
+        self._done: list[ThumbJob] = []
+        self._jobs_by_object: dict[int, list[ThumbJob]] = {}
+
+    def submit(self, pc_object: Model, key: Any, image_as_bytes: bytes, thumb_index: int) -> None:
+        thumb_count = pc_object.thumbCount
+        previous_jobs_of_object = self._jobs_by_object.setdefault(id(pc_object), [])
+        if previous_jobs_of_object:
+            # Do not upload different images to the same storage id at
+            # the same time, and start from the thumb count that the
+            # object will have once previous jobs are applied.
+            concurrent.futures.wait([job.future for job in previous_jobs_of_object])
+            for job in previous_jobs_of_object:
+                if job.future.exception() is None:
+                    thumb_count = job.new_thumb_count
+        source_hash = thumb_storage.get_source_hash(image_as_bytes)
+        indexes, new_thumb_count = get_thumb_indexes_to_upload(pc_object, thumb_count, thumb_index, source_hash)
+        if indexes:
+            while len(self._pending) >= self.max_pending:
+                job = self._pending.popleft()
+                concurrent.futures.wait([job.future])
+                self._done.append(job)
+            storage_ids = [pc_object.get_thumb_storage_id(index) for index in indexes]
+            future = self._thread_executor.submit(_create_thumbs, self._process_executor, image_as_bytes, storage_ids)
+        else:
+            future = concurrent.futures.Future()
+            future.set_result(None)
+
+        job = ThumbJob(pc_object, key, thumb_count or 0, new_thumb_count, indexes, source_hash, future)
+        self._pending.append(job)
+        previous_jobs_of_object.append(job)
+
+    def join(self) -> list[tuple[ThumbJob, Optional[Exception]]]:
+        """Wait for all submitted thumbs and return each job along with
+        the exception it raised, if any, in the order of submission.
+        """
+        jobs = self._done + list(self._pending)
+        self._done = []
+        self._pending.clear()
+        self._jobs_by_object = {}
+        concurrent.futures.wait([job.future for job in jobs])
+        return [(job, job.future.exception()) for job in jobs]
+
+    def shutdown(self) -> None:
+        self._thread_executor.shutdown()
+        self._process_executor.shutdown()
@@ -20,6 +20,7 @@ END_FILE_IDENTIFIER = "_p.txt"
 class TiteLiveThingDescriptions(LocalProvider):
     name = "TiteLive (Epagine / Place des libraires.com) Descriptions"
     can_create = False
+    current_element_attributes = ("zip_file", "description_zip_info")
 
     def __init__(self):
         super().__init__()
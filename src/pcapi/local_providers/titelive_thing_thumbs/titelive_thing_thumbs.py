@@ -20,6 +20,7 @@ SYNCHONISABLE_FILE_EXTENSION = "_75.jpg"
 class TiteLiveThingThumbs(LocalProvider):
     name = "TiteLive (Epagine / Place des libraires.com) Thumbs"
     can_create = False
+    current_element_attributes = ("zip", "thumb_zipinfo")
 
     def __init__(self):
         super().__init__()
@@ -1,11 +1,9 @@
-from io import BytesIO
-from io import TextIOWrapper
 import logging
 import re
 from typing import Optional
 
-from pcapi.connectors.ftp_titelive import connect_to_titelive_ftp
 from pcapi.connectors.ftp_titelive import get_files_to_process_from_titelive_ftp
+from pcapi.connectors.ftp_titelive import get_lines_from_ftp_file
 from pcapi.core.categories import subcategories
 from pcapi.domain.titelive import get_date_from_filename
 from pcapi.domain.titelive import read_things_date
@@ -16,7 +14,6 @@ from pcapi.models import Product
 from pcapi.models.local_provider_event import LocalProviderEventType
 from pcapi.repository import local_provider_event_queries
 from pcapi.repository import product_queries
-from pcapi.repository.product_queries import ProductWithBookingsException
 from pcapi.utils.string_processing import trim_with_elipsis
 
 
@@ -29,6 +26,7 @@ NUMBER_OF_ELEMENTS_PER_LINE = 46  # (45 elements from line + \n)
 PAPER_PRESS_TVA = "2,10"
 PAPER_PRESS_SUPPORT_CODE = "R"
 UNRELEASED_BOOK_MARKER = "xxx"
+INELIGIBLE_PRODUCTS_BATCH_SIZE = 1_000
 SCHOOL_RELATED_CSR_CODE = [
     "2700",
     "2701",
@@ -83,6 +81,7 @@ SCHOOL_RELATED_CSR_CODE = [
 class TiteLiveThings(LocalProvider):
     name = "TiteLive (Epagine / Place des libraires.com)"
     can_create = True
+    current_element_attributes = ("product_infos", "product_subcategory_id", "product_extra_data")
 
     def __init__(self):
         super().__init__()
@@ -93,6 +92,7 @@ class TiteLiveThings(LocalProvider):
         self.data_lines = None
         self.products_file = None
         self.product_extra_data = {}
+        self.ineligible_isbns = set()
 
     def __next__(self) -> Optional[list[ProvidableInfo]]:
         if self.data_lines is None:
@@ -110,6 +110,9 @@ class TiteLiveThings(LocalProvider):
             return []
 
         self.product_infos = get_infos_from_data_line(elements)
+        # A new dictionary for each line: the one of the previous line
+        # may not have been processed yet (see `LocalProvider`).
+        self.product_extra_data = {}
 
         (
             self.product_subcategory_id,
@@ -120,13 +123,10 @@ class TiteLiveThings(LocalProvider):
         ineligibility_reason = self.get_ineligibility_reason()
         if ineligibility_reason:
             logger.info("Ignoring isbn=%s because reason=%s", book_unique_identifier, ineligibility_reason)
-            try:
-                product_queries.delete_unwanted_existing_product(book_unique_identifier)
-            except ProductWithBookingsException:
-                self.log_provider_event(
-                    LocalProviderEventType.SyncError, f"Error deleting product with ISBN: {self.product_infos['ean13']}"
-                )
+            self.ineligible_isbns.add(book_unique_identifier)
             return []
+        # The product is eligible again: it must not be deleted anymore.
+        self.ineligible_isbns.discard(book_unique_identifier)
 
         if is_unreleased_book(self.product_infos):
             logger.info(
@@ -156,6 +156,31 @@ class TiteLiveThings(LocalProvider):
 
         return None
 
+    def delete_ineligible_products(self) -> None:
+        """Delete (or deactivate if they have bookings) existing products
+        of the ineligible lines that have been read so far.
+        """
+        if not self.ineligible_isbns:
+            return
+        isbns_with_bookings = product_queries.delete_unwanted_existing_products(self.ineligible_isbns)
+        self.ineligible_isbns = set()
+        for isbn in sorted(isbns_with_bookings):
+            self.log_provider_event(LocalProviderEventType.SyncError, "Error deleting product with bookings", isbn)
+
+    def _save_chunks(self, chunk_to_insert: dict, chunk_to_update: dict) -> None:
+        super()._save_chunks(chunk_to_insert, chunk_to_update)
+        # Deleting products commits the session, which would discard the
+        # changes of objects that are waiting in chunks: only do it once
+        # chunks have been saved.
+        if len(self.ineligible_isbns) >= INELIGIBLE_PRODUCTS_BATCH_SIZE:
+            self.delete_ineligible_products()
+
+    def updateObjects(self, limit=None):
+        super().updateObjects(limit)
+        # Lines may not have all been read if there is a limit.
+        self.delete_ineligible_products()
+        self.flush_provider_events()
+
     def fill_object_attributes(self, product: Product):
         product.name = trim_with_elipsis(self.product_infos["titre"], 140)
         product.datePublished = read_things_date(self.product_infos["date_parution"])
@@ -192,16 +217,7 @@ class TiteLiveThings(LocalProvider):
 
 
 def get_lines_from_thing_file(thing_file: str):
-    data_file = BytesIO()
-    data_wrapper = TextIOWrapper(
-        data_file,
-        encoding="iso-8859-1",
-        line_buffering=True,
-    )
-    file_path = "RETR " + THINGS_FOLDER_NAME_TITELIVE + "/" + thing_file
-    connect_to_titelive_ftp().retrbinary(file_path, data_file.write)
-    data_wrapper.seek(0, 0)
-    return iter(data_wrapper.readlines())
+    return get_lines_from_ftp_file(thing_file, THINGS_FOLDER_NAME_TITELIVE, encoding="iso-8859-1")
 
 
 def get_subcategory_and_extra_data_from_titelive_type(titelive_type):
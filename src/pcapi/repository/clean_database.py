@@ -1,4 +1,5 @@
 from pcapi import settings
+from pcapi.core.bookings.models import BookingOutboxEvent
 from pcapi.core.bookings.models import IndividualBooking
 from pcapi.core.educational.models import EducationalBooking
 from pcapi.core.educational.models import EducationalDeposit
@@ -16,6 +17,7 @@ from pcapi.core.offerers.models import VenueType
 from pcapi.core.offers.models import ActivationCode
 from pcapi.core.offers.models import Mediation
 from pcapi.core.offers.models import OfferValidationConfig
+from pcapi.core.offers.models import StockConsistencyCheck
 from pcapi.core.providers.models import AllocineVenueProvider
 from pcapi.core.providers.models import AllocineVenueProviderPriceRule
 from pcapi.core.providers.models import Provider
@@ -58,9 +60,11 @@ def clean_all_database(*args, **kwargs):
     PaymentStatus.query.delete()
     Payment.query.delete()
     PaymentMessage.query.delete()
+    BookingOutboxEvent.query.delete()
     Booking.query.delete()
     IndividualBooking.query.delete()
     Stock.query.delete()
+    StockConsistencyCheck.query.delete()
     Favorite.query.delete()
     Mediation.query.delete()
     OfferCriterion.query.delete()
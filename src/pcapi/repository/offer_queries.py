@@ -1,6 +1,8 @@
 from datetime import datetime
+from typing import Iterator
 
 from sqlalchemy import func
+from sqlalchemy.orm import Query
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm import joinedload
 
@@ -67,12 +69,22 @@ def get_paginated_active_offer_ids(limit: int, page: int) -> list[int]:
     return [offer_id for offer_id, in query]
 
 
-def get_paginated_offer_ids_by_venue_id(venue_id: int, limit: int, page: int) -> list[int]:
-    query = (
-        Offer.query.with_entities(Offer.id)
-        .filter(Offer.venueId == venue_id)
-        .order_by(Offer.id)
-        .offset(page * limit)
-        .limit(limit)
-    )
-    return [offer_id for offer_id, in query]
+def get_offer_ids_in_batches(query: Query, batch_size: int) -> Iterator[list[int]]:
+    """Yield ids of the offers returned by ``query``, by batches of
+    ``batch_size`` ids.
+
+    We use keyset pagination (``Offer.id > last_id``) instead of an
+    offset, so that fetching a batch does not get slower as we go.
+    """
+    query = query.with_entities(Offer.id).order_by(None).order_by(Offer.id)
+    last_id = 0
+    while True:
+        offer_ids = [offer_id for offer_id, in query.filter(Offer.id > last_id).limit(batch_size)]
+        if not offer_ids:
+            break
+        yield offer_ids
+        last_id = offer_ids[-1]
+
+
+def get_offer_ids_by_venue_id_in_batches(venue_id: int, batch_size: int) -> Iterator[list[int]]:
+    return get_offer_ids_in_batches(Offer.query.filter(Offer.venueId == venue_id), batch_size)
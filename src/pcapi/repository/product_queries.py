@@ -1,16 +1,17 @@
+from typing import Collection
 from typing import Optional
 
-import pcapi.core.offers.repository as offers_repository
-from pcapi.core.users.repository import get_favorites_for_offers
-from pcapi.domain.offers import update_is_active_status
+from pcapi.core import search
+from pcapi.core.offers.models import ActivationCode
+from pcapi.core.offers.models import Mediation
+from pcapi.core.users.models import Favorite
 from pcapi.models import Booking
 from pcapi.models import Offer
+from pcapi.models import OfferCriterion
 from pcapi.models import Product
 from pcapi.models import Stock
 from pcapi.models import ThingType
-from pcapi.repository import repository
-from pcapi.repository.mediation_queries import get_mediations_for_offers
-from pcapi.repository.offer_queries import get_offers_by_product_id
+from pcapi.models import db
 
 
 class ProductWithBookingsException(Exception):
@@ -18,33 +19,84 @@ class ProductWithBookingsException(Exception):
 
 
 def delete_unwanted_existing_product(isbn: str):
-    product_has_at_least_one_booking = (
-        Product.query.filter_by(idAtProviders=isbn).join(Offer).join(Stock).join(Booking).count() > 0
+    if delete_unwanted_existing_products([isbn]):
+        raise ProductWithBookingsException
+
+
+def delete_unwanted_existing_products(isbns: Collection[str]) -> set[str]:
+    """Delete active book products that have one of the given ISBNs,
+    along with their offers, stocks (and their activation codes),
+    mediations, favorites and criteria.
+
+    Products that have bookings cannot be deleted: they are marked as
+    not GCU compatible and their offers are deactivated instead. Their
+    ISBNs are returned.
+
+    The number of queries does not depend on the number of ISBNs.
+    """
+    if not isbns:
+        return set()
+
+    products = (
+        db.session.query(Product.id, Product.idAtProviders)
+        .filter(Product.isGcuCompatible)
+        .filter(Product.type == str(ThingType.LIVRE_EDITION))
+        .filter(Product.idAtProviders.in_(isbns))
+        .all()
     )
-    product = find_active_book_product_by_isbn(isbn)
+    if not products:
+        return set()
 
-    if not product:
-        return
+    product_ids = {product.id for product in products}
+    product_ids_with_bookings = {
+        product_id
+        for product_id, in db.session.query(Offer.productId)
+        .join(Stock)
+        .join(Booking)
+        .filter(Offer.productId.in_(product_ids))
+        .distinct()
+    }
+    product_ids_to_delete = product_ids - product_ids_with_bookings
 
-    if product_has_at_least_one_booking:
-        offers = get_offers_by_product_id(product.id)
-        product.isGcuCompatible = False
-        offers = update_is_active_status(offers, False)
-        repository.save(*offers, product)
-        raise ProductWithBookingsException
+    offer_ids_to_deactivate = []
+    if product_ids_with_bookings:
+        offer_ids_to_deactivate = [
+            offer_id for offer_id, in db.session.query(Offer.id).filter(Offer.productId.in_(product_ids_with_bookings))
+        ]
+        Product.query.filter(Product.id.in_(product_ids_with_bookings)).update(
+            {"isGcuCompatible": False}, synchronize_session=False
+        )
+        Offer.query.filter(Offer.id.in_(offer_ids_to_deactivate)).update({"isActive": False}, synchronize_session=False)
+
+    offer_ids_to_delete = []
+    if product_ids_to_delete:
+        offer_ids_to_delete = [
+            offer_id for offer_id, in db.session.query(Offer.id).filter(Offer.productId.in_(product_ids_to_delete))
+        ]
+        if offer_ids_to_delete:
+            # Bulk deletes skip ORM cascades: delete rows that reference
+            # offers and stocks first.
+            stock_ids_to_delete = db.session.query(Stock.id).filter(Stock.offerId.in_(offer_ids_to_delete))
+            ActivationCode.query.filter(ActivationCode.stockId.in_(stock_ids_to_delete.subquery())).delete(
+                synchronize_session=False
+            )
+            OfferCriterion.query.filter(OfferCriterion.offerId.in_(offer_ids_to_delete)).delete(
+                synchronize_session=False
+            )
+            Stock.query.filter(Stock.offerId.in_(offer_ids_to_delete)).delete(synchronize_session=False)
+            Favorite.query.filter(Favorite.offerId.in_(offer_ids_to_delete)).delete(synchronize_session=False)
+            Mediation.query.filter(Mediation.offerId.in_(offer_ids_to_delete)).delete(synchronize_session=False)
+            Offer.query.filter(Offer.id.in_(offer_ids_to_delete)).delete(synchronize_session=False)
+        Product.query.filter(Product.id.in_(product_ids_to_delete)).delete(synchronize_session=False)
+
+    db.session.commit()
+
+    if offer_ids_to_delete:
+        search.unindex_offer_ids(offer_ids_to_delete)
+    if offer_ids_to_deactivate:
+        search.async_index_offer_ids(offer_ids_to_deactivate, priority=search.IndexationPriority.BULK)
 
-    objects_to_delete = []
-    objects_to_delete.append(product)
-    offers = get_offers_by_product_id(product.id)
-    offer_ids = [offer.id for offer in offers]
-    objects_to_delete = objects_to_delete + offers
-    stocks = offers_repository.get_stocks_for_offers(offer_ids)
-    objects_to_delete = objects_to_delete + stocks
-    mediations = get_mediations_for_offers(offer_ids)
-    objects_to_delete = objects_to_delete + mediations
-    favorites = get_favorites_for_offers(offer_ids)
-    objects_to_delete = objects_to_delete + favorites
-    repository.delete(*objects_to_delete)
+    return {product.idAtProviders for product in products if product.id in product_ids_with_bookings}
 
 
 def find_active_book_product_by_isbn(isbn: str) -> Optional[Product]:
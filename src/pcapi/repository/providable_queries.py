@@ -1,64 +1,84 @@
+from collections import defaultdict
 import datetime
+import operator
+from typing import Iterable
 from typing import Optional
 
-from pcapi import models
+from sqlalchemy import inspect
+
 from pcapi.models.db import Model
 from pcapi.models.db import db
 
 
-def insert_chunk(chunk_to_insert: dict):
-    db.session.bulk_save_objects(chunk_to_insert.values(), return_defaults=False)
-    db.session.commit()
-
-
-def update_chunk(chunk_to_update: dict):
-    models_in_chunk = set(_extract_model_name_from_chunk_key(key) for key in chunk_to_update.keys())
-
-    for model_in_chunk in models_in_chunk:
-        matching_tuples_in_chunk = _filter_matching_pc_object_in_chunk(model_in_chunk, chunk_to_update)
-        values_to_update_in_chunk = _extract_dict_values_from_chunk(matching_tuples_in_chunk)
-        model_to_update = getattr(models, model_in_chunk)
+# Columns that are set on every update by local providers. An object
+# on which only these columns have changed is not updated.
+BOOKKEEPING_COLUMNS = {"dateModifiedAtLastProvider"}
 
-        db.session.bulk_update_mappings(model_to_update, values_to_update_in_chunk)
-    db.session.commit()
 
-
-def _filter_matching_pc_object_in_chunk(model_in_chunk: Model, chunk_to_update: dict) -> list[Model]:
-    return list(
-        filter(lambda item: _extract_model_name_from_chunk_key(item[0]) == model_in_chunk, chunk_to_update.items())
-    )
+def insert_chunk(chunk_to_insert: dict):
+    db.session.bulk_save_objects(chunk_to_insert.values(), return_defaults=False)
 
 
-def _extract_dict_values_from_chunk(matching_tuples_in_chunk: list[Model]) -> list[dict]:
-    return list(dictify_pc_object(pc_object_item) for pc_object_key, pc_object_item in matching_tuples_in_chunk)
+def get_update_mappings(chunk_to_update: dict) -> tuple[dict, set[str]]:
+    """Return the columns that have changed on the objects of the chunk,
+    by mapper, and the keys of the objects that have no effective change.
+
+    Changes are read from the attribute history of objects: this must
+    be called before the session is committed, which expires objects.
+    """
+    mappings_by_mapper = defaultdict(list)
+    unchanged_keys = set()
+    for chunk_key, pc_object in chunk_to_update.items():
+        state = inspect(pc_object)
+        mapping = get_changed_values(pc_object)
+        if not set(mapping) - BOOKKEEPING_COLUMNS:
+            unchanged_keys.add(chunk_key)
+        else:
+            for column in state.mapper.primary_key:
+                key = state.mapper.get_property_by_column(column).key
+                mapping[key] = state.attrs[key].value
+            mappings_by_mapper[state.mapper].append(mapping)
+        if state.session is not None:
+            # Changes are written by `update_chunk()` (or discarded),
+            # they must not be flushed again on commit.
+            state.session.expire(pc_object)
+    return mappings_by_mapper, unchanged_keys
+
+
+def update_chunk(mappings_by_mapper: dict) -> None:
+    for mapper, mappings in mappings_by_mapper.items():
+        # Update rows in the same order as concurrent synchronizations
+        # (e.g. Allociné theaters that share products) to avoid deadlocks.
+        primary_key = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+        mappings.sort(key=operator.itemgetter(*primary_key))
+        db.session.bulk_update_mappings(mapper, mappings)
+
+
+def get_changed_values(pc_object: Model) -> dict:
+    """Return the new value of each column whose value has changed
+    since the object has been loaded (or last flushed).
+
+    Setting an attribute to a value that is equal to its current value
+    is not a change.
+    """
+    state = inspect(pc_object)
+    changed_values = {}
+    for attribute in state.mapper.column_attrs:
+        if state.attrs[attribute.key].history.has_changes():
+            changed_values[attribute.key] = state.attrs[attribute.key].value
+    return changed_values
 
 
 def get_existing_object(model_type: Model, id_at_providers: str) -> Optional[dict]:
     return model_type.query.filter_by(idAtProviders=id_at_providers).one_or_none()
 
 
+def get_existing_objects(model_type: Model, ids_at_providers: Iterable[str]) -> list[Model]:
+    return model_type.query.filter(model_type.idAtProviders.in_(ids_at_providers)).all()
+
+
 def get_last_update_for_provider(provider_id: int, pc_obj: Model) -> datetime:
     if pc_obj.lastProviderId == provider_id:
         return pc_obj.dateModifiedAtLastProvider if pc_obj.dateModifiedAtLastProvider else None
     return None
 
-
-def dictify_pc_object(object_to_update: Model) -> dict:
-    dict_to_update = object_to_update.__dict__.copy()
-    if "_sa_instance_state" in dict_to_update:
-        del dict_to_update["_sa_instance_state"]
-    if "datePublished" in dict_to_update:
-        del dict_to_update["datePublished"]
-    if "venue" in dict_to_update:
-        del dict_to_update["venue"]
-    if "offer" in dict_to_update:
-        del dict_to_update["offer"]
-    if "stocks" in dict_to_update:
-        del dict_to_update["stocks"]
-    if "remainingQuantity" in dict_to_update:
-        del dict_to_update["remainingQuantity"]
-    return dict_to_update
-
-
-def _extract_model_name_from_chunk_key(chunk_key: str) -> str:
-    return chunk_key.split("|")[1]
@@ -1,4 +1,8 @@
+from typing import Iterable
+
+from pcapi.models import Offerer
 from pcapi.models import Venue
+from pcapi.models import db
 
 
 def find_by_id(venue_id: int) -> Venue:
@@ -15,3 +19,24 @@ def find_by_managing_offerer_id(offerer_id: int) -> Venue:
 
 def find_by_offerer_id_and_is_virtual(offrer_id: int):
     return Venue.query.filter_by(managingOffererId=offrer_id, isVirtual=True).first()
+
+
+def get_indexed_fields_by_ids(venue_ids: Iterable[int]) -> list:
+    """Return the fields of the given venues (and of their offerer)
+    that are copied in the search documents of their offers, without
+    loading ``Venue`` objects.
+    """
+    return (
+        db.session.query(
+            Venue.id,
+            Venue.name,
+            Venue.publicName,
+            Venue.latitude,
+            Venue.longitude,
+            Venue.departementCode,
+            Offerer.name.label("offererName"),
+        )
+        .join(Offerer, Venue.managingOffererId == Offerer.id)
+        .filter(Venue.id.in_(venue_ids))
+        .all()
+    )
@@ -12,10 +12,12 @@ from flask import Flask
 import pcapi.models  # pylint: disable=unused-import
 from pcapi import settings
 import pcapi.core.bookings.api as bookings_api
+from pcapi.core.bookings.outbox import process_booking_outbox
 from pcapi.core.logging import install_logging
-from pcapi.core.offers.repository import check_stock_consistency
 from pcapi.core.offers.repository import delete_past_draft_offers
 from pcapi.core.offers.repository import find_tomorrow_event_stock_ids
+from pcapi.core.offers.stock_consistency import check_all_stocks_consistency
+from pcapi.core.offers.stock_consistency import check_recent_stock_consistency
 from pcapi.core.providers.repository import get_provider_by_local_class
 from pcapi.core.users import api as users_api
 from pcapi.core.users.repository import get_newly_eligible_users
@@ -54,7 +56,9 @@ def update_booking_used(app: Flask) -> None:
 @cron_require_feature(FeatureToggle.SYNCHRONIZE_ALLOCINE)
 def synchronize_allocine_stocks(app: Flask) -> None:
     allocine_stocks_provider_id = get_provider_by_local_class("AllocineStocks").id
-    synchronize_venue_providers_for_provider(allocine_stocks_provider_id)
+    synchronize_venue_providers_for_provider(
+        allocine_stocks_provider_id, pool_size=settings.ALLOCINE_SYNC_WORKERS_POOL_SIZE
+    )
 
 
 @log_cron
@@ -108,6 +112,15 @@ def pc_handle_expired_bookings(app: Flask) -> None:
     handle_expired_bookings()
 
 
+@log_cron
+@cron_context
+def pc_process_booking_outbox(app: Flask) -> None:
+    # Booking side effects are normally processed by a job enqueued
+    # after each booking. This catches up if the job could not be
+    # enqueued or has failed.
+    process_booking_outbox()
+
+
 @log_cron
 @cron_context
 def pc_notify_soon_to_be_expired_bookings(app: Flask) -> None:
@@ -134,9 +147,13 @@ def pc_clean_expired_tokens(app: Flask) -> None:
 @log_cron
 @cron_context
 def pc_check_stock_quantity_consistency(app: Flask) -> None:
-    inconsistent_stocks = check_stock_consistency()
-    if inconsistent_stocks:
-        logger.error("Found inconsistent stocks: %s", ", ".join([str(stock_id) for stock_id in inconsistent_stocks]))
+    check_recent_stock_consistency()
+
+
+@log_cron
+@cron_context
+def pc_check_all_stocks_quantity_consistency(app: Flask) -> None:
+    check_all_stocks_consistency()
 
 
 @log_cron
@@ -188,6 +205,8 @@ def main() -> None:
         hour="5",
     )
 
+    scheduler.add_job(pc_process_booking_outbox, "cron", [app], minute="*/5")
+
     scheduler.add_job(
         pc_notify_soon_to_be_expired_bookings,
         "cron",
@@ -203,6 +222,8 @@ def main() -> None:
 
     scheduler.add_job(pc_check_stock_quantity_consistency, "cron", [app], day="*", hour="1")
 
+    scheduler.add_job(pc_check_all_stocks_quantity_consistency, "cron", [app], day_of_week="sun", hour="4")
+
     scheduler.add_job(pc_send_tomorrow_events_notifications, "cron", [app], day="*", hour="16")
 
     scheduler.add_job(pc_clean_past_draft_offers, "cron", [app], day="*", hour="20")
@@ -16,6 +16,14 @@ def process_offers():
         search.index_offers_in_queue(stop_only_when_empty=True)
 
 
+@app.manager.command
+def offers_queue_stats():
+    with app.app_context():
+        for backend, lanes in search.get_offer_queue_stats().items():
+            for lane, stats in lanes.items():
+                print(f"{backend} [{lane}]: {stats['count']} offers, oldest age (s): {stats['oldest_age']}")
+
+
 @app.manager.command
 def process_offers_by_venue():
     with app.app_context():
@@ -0,0 +1,13 @@
+from flask import current_app as app
+
+from pcapi.core.offers import stock_consistency
+
+
+@app.manager.option("-a", "--all", action="store_true", dest="check_all", help="Check all stocks, not only recent ones")
+@app.manager.option("-r", "--repair", action="store_true", dest="repair", help="Fix the booked quantity of stocks")
+def check_stock_consistency(check_all: bool = False, repair: bool = False) -> None:
+    if check_all:
+        inconsistent_stock_ids = stock_consistency.check_all_stocks_consistency(repair=repair)
+    else:
+        inconsistent_stock_ids = stock_consistency.check_recent_stock_consistency(repair=repair)
+    print(f"{len(inconsistent_stock_ids)} stocks do not match bookings: {inconsistent_stock_ids}")
@@ -2,27 +2,91 @@ import datetime
 from itertools import groupby
 import logging
 from operator import attrgetter
+from typing import NamedTuple
+from typing import Optional
 
 from pcapi import settings
-from pcapi.core.bookings.api import recompute_dnBookedQuantity
-from pcapi.core.bookings.models import Booking
+from pcapi.core.bookings.conf import BOOKINGS_AUTO_EXPIRY_DELAY
 from pcapi.core.bookings.models import BookingCancellationReasons
 from pcapi.core.bookings.models import BookingStatus
 import pcapi.core.bookings.repository as bookings_repository
 from pcapi.domain.user_emails import send_expired_bookings_recap_email_to_beneficiary
 from pcapi.domain.user_emails import send_expired_bookings_recap_email_to_offerer
 from pcapi.models import db
+from pcapi.models.offer_type import EXPIRABLE_OFFER_TYPES
 
 
 logger = logging.getLogger(__name__)
 
+# Bookings of things that have been neither used nor cancelled within
+# `BOOKINGS_AUTO_EXPIRY_DELAY`.
+FIND_EXPIRING_BOOKINGS_QUERY = """
+    SELECT booking.id, booking."stockId"
+    FROM booking
+    JOIN stock ON stock.id = booking."stockId"
+    JOIN offer ON offer.id = stock."offerId"
+    WHERE NOT booking."isCancelled"
+    AND NOT booking."isUsed"
+    AND booking."dateCreated" <= :created_before
+    AND offer.type IN :expirable_offer_types
+    ORDER BY booking.id
+    LIMIT :batch_size
+"""
+
+# Lock stocks before bookings, in the same order as `_cancel_booking()`
+# and `mark_as_used_with_uncancelling()`, to avoid deadlocks.
+LOCK_STOCKS_QUERY = """
+    SELECT id FROM stock WHERE id IN :stock_ids ORDER BY id FOR UPDATE
+"""
+
+# Cancel the given bookings (unless they have been used or cancelled
+# in the meantime) and decrement the booked quantity of their stocks, in
+# one statement.
+CANCEL_BOOKINGS_QUERY = """
+    WITH cancelled_booking AS (
+        UPDATE booking
+        SET
+          "isCancelled" = true,
+          status = :status,
+          "cancellationReason" = :cancellation_reason,
+          "cancellationDate" = :now
+        WHERE booking.id IN :booking_ids
+        AND NOT booking."isCancelled"
+        AND NOT booking."isUsed"
+        RETURNING booking.id, booking."stockId", booking."userId", booking."offererId", booking.quantity
+    ),
+    cancelled_quantity_per_stock AS (
+        UPDATE stock
+        SET "dnBookedQuantity" = stock."dnBookedQuantity" - cancelled_quantity.quantity
+        FROM (
+          SELECT "stockId", SUM(quantity) AS quantity
+          FROM cancelled_booking
+          GROUP BY "stockId"
+        ) AS cancelled_quantity
+        WHERE stock.id = cancelled_quantity."stockId"
+    )
+    SELECT id, "stockId", "userId", "offererId"
+    FROM cancelled_booking
+    ORDER BY id
+"""
+
+
+class ExpiredBooking(NamedTuple):
+    id: int
+    stockId: int
+    userId: Optional[int]
+    offererId: int
+
 
 def handle_expired_bookings() -> None:
     logger.info("[handle_expired_bookings] Start")
 
+    # If cancellation fails, notifications fall back to looking for
+    # bookings that have expired today.
+    expired_bookings = None
     try:
         logger.info("[handle_expired_bookings] STEP 1 : cancel_expired_bookings()")
-        cancel_expired_bookings()
+        expired_bookings = cancel_expired_bookings()
     except Exception as e:  # pylint: disable=broad-except
         logger.exception("[handle_expired_bookings] Error in STEP 1 : %s", e)
     if settings.IS_STAGING:
@@ -30,79 +94,87 @@ def handle_expired_bookings() -> None:
     else:
         try:
             logger.info("[handle_expired_bookings] STEP 2 : notify_users_of_expired_bookings()")
-            notify_users_of_expired_bookings()
+            notify_users_of_expired_bookings(expired_bookings=expired_bookings)
         except Exception as e:  # pylint: disable=broad-except
             logger.exception("[handle_expired_bookings] Error in STEP 2 : %s", e)
 
         try:
             logger.info("[handle_expired_bookings] STEP 3 : notify_offerers_of_expired_bookings()")
-            notify_offerers_of_expired_bookings()
+            notify_offerers_of_expired_bookings(expired_bookings=expired_bookings)
         except Exception as e:  # pylint: disable=broad-except
             logger.exception("[handle_expired_bookings] Error in STEP 3 : %s", e)
 
     logger.info("[handle_expired_bookings] End")
 
 
-def cancel_expired_bookings(batch_size: int = 500) -> None:
+def cancel_expired_bookings(batch_size: int = 5_000) -> list[ExpiredBooking]:
+    """Cancel expiring bookings by batches, and return the cancelled
+    bookings.
+    """
     logger.info("[cancel_expired_bookings] Start")
 
-    expiring_bookings_count = bookings_repository.find_expiring_bookings().count()
-    logger.info("[cancel_expired_bookings] %d expiring bookings to cancel", expiring_bookings_count)
-    if expiring_bookings_count == 0:
-        logger.info("[cancel_expired_bookings] End")
-        return
-
-    updated_total = 0
-    expiring_booking_ids = bookings_repository.find_expiring_bookings_ids().limit(batch_size).all()
-    max_id = expiring_booking_ids[-1][0]
+    today_at_midnight = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0))
+    params = {
+        "created_before": today_at_midnight - BOOKINGS_AUTO_EXPIRY_DELAY,
+        "expirable_offer_types": tuple(EXPIRABLE_OFFER_TYPES),
+        "batch_size": batch_size,
+    }
 
-    # we commit here to make sure there is no unexpected objects in SQLA cache before the update,
-    # as we use synchronize_session=False
+    # we commit here to make sure there is no unexpected objects in SQLA cache before the update
     db.session.commit()
 
-    while expiring_booking_ids:
-        updated = (
-            Booking.query.filter(Booking.id <= max_id)
-            .filter(Booking.id.in_(expiring_booking_ids))
-            .update(
-                {
-                    "isCancelled": True,
-                    "status": BookingStatus.CANCELLED,
-                    "cancellationReason": BookingCancellationReasons.EXPIRED,
-                    "cancellationDate": datetime.datetime.utcnow(),
-                },
-                synchronize_session=False,
-            )
+    expired_bookings: list[ExpiredBooking] = []
+    while True:
+        expiring_bookings = db.session.execute(FIND_EXPIRING_BOOKINGS_QUERY, params).fetchall()
+        if not expiring_bookings:
+            break
+        db.session.execute(
+            LOCK_STOCKS_QUERY, {"stock_ids": tuple(sorted({stock_id for _booking_id, stock_id in expiring_bookings}))}
         )
-        # Recompute denormalized stock quantity
-        stocks_to_recompute = [
-            row[0]
-            for row in db.session.query(Booking.stockId).filter(Booking.id.in_(expiring_booking_ids)).distinct().all()
-        ]
-        recompute_dnBookedQuantity(stocks_to_recompute)
+        rows = db.session.execute(
+            CANCEL_BOOKINGS_QUERY,
+            {
+                "booking_ids": tuple(booking_id for booking_id, _stock_id in expiring_bookings),
+                "status": BookingStatus.CANCELLED.name,
+                "cancellation_reason": BookingCancellationReasons.EXPIRED.name,
+                "now": datetime.datetime.utcnow(),
+            },
+        )
+        cancelled_bookings = [ExpiredBooking(*row) for row in rows]
         db.session.commit()
 
-        updated_total += updated
-        expiring_booking_ids = bookings_repository.find_expiring_bookings_ids().limit(batch_size).all()
-        if expiring_booking_ids:
-            max_id = expiring_booking_ids[-1][0]
+        expired_bookings.extend(cancelled_bookings)
         logger.info(
             "[cancel_expired_bookings] %d Bookings have been cancelled in this batch",
-            updated,
+            len(cancelled_bookings),
         )
+        if len(expiring_bookings) < batch_size:
+            break
 
     logger.info(
         "[cancel_expired_bookings] %d Bookings have been cancelled",
-        updated_total,
+        len(expired_bookings),
     )
     logger.info("[cancel_expired_bookings] End")
+    return expired_bookings
 
 
-def notify_users_of_expired_bookings(expired_on: datetime.date = None) -> None:
+def notify_users_of_expired_bookings(
+    expired_on: datetime.date = None, expired_bookings: Optional[list[ExpiredBooking]] = None
+) -> None:
+    """Notify users of the bookings that have been cancelled by
+    ``cancel_expired_bookings()``, or of all bookings that have expired
+    on ``expired_on`` if they are not given.
+    """
     expired_on = expired_on or datetime.date.today()
 
     logger.info("[notify_users_of_expired_bookings] Start")
-    expired_bookings_ordered_by_user = bookings_repository.find_expired_bookings_ordered_by_user(expired_on)
+    if expired_bookings is None:
+        expired_bookings_ordered_by_user = bookings_repository.find_expired_bookings_ordered_by_user(expired_on)
+    else:
+        expired_bookings_ordered_by_user = bookings_repository.find_by_ids_ordered_by_user(
+            [booking.id for booking in expired_bookings if booking.userId is not None]
+        )
 
     expired_bookings_grouped_by_user = dict()
     for user, booking in groupby(expired_bookings_ordered_by_user, attrgetter("user")):
@@ -123,11 +195,22 @@ def notify_users_of_expired_bookings(expired_on: datetime.date = None) -> None:
     logger.info("[notify_users_of_expired_bookings] End")
 
 
-def notify_offerers_of_expired_bookings(expired_on: datetime.date = None) -> None:
+def notify_offerers_of_expired_bookings(
+    expired_on: datetime.date = None, expired_bookings: Optional[list[ExpiredBooking]] = None
+) -> None:
+    """Notify offerers of the bookings that have been cancelled by
+    ``cancel_expired_bookings()``, or of all bookings that have expired
+    on ``expired_on`` if they are not given.
+    """
     expired_on = expired_on or datetime.date.today()
     logger.info("[notify_offerers_of_expired_bookings] Start")
 
-    expired_bookings_ordered_by_offerer = bookings_repository.find_expired_bookings_ordered_by_offerer(expired_on)
+    if expired_bookings is None:
+        expired_bookings_ordered_by_offerer = bookings_repository.find_expired_bookings_ordered_by_offerer(expired_on)
+    else:
+        expired_bookings_ordered_by_offerer = bookings_repository.find_by_ids_ordered_by_offerer(
+            [booking.id for booking in expired_bookings]
+        )
     expired_bookings_grouped_by_offerer = dict()
     for offerer, booking in groupby(
         expired_bookings_ordered_by_offerer, attrgetter("stock.offer.venue.managingOfferer")
@@ -6,20 +6,33 @@ unindexed, as we suppose that the offer has already been unindexed
 through the normally-run code. (That way, this script skips a lot of
 unnecessary unindexation requests.)
 
-This script processes batches of 1.000 offers (note that HTTP requests
-to App Search cannot have include more than 100 offers) and reports
-back every 10.000 offers.
+The requested range of ids is split into shards. Each shard is
+processed by batches of 1.000 offers (note that HTTP requests to App
+Search cannot have include more than 100 offers), using keyset
+pagination (``Offer.id > last_id``). Each shard reports back every
+10.000 offers with its throughput and ETA. Offers whose document has
+not changed since the last indexation are skipped (and counted in
+reports), unless ``--force`` is given: use it to repair an index that
+has drifted from the stored fingerprints.
 
-Errors are logged and are not blocking. You can see the batch that
-failed in the logs and should re-run any batch that failed.
+Shards are processed in parallel by a pool of processes if
+``--processes`` is greater than 1.
 
-Obviously, the script takes a lot of time. You should run multiple
-instances of it at the same time.
+The last indexed id of each shard is stored in Redis after each batch
+that has been successfully indexed. If the script is stopped (or
+crashes), running it again with the same range and the same number of
+shards resumes each shard where it stopped. Use ``--restart`` to
+ignore (and clear) previous checkpoints, e.g. to change the number of
+shards.
+
+Errors are logged and stop the shard in which they occurred (other
+shards go on). Run the script again to resume failed shards from the
+batch that failed.
 
 Usage:
 
     $ python full_index_offers.py 10 10_000_000
-    $ python full_index_offers.py 10_000_000 20_000_000
+    $ python full_index_offers.py 10 20_000_000 --processes 8 --shards 32
 
 Using "_" as thousands separator is supported.
 """
@@ -31,92 +44,223 @@ app.app_context().push()
 import argparse
 import datetime
 import logging
-import statistics
+import multiprocessing
 import time
 
+from flask import current_app
 import pytz
-from sqlalchemy.orm import joinedload
 
+from pcapi.core import search
 from pcapi.core.search.backends import appsearch
-import pcapi.core.offerers.models as offerers_models
 import pcapi.core.offers.models as offers_models
+from pcapi.models import db
 
 
-appsearch.AppSearchBackend.unindex_offer_ids = lambda *args, **kwargs: 1
-
 BATCH_SIZE = 1_000
 REPORT_EVERY = 10_000
+REDIS_CHECKPOINTS_NAME_TEMPLATE = "search:appsearch:full-index-checkpoints:{start}-{end}"
+# Checkpoints are only valid for the number of shards that they have
+# been recorded with, which is stored along with them.
+REDIS_CHECKPOINTS_SHARDS_KEY = "shards"
 
 logger = logging.getLogger(__name__)
 
 
-def _get_eta(end, current, elapsed_per_batch):
-    left_to_do = end - current
-    eta = left_to_do / BATCH_SIZE * statistics.mean(elapsed_per_batch)
+class ShardFailed(Exception):
+    pass
+
+
+def _get_checkpoints_name(start, end):
+    return REDIS_CHECKPOINTS_NAME_TEMPLATE.format(start=start, end=end)
+
+
+def _get_shards(start, end, n_shards):
+    """Split the ``[start, end]`` range of ids into ``n_shards``
+    contiguous (and inclusive) ranges.
+    """
+    size = max((end - start + 1) // n_shards, 1)
+    shards = []
+    shard_start = start
+    while shard_start <= end:
+        shard_end = min(shard_start + size - 1, end)
+        if len(shards) == n_shards - 1:
+            shard_end = end
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end + 1
+    return shards
+
+
+def _get_eta(shard_start, shard_end, last_id, elapsed):
+    # Ids are not contiguous, so we estimate the progress from the
+    # position of the last indexed id in the shard.
+    done = last_id - shard_start + 1
+    left_to_do = shard_end - last_id
+    if done <= 0 or elapsed <= 0:
+        return "?"
+    eta = left_to_do * elapsed / done
     eta = datetime.datetime.now() + datetime.timedelta(seconds=eta)
     eta = eta.astimezone(pytz.timezone("Europe/Paris"))
     eta = eta.strftime("%d/%m/%Y %H:%M:%S")
     return eta
 
 
-def full_index_offers(start, end):
-    backend = appsearch.AppSearchBackend()
+def _index_batch(backend, offers, skip_unchanged=True):
+    """Index the given offers and return the number of offers that
+    have been skipped because they have not changed, or None if the
+    batch failed.
+    """
+    try:
+        return backend.index_offers(offers, skip_unchanged=skip_unchanged)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception(
+            "Full offer reindexation: error while reindexing from %d to %d: %s", offers[0].id, offers[-1].id, exc
+        )
+        return None
 
-    queue = []
 
-    def enqueue_or_index(q, offer, force_index=False):
-        if offer:
-            q.append(offer)
-        if force_index or len(q) > BATCH_SIZE:
-            try:
-                backend.index_offers(q)
-            except Exception as exc:  # pylint: disable=broad-except
-                logger.exception(
-                    "Full offer reindexation: error while reindexing from %d to %d: %s", q[0].id, q[-1].id, exc
-                )
-            q.clear()
+def index_shard(checkpoints_name, shard_start, shard_end, skip_unchanged=True):
+    backend = appsearch.AppSearchBackend()
+    redis_client = current_app.redis_client
+    shard_key = f"{shard_start}-{shard_end}"
 
-    to_report = 0
-    elapsed_per_batch = []
+    checkpoint = redis_client.hget(checkpoints_name, shard_key)
+    last_id = int(checkpoint) if checkpoint is not None else shard_start - 1
+    if last_id >= shard_end:
+        print(f"[{shard_key}] already done")
+        return 0, 0
+    if checkpoint is not None:
+        print(f"[{shard_key}] resuming after offer {last_id}")
 
-    while start <= end:
-        start_time = time.perf_counter()
+    start_time = time.perf_counter()
+    first_id = last_id + 1
+    processed = 0
+    skipped = 0
+    to_report = 0
+    while last_id < shard_end:
         offers = (
-            offers_models.Offer.query.options(
-                joinedload(offers_models.Offer.venue).joinedload(offerers_models.Venue.managingOfferer)
+            search.get_base_query_for_offer_indexation()
+            .filter(
+                offers_models.Offer.isActive == True,
+                offers_models.Offer.id > last_id,
+                offers_models.Offer.id <= shard_end,
             )
-            .options(joinedload(offers_models.Offer.criteria))
-            .options(joinedload(offers_models.Offer.mediations))
-            .options(joinedload(offers_models.Offer.product))
-            .options(joinedload(offers_models.Offer.stocks))
-            .filter(offers_models.Offer.isActive == True, offers_models.Offer.id.between(start, start + BATCH_SIZE))
             .order_by(offers_models.Offer.id)
+            .limit(BATCH_SIZE)
+            .all()
         )
-        for offer in offers:
-            if offer.isBookable:
-                enqueue_or_index(queue, offer)
-        elapsed_per_batch.append(int(time.perf_counter() - start_time))
-        start = start + BATCH_SIZE
-        eta = _get_eta(end, start, elapsed_per_batch)
-        to_report += BATCH_SIZE
-        if to_report > REPORT_EVERY:
+        if not offers:
+            last_id = shard_end
+        else:
+            bookable_offers = [offer for offer in offers if offer.isBookable]
+            if bookable_offers:
+                batch_skipped = _index_batch(backend, bookable_offers, skip_unchanged=skip_unchanged)
+                if batch_skipped is None:
+                    # Do not move the checkpoint: the next run will
+                    # resume from this batch.
+                    print(f"  => [{shard_key}] FAILED after {last_id}, run again to resume")
+                    raise ShardFailed()
+                skipped += batch_skipped
+            last_id = offers[-1].id
+            processed += len(offers)
+            to_report += len(offers)
+        redis_client.hset(checkpoints_name, shard_key, last_id)
+        # Release loaded offers, they are not needed anymore.
+        db.session.expunge_all()
+
+        if to_report >= REPORT_EVERY or last_id >= shard_end:
             to_report = 0
-            print(f"  => OK: {start} | eta = {eta}")
-    enqueue_or_index(queue, offer=None, force_index=True)
+            elapsed = time.perf_counter() - start_time
+            rate = processed / elapsed if elapsed else 0
+            eta = _get_eta(first_id, shard_end, last_id, elapsed)
+            print(
+                f"  => [{shard_key}] OK: {last_id} | {rate:.0f} offers/s | "
+                f"skipped (unchanged) = {skipped} | eta = {eta}"
+            )
+    return processed, skipped
+
+
+def _init_worker():
+    # Each process must have its own connections to the database.
+    db.engine.dispose()
+
+
+def _index_shard_in_worker(args):
+    """Return the number of processed and skipped offers, and whether
+    the shard failed.
+    """
+    checkpoints_name, shard_start, shard_end, skip_unchanged = args
+    try:
+        return (*index_shard(checkpoints_name, shard_start, shard_end, skip_unchanged=skip_unchanged), False)
+    except ShardFailed:
+        return 0, 0, True
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("Full offer reindexation: shard %d-%d failed: %s", shard_start, shard_end, exc)
+        return 0, 0, True
+
+
+def _check_checkpoints(checkpoints_name, n_shards):
+    redis_client = current_app.redis_client
+    stored = redis_client.hget(checkpoints_name, REDIS_CHECKPOINTS_SHARDS_KEY)
+    if stored is not None and int(stored) != n_shards:
+        raise ValueError(
+            f"Checkpoints of a previous run have been recorded with {int(stored)} shards, not {n_shards}. "
+            "Use the same number of shards (and processes) to resume, or --restart."
+        )
+    redis_client.hset(checkpoints_name, REDIS_CHECKPOINTS_SHARDS_KEY, n_shards)
+
+
+def full_index_offers(start, end, processes=1, n_shards=None, restart=False, force=False):
+    checkpoints_name = _get_checkpoints_name(start, end)
+    if restart:
+        current_app.redis_client.delete(checkpoints_name)
+    shards = _get_shards(start, end, n_shards or processes)
+    _check_checkpoints(checkpoints_name, len(shards))
+    tasks = [(checkpoints_name, shard_start, shard_end, not force) for shard_start, shard_end in shards]
+
+    start_time = time.perf_counter()
+    if processes > 1:
+        db.session.remove()
+        with multiprocessing.Pool(processes=processes, initializer=_init_worker) as pool:
+            results = pool.map(_index_shard_in_worker, tasks, chunksize=1)
+    else:
+        results = [_index_shard_in_worker(task) for task in tasks]
+
+    processed = sum(result[0] for result in results)
+    skipped = sum(result[1] for result in results)
+    failed = sum(1 for result in results if result[2])
+    elapsed = time.perf_counter() - start_time
+    rate = processed / elapsed if elapsed else 0
+    print(f"Done. Processed {processed} offers ({rate:.0f} offers/s), skipped {skipped} unchanged offers.")
+    if failed:
+        print(f"{failed} shards failed, run again (without --restart) to resume them.")
 
 
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("start", type=int, help="Offer id to start from (included)")
     parser.add_argument("end", type=int, help="Offer id to end to (included)")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes to run in parallel")
+    parser.add_argument("--shards", type=int, help="Number of shards to split the range into (default: processes)")
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints of a previous run")
+    parser.add_argument("--force", action="store_true", help="Index offers even if they have not changed")
     return parser
 
 
 def main():
+    # Offers that are not bookable are not unindexed (see above).
+    appsearch.AppSearchBackend.unindex_offer_ids = lambda *args, **kwargs: 1
     parser = get_parser()
     args = parser.parse_args()
     assert args.start <= args.end
-    full_index_offers(args.start, args.end)
+    assert args.processes >= 1
+    full_index_offers(
+        args.start,
+        args.end,
+        processes=args.processes,
+        n_shards=args.shards,
+        restart=args.restart,
+        force=args.force,
+    )
 
 
 if __name__ == "__main__":
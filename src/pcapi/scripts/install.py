@@ -1,6 +1,7 @@
 def install_scripts():
     # pylint: disable=unused-import
     import pcapi.scripts.algolia_indexing.commands
+    import pcapi.scripts.booking.commands
     import pcapi.scripts.clean_database
     import pcapi.scripts.install_data
     import pcapi.scripts.offerer.commands
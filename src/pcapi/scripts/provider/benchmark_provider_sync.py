@@ -0,0 +1,476 @@
+"""Benchmark provider synchronizations by replaying recorded fixtures.
+
+Files of the FTP of Titelive and responses of the Allociné API and of
+the provider API are served from a local directory, and synchronized
+into a scratch database through the same code as the nightly
+synchronizations (``LocalProvider.updateObjects()`` and
+``synchronize_provider_api.synchronize_venue_provider()``).
+
+THE DATABASE IS EMPTIED BEFORE THE BENCHMARK. This script can only run
+in the development and testing environments.
+
+Fixtures directory (each part is optional, scenarios without fixtures
+are skipped)::
+
+    titelive/livre3_11/*.tit          # TiteLive things (products)
+    titelive/Atoo/*.zip               # TiteLive thumbs
+    allocine/theaters/<theater>.json  # Allociné showtimes of a theater
+    allocine/posters/<file name>      # posters, by file name of their URL
+    provider_api/<siret>/*.json       # pages of stocks, in order of file names
+
+File names of Titelive must contain their date, like on the FTP. Stocks
+of the provider API only match products that exist in the database,
+i.e. those of the Titelive fixtures.
+
+For each scenario, the script reports the number of processed rows per
+second, the number of SQL queries per row, the peak RSS of the process
+and how time is split between the database, thumbs and everything else
+(downloading, parsing and building objects). Thumbs are measured as the
+time the synchronization waits for them, without the queries they run.
+The ``COPY`` of the provider API stocks does not go through SQLAlchemy
+and is not counted as a query.
+
+With ``--passes 2`` (or more), fixtures are synchronized again on the
+same data, which measures the update of existing objects.
+
+Usage:
+
+    $ python benchmark_provider_sync.py fixtures/ --save-baseline baseline.json
+    $ python benchmark_provider_sync.py fixtures/ --baseline baseline.json
+
+The script exits with status 1 if a metric is worse than the baseline
+by more than ``--tolerance``.
+"""
+# isort:skip_file
+from pcapi.flask_app import app
+
+app.app_context().push()
+
+import argparse
+import contextlib
+import dataclasses
+import functools
+import json
+import pathlib
+import resource
+import sys
+import threading
+import time
+from typing import Callable
+from typing import Optional
+from unittest import mock
+from urllib.parse import urlparse
+
+import sqlalchemy
+
+from pcapi.connectors import api_allocine
+from pcapi.connectors import ftp_titelive
+from pcapi.core.offerers import factories as offerers_factories
+from pcapi.core.providers.models import AllocineVenueProvider
+from pcapi.core.providers.models import Provider
+from pcapi.core.providers.models import VenueProvider
+from pcapi.domain.allocine import movie_posters_cache
+from pcapi.infrastructure.repository.stock_provider import provider_api
+from pcapi.local_providers import AllocineStocks
+from pcapi.local_providers import TiteLiveThingThumbs
+from pcapi.local_providers import TiteLiveThings
+from pcapi.local_providers.local_provider import LocalProvider
+from pcapi.local_providers.provider_api import synchronize_provider_api
+from pcapi.local_providers.titelive_thing_thumbs.titelive_thing_thumbs import THUMB_FOLDER_NAME_TITELIVE
+from pcapi.local_providers.titelive_things.titelive_things import THINGS_FOLDER_NAME_TITELIVE
+from pcapi.models import LocalProviderEvent
+from pcapi.models.db import db
+from pcapi.repository.clean_database import clean_all_database
+
+
+TITELIVE_DIR = "titelive"
+ALLOCINE_THEATERS_DIR = "allocine/theaters"
+ALLOCINE_POSTERS_DIR = "allocine/posters"
+PROVIDER_API_DIR = "provider_api"
+PROVIDER_API_URL = "https://provider-api.example.org/stocks"
+
+DEFAULT_TOLERANCE = 0.1
+# Metric -> whether higher values are better.
+COMPARED_METRICS = {
+    "rows_per_second": True,
+    "queries_per_row": False,
+    "peak_rss_mb": False,
+}
+
+
+@dataclasses.dataclass
+class Measure:
+    rows: int = 0
+    queries: int = 0
+    total_seconds: float = 0
+    db_seconds: float = 0
+    thumbs_seconds: float = 0
+    peak_rss_mb: float = 0
+
+    @property
+    def other_seconds(self) -> float:
+        return max(self.total_seconds - self.db_seconds - self.thumbs_seconds, 0)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.total_seconds if self.total_seconds else 0
+
+    @property
+    def queries_per_row(self) -> float:
+        return self.queries / self.rows if self.rows else 0
+
+    def as_dict(self) -> dict:
+        return {
+            **dataclasses.asdict(self),
+            "other_seconds": self.other_seconds,
+            "rows_per_second": self.rows_per_second,
+            "queries_per_row": self.queries_per_row,
+        }
+
+
+class Recorder:
+    """Record SQL queries and time spent on thumbs while a scenario
+    runs.
+    """
+
+    def __init__(self):
+        self.measure = Measure()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._db_seconds_in_thumbs = 0.0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("benchmark_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["benchmark_query_start"].pop()
+        with self._lock:
+            self.measure.queries += 1
+            self.measure.db_seconds += elapsed
+            if getattr(self._local, "in_thumbs", False):
+                self._db_seconds_in_thumbs += elapsed
+
+    def _timed_as_thumbs(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._local.in_thumbs = True
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.in_thumbs = False
+                with self._lock:
+                    self.measure.thumbs_seconds += elapsed
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def record(self):
+        _reset_peak_rss()
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", self._before_cursor_execute)
+        sqlalchemy.event.listen(db.engine, "after_cursor_execute", self._after_cursor_execute)
+        start = time.perf_counter()
+        try:
+            with mock.patch.object(
+                LocalProvider, "_handle_thumb", self._timed_as_thumbs(LocalProvider._handle_thumb)
+            ), mock.patch.object(
+                LocalProvider, "_join_thumbs_pipeline", self._timed_as_thumbs(LocalProvider._join_thumbs_pipeline)
+            ):
+                yield self.measure
+        finally:
+            self.measure.total_seconds = time.perf_counter() - start
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", self._before_cursor_execute)
+            sqlalchemy.event.remove(db.engine, "after_cursor_execute", self._after_cursor_execute)
+            self.measure.thumbs_seconds -= self._db_seconds_in_thumbs
+            self.measure.peak_rss_mb = _get_peak_rss_mb()
+
+
+def _reset_peak_rss() -> None:
+    # Linux only: reset the peak RSS of the process (``VmHWM``), so
+    # that it is measured for each scenario.
+    with contextlib.suppress(OSError):
+        pathlib.Path("/proc/self/clear_refs").write_text("5")
+
+
+def _get_peak_rss_mb() -> float:
+    with contextlib.suppress(OSError):
+        for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024  # in kB
+    # Peak RSS since the process started (in kB on Linux).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class FixtureFtp:
+    """Serve the files of a directory like the FTP of Titelive."""
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+
+    def nlst(self, folder: str) -> list[str]:
+        return sorted(path.name for path in (self.root / folder).iterdir())
+
+    def retrbinary(self, command: str, callback: Callable, blocksize: int = 8192) -> None:
+        path = self.root / command.split(" ", 1)[1]  # "RETR folder/file"
+        with path.open("rb") as fp:
+            for block in iter(functools.partial(fp.read, blocksize), b""):
+                callback(block)
+
+
+@dataclasses.dataclass
+class FixtureResponse:
+    status_code: int
+    content: bytes = b""
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AllocineFixtures:
+    """Serve showtimes and posters like the Allociné API."""
+
+    def __init__(self, root: pathlib.Path):
+        self.theaters_dir = root / ALLOCINE_THEATERS_DIR
+        self.posters_dir = root / ALLOCINE_POSTERS_DIR
+
+    def get_theater_ids(self) -> list[str]:
+        return sorted(path.stem for path in self.theaters_dir.glob("*.json"))
+
+    def get(self, url: str, **kwargs) -> FixtureResponse:
+        parsed_url = urlparse(url)
+        if parsed_url.path.endswith("/movieShowtimeList"):
+            theater_id = dict(param.split("=", 1) for param in parsed_url.query.split("&"))["theater"]
+            path = self.theaters_dir / f"{theater_id}.json"
+        else:
+            path = self.posters_dir / pathlib.PurePosixPath(parsed_url.path).name
+        if not path.is_file():
+            return FixtureResponse(status_code=404)
+        return FixtureResponse(status_code=200, content=path.read_bytes())
+
+
+class ProviderApiFixtures:
+    """Serve pages of stocks like the API of a provider, and count
+    served stocks.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root / PROVIDER_API_DIR
+        self.served_stocks = 0
+
+    def get_sirets(self) -> list[str]:
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
+
+    def get(self, url: str, params: Optional[dict] = None, **kwargs) -> FixtureResponse:
+        siret = url.rsplit("/", 1)[-1]
+        after = (params or {}).get("after")
+        pages = [json.loads(path.read_bytes()) for path in sorted((self.root / siret).glob("*.json"))]
+        page = pages[0] if pages else {"stocks": []}
+        if after:
+            page = {"stocks": []}
+            for previous_page, next_page in zip(pages, pages[1:]):
+                if previous_page["stocks"] and previous_page["stocks"][-1]["ref"] == after:
+                    page = next_page
+                    break
+        self.served_stocks += len(page["stocks"])
+        return FixtureResponse(status_code=200, content=json.dumps(page).encode())
+
+
+def _activate_provider(local_class: str) -> Provider:
+    provider = Provider.query.filter_by(localClass=local_class).one()
+    provider.isActive = True
+    db.session.commit()
+    return provider
+
+
+def _setup(scenarios: list[str], allocine: AllocineFixtures, provider_api_fixtures: ProviderApiFixtures) -> None:
+    clean_all_database()
+    if "titelive_things" in scenarios:
+        _activate_provider("TiteLiveThings")
+    if "titelive_thumbs" in scenarios:
+        _activate_provider("TiteLiveThingThumbs")
+    if "allocine" in scenarios:
+        provider = _activate_provider("AllocineStocks")
+        for theater_id in allocine.get_theater_ids():
+            offerers_factories.AllocineVenueProviderPriceRuleFactory(
+                allocineVenueProvider__provider=provider,
+                allocineVenueProvider__venueIdAtOfferProvider=theater_id,
+            )
+    if "provider_api" in scenarios:
+        provider = offerers_factories.APIProviderFactory(apiUrl=PROVIDER_API_URL)
+        for siret in provider_api_fixtures.get_sirets():
+            offerers_factories.VenueProviderFactory(
+                provider=provider,
+                venue__siret=siret,
+                venue__managingOfferer__siren=siret[:9],
+            )
+
+
+def _reset_sync_state() -> None:
+    # Let providers process the same files and pages again.
+    LocalProviderEvent.query.delete()
+    VenueProvider.query.update({"lastSyncDate": None})
+    db.session.commit()
+
+
+def _sync_local_provider(provider: LocalProvider) -> int:
+    provider.updateObjects()
+    return provider.checkedObjects
+
+
+def _sync_allocine() -> int:
+    rows = 0
+    with movie_posters_cache():
+        for venue_provider in AllocineVenueProvider.query.order_by(AllocineVenueProvider.id).all():
+            rows += _sync_local_provider(AllocineStocks(venue_provider))
+    return rows
+
+
+def _sync_provider_api(fixtures: ProviderApiFixtures) -> int:
+    fixtures.served_stocks = 0
+    venue_providers = (
+        VenueProvider.query.join(Provider, Provider.id == VenueProvider.providerId)
+        .filter(Provider.apiUrl == PROVIDER_API_URL)
+        .order_by(VenueProvider.id)
+        .all()
+    )
+    for venue_provider in venue_providers:
+        synchronize_provider_api.synchronize_venue_provider(venue_provider)
+    return fixtures.served_stocks
+
+
+def get_available_scenarios(fixtures_dir: pathlib.Path) -> list[str]:
+    directories = {
+        "titelive_things": fixtures_dir / TITELIVE_DIR / THINGS_FOLDER_NAME_TITELIVE,
+        "titelive_thumbs": fixtures_dir / TITELIVE_DIR / THUMB_FOLDER_NAME_TITELIVE,
+        "allocine": fixtures_dir / ALLOCINE_THEATERS_DIR,
+        "provider_api": fixtures_dir / PROVIDER_API_DIR,
+    }
+    return [scenario for scenario, directory in directories.items() if directory.is_dir()]
+
+
+def run_benchmark(fixtures_dir: pathlib.Path, scenarios: list[str], passes: int) -> dict[str, dict]:
+    allocine = AllocineFixtures(fixtures_dir)
+    provider_api_fixtures = ProviderApiFixtures(fixtures_dir)
+    syncs = {
+        "titelive_things": lambda: _sync_local_provider(TiteLiveThings()),
+        "titelive_thumbs": lambda: _sync_local_provider(TiteLiveThingThumbs()),
+        "allocine": _sync_allocine,
+        "provider_api": lambda: _sync_provider_api(provider_api_fixtures),
+    }
+
+    results = {}
+    with mock.patch.object(
+        ftp_titelive, "connect_to_titelive_ftp", lambda: FixtureFtp(fixtures_dir / TITELIVE_DIR)
+    ), mock.patch.object(api_allocine, "requests", allocine), mock.patch.object(
+        provider_api, "requests", provider_api_fixtures
+    ):
+        _setup(scenarios, allocine, provider_api_fixtures)
+        for pass_number in range(1, passes + 1):
+            if pass_number > 1:
+                _reset_sync_state()
+            for scenario in scenarios:
+                name = f"{scenario}/pass{pass_number}"
+                print(f"Running {name}...", flush=True)
+                recorder = Recorder()
+                with recorder.record() as measure:
+                    measure.rows = syncs[scenario]()
+                results[name] = measure.as_dict()
+    return results
+
+
+def compare_with_baseline(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """Return a description of each metric that is worse than in the
+    baseline by more than ``tolerance`` (a ratio).
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if metrics["rows"] != reference["rows"]:
+            print(f"Warning: {name} processed {metrics['rows']} rows, {reference['rows']} in baseline")
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            value, reference_value = metrics[metric], reference.get(metric)
+            if not reference_value:
+                continue
+            change = (value - reference_value) / reference_value
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}: {metric} {reference_value:.2f} -> {value:.2f} ({change:+.0%})")
+    return regressions
+
+
+def print_results(results: dict[str, dict], baseline: Optional[dict[str, dict]] = None) -> None:
+    baseline = baseline or {}
+    header = (
+        f"{'scenario':<24} {'rows':>8} {'rows/s':>10} {'queries/row':>12} {'RSS (MB)':>9} "
+        f"{'db/thumbs/other (s)':>22}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, metrics in results.items():
+        split = f"{metrics['db_seconds']:.1f}/{metrics['thumbs_seconds']:.1f}/{metrics['other_seconds']:.1f}"
+        print(
+            f"{name:<24} {metrics['rows']:>8} {metrics['rows_per_second']:>10.1f} "
+            f"{metrics['queries_per_row']:>12.2f} {metrics['peak_rss_mb']:>9.0f} {split:>22}"
+        )
+        reference = baseline.get(name)
+        if reference:
+            print(
+                f"{'  (baseline)':<24} {reference['rows']:>8} {reference['rows_per_second']:>10.1f} "
+                f"{reference['queries_per_row']:>12.2f} {reference['peak_rss_mb']:>9.0f}"
+            )
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures", type=pathlib.Path, help="Directory of recorded fixtures")
+    parser.add_argument(
+        "--only-scenarios",
+        nargs="+",
+        choices=["titelive_things", "titelive_thumbs", "allocine", "provider_api"],
+        help="Run only these scenarios (default: all scenarios that have fixtures)",
+    )
+    parser.add_argument("--passes", type=int, default=1, help="Number of times fixtures are synchronized")
+    parser.add_argument("--baseline", type=pathlib.Path, help="JSON file of results to compare with")
+    parser.add_argument("--save-baseline", type=pathlib.Path, help="Write results in this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Accepted degradation of each metric compared to the baseline (default: %(default)s)",
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    assert args.passes >= 1
+
+    # Keep the order of available scenarios: thumbs need the products
+    # of TiteLive things, and stocks of the provider API too.
+    scenarios = get_available_scenarios(args.fixtures)
+    if args.only_scenarios:
+        scenarios = [scenario for scenario in scenarios if scenario in args.only_scenarios]
+    if not scenarios:
+        parser.error(f"No fixtures found in {args.fixtures}")
+
+    results = run_benchmark(args.fixtures, scenarios, args.passes)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2, sort_keys=True))
+        print(f"Wrote results in {args.save_baseline}")
+
+    if baseline:
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
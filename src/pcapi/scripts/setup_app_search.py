@@ -38,11 +38,11 @@ def setup_engine():
 
 def index_offers():
     # FIXME (dbaty, 2021-07-01): late import to avoid import loop of models.
-    import pcapi.core.offers.models as offers_models
+    from pcapi.core import search
 
     backend = appsearch.AppSearchBackend()
 
-    offers = offers_models.Offer.query.all()
+    offers = search.get_base_query_for_offer_indexation().all()
     documents = []
     for offer in offers:
         if offer.isBookable:
@@ -12,4 +12,4 @@ def move_all_offers_from_venue_to_other_venue(origin_venue_id: str, destination_
     for o in offers:
         o.venueId = destination_venue_id
     repository.save(*offers)
-    search.async_index_offer_ids({offer.id for offer in offers})
+    search.async_index_offer_ids({offer.id for offer in offers}, priority=search.IndexationPriority.BULK)
@@ -192,6 +192,8 @@ JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 TITELIVE_FTP_URI = os.environ.get("FTP_TITELIVE_URI")
 TITELIVE_FTP_USER = os.environ.get("FTP_TITELIVE_USER")
 TITELIVE_FTP_PWD = os.environ.get("FTP_TITELIVE_PWD")
+# Files downloaded from the FTP are written to disk past this size (in bytes)
+TITELIVE_FTP_SPOOL_MAX_SIZE = int(os.environ.get("FTP_TITELIVE_SPOOL_MAX_SIZE", 32 * 1024 * 1024))
 
 
 # JOUVE
@@ -211,6 +213,12 @@ ALLOCINE_API_KEY = os.environ.get("ALLOCINE_API_KEY")
 FNAC_API_TOKEN = os.environ.get("PROVIDER_FNAC_BASIC_AUTHENTICATION_TOKEN")
 FNAC_API_URL = "https://passculture-fr.ws.fnac.com/api/v1/pass-culture/stocks"
 PROVIDERS_SYNC_WORKERS_POOL_SIZE = int(os.environ.get("SYNC_WORKERS_POOL_SIZE", 5))
+PROVIDERS_SYNC_MAX_WORKERS_PER_PROVIDER = int(os.environ.get("SYNC_MAX_WORKERS_PER_PROVIDER", 2))
+ALLOCINE_SYNC_WORKERS_POOL_SIZE = int(os.environ.get("ALLOCINE_SYNC_WORKERS_POOL_SIZE", 5))
+# Thumbs of local providers are created inline if there is no process
+THUMBS_PIPELINE_PROCESSES = int(os.environ.get("THUMBS_PIPELINE_PROCESSES", 0))
+THUMBS_PIPELINE_UPLOAD_THREADS = int(os.environ.get("THUMBS_PIPELINE_UPLOAD_THREADS", 8))
+THUMBS_PIPELINE_MAX_PENDING = int(os.environ.get("THUMBS_PIPELINE_MAX_PENDING", 100))
 
 
 # DEMARCHES SIMPLIFIEES
@@ -308,6 +316,7 @@ APPS_FLYER_IOS_API_KEY = os.environ.get("APPS_FLYER_IOS_API_KEY", "")
 SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", _default_search_backend)
 APPSEARCH_API_KEY = os.environ.get("APPSEARCH_API_KEY", "")
 APPSEARCH_HOST = os.environ.get("APPSEARCH_HOST", "")
+APPSEARCH_MAX_CONCURRENT_REQUESTS = int(os.environ.get("APPSEARCH_MAX_CONCURRENT_REQUESTS", 4))
 
 # ADAGE
 ADAGE_API_KEY = os.environ.get("ADAGE_API_KEY", None)
@@ -0,0 +1,63 @@
+import queue
+import threading
+from typing import Iterable
+from typing import Iterator
+from typing import TypeVar
+
+
+T = TypeVar("T")
+
+_ITEM = "item"
+_ERROR = "error"
+_END = "end"
+
+
+def prefetch(iterable: Iterable[T], read_ahead: int = 1) -> Iterator[T]:
+    """Iterate over ``iterable`` in a background thread, so that the
+    next items (up to ``read_ahead`` of them) are fetched while the
+    caller processes the current one.
+
+    An exception raised by ``iterable`` is raised again by this
+    iterator, once the items that had been fetched before are
+    consumed. If the caller stops iterating, the background thread
+    stops after having fetched at most ``read_ahead`` more items.
+
+    ``iterable`` must not use the database session, which is not
+    shared between threads.
+    """
+    entries = queue.Queue(maxsize=read_ahead)
+    stopped = threading.Event()
+
+    def put(kind, value) -> bool:
+        while not stopped.is_set():
+            try:
+                entries.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(_ITEM, item):
+                    return
+        except Exception as exc:  # pylint: disable=broad-except
+            put(_ERROR, exc)
+        else:
+            put(_END, None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = entries.get()
+            if kind == _ERROR:
+                raise value
+            if kind == _END:
+                return
+            yield value
+    finally:
+        # Do not wait for the producer: it may be blocked in a slow
+        # call, and it stops by itself.
+        stopped.set()
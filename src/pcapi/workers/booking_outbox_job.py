@@ -0,0 +1,8 @@
+from pcapi.core.bookings import outbox
+from pcapi.workers import worker
+from pcapi.workers.decorators import job
+
+
+@job(worker.default_queue)
+def process_booking_outbox_job() -> None:
+    outbox.process_booking_outbox()
@@ -18,11 +18,14 @@ def job(queue: Queue):
     def decorator(func):
         @wraps(func)
         def job_func(*args, **kwargs):
+            from pcapi.core import search  # avoid circular import
+
             current_job = get_current_job()
             if not current_job or IS_RUNNING_TESTS:
                 # in synchronous calls (as wall in TESTS because queued jobs are executed synchronously)
                 # we don't won't to create another session
-                return func(*args, **kwargs)
+                with search.buffered_indexation_requests():
+                    return func(*args, **kwargs)
 
             start = time.perf_counter()
             started_at = current_job.started_at or datetime.now()
@@ -38,7 +41,8 @@ def job(queue: Queue):
 
             # TODO(xordoquy): use flask.current_app to retrieve context
             with app.app_context():
-                result = func(*args, **kwargs)
+                with search.buffered_indexation_requests():
+                    result = func(*args, **kwargs)
 
             logger.info(
                 "Ended job %s",
@@ -4,6 +4,7 @@ import pytest
 
 from pcapi.admin.custom_views.many_offers_operations_view import _get_current_criteria_on_active_offers
 from pcapi.admin.custom_views.many_offers_operations_view import _get_products_compatible_status
+from pcapi.core import search
 import pcapi.core.offers.factories as offers_factories
 from pcapi.core.offers.models import Offer
 import pcapi.core.users.factories as users_factories
@@ -112,7 +113,9 @@ class ManyOffersOperationsViewTest:
         assert offer2.criteria == [criterion1, criterion2]
         assert not inactive_offer.criteria
         assert not unmatched_offer.criteria
-        mocked_async_index_offer_ids.assert_called_once_with([offer1.id, offer2.id])
+        mocked_async_index_offer_ids.assert_called_once_with(
+            [offer1.id, offer2.id], priority=search.IndexationPriority.BULK
+        )
 
     @patch("pcapi.core.search.async_index_offer_ids")
     @patch("wtforms.csrf.session.SessionCSRF.validate_csrf_token")
@@ -226,7 +229,9 @@ class ManyOffersOperationsViewTest:
         assert not first_product.isGcuCompatible
         assert not first_offer.isActive
         assert not second_offer.isActive
-        mocked_async_index_offer_ids.assert_called_once_with([offer.id for offer in offers])
+        mocked_async_index_offer_ids.assert_called_once_with(
+            [offer.id for offer in offers], priority=search.IndexationPriority.BULK
+        )
 
     def test_get_products_compatible_status(self):
         # Given
@@ -134,7 +134,7 @@ class VenueViewTest:
 
         assert response.status_code == 302
 
-        mocked_async_index_venue_ids.assert_called_once_with([venue.id])
+        mocked_async_index_venue_ids.assert_called_once_with([venue.id], venue_fields_only=True)
 
 
 class GetVenueProviderLinkTest:
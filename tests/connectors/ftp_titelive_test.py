@@ -0,0 +1,67 @@
+from io import BytesIO
+from unittest.mock import patch
+import zipfile
+
+from pcapi.connectors import ftp_titelive
+from pcapi.core.testing import override_settings
+
+
+def _mock_retrbinary(content, chunk_size=4):
+    def retrbinary(command, callback):
+        for i in range(0, len(content), chunk_size):
+            callback(content[i : i + chunk_size])
+
+    return retrbinary
+
+
+class DownloadFileFromFtpTest:
+    @override_settings(TITELIVE_FTP_SPOOL_MAX_SIZE=100)
+    @patch("pcapi.connectors.ftp_titelive.connect_to_titelive_ftp")
+    def test_small_file_is_kept_in_memory(self, mocked_connect):
+        mocked_connect.return_value.retrbinary.side_effect = _mock_retrbinary(b"0123456789")
+
+        data_file = ftp_titelive.download_file_from_ftp("file.txt", "folder")
+
+        assert isinstance(data_file, BytesIO)
+        assert data_file.read() == b"0123456789"
+        mocked_connect.return_value.retrbinary.assert_called_once()
+        assert mocked_connect.return_value.retrbinary.call_args[0][0] == "RETR folder/file.txt"
+
+    @override_settings(TITELIVE_FTP_SPOOL_MAX_SIZE=5)
+    @patch("pcapi.connectors.ftp_titelive.connect_to_titelive_ftp")
+    def test_big_file_is_spooled_to_disk(self, mocked_connect):
+        mocked_connect.return_value.retrbinary.side_effect = _mock_retrbinary(b"0123456789")
+
+        data_file = ftp_titelive.download_file_from_ftp("file.txt", "folder")
+
+        assert not isinstance(data_file, BytesIO)
+        assert data_file.read() == b"0123456789"
+
+
+class GetZipFileFromFtpTest:
+    @override_settings(TITELIVE_FTP_SPOOL_MAX_SIZE=5)
+    @patch("pcapi.connectors.ftp_titelive.connect_to_titelive_ftp")
+    def test_read_members_from_spooled_file(self, mocked_connect):
+        content = BytesIO()
+        with zipfile.ZipFile(content, "w") as zip_file:
+            zip_file.writestr("livres/9782070584628_75.jpg", b"thumb")
+        mocked_connect.return_value.retrbinary.side_effect = _mock_retrbinary(content.getvalue())
+
+        zip_file = ftp_titelive.get_zip_file_from_ftp("livres_tl20210101.zip", "Atoo")
+
+        assert zip_file.filename == "livres_tl20210101.zip"
+        with zip_file.open("livres/9782070584628_75.jpg") as member:
+            assert member.read() == b"thumb"
+
+
+class GetLinesFromFtpFileTest:
+    @override_settings(TITELIVE_FTP_SPOOL_MAX_SIZE=5)
+    @patch("pcapi.connectors.ftp_titelive.connect_to_titelive_ftp")
+    def test_decode_lines(self, mocked_connect):
+        content = "première~ligne\nseconde~ligne\n".encode("iso-8859-1")
+        mocked_connect.return_value.retrbinary.side_effect = _mock_retrbinary(content)
+
+        lines = ftp_titelive.get_lines_from_ftp_file("livre3_11", "livre3_11", encoding="iso-8859-1")
+
+        assert next(lines) == "première~ligne\n"
+        assert list(lines) == ["seconde~ligne\n"]
@@ -149,6 +149,9 @@ class BookOfferTest:
         email_data2 = mails_testing.outbox[1].sent_data
         assert email_data2["MJ-TemplateID"] == 2996790  # to beneficiary
 
+        # Side effects have been processed by the (synchronous in tests) outbox job.
+        assert models.BookingOutboxEvent.query.count() == 0
+
     def test_booked_categories_are_sent_to_batch_backend(self, app):
         offer1 = offers_factories.OfferFactory(subcategoryId=subcategories.SUPPORT_PHYSIQUE_FILM.id)
         offer2 = offers_factories.OfferFactory(subcategoryId=subcategories.CARTE_CINE_ILLIMITE.id)
@@ -175,6 +178,32 @@ class BookOfferTest:
         expected_categories = ["CINEMA", "FILM"]
         assert sorted(data["attribute_values"]["ut.booking_categories"]) == expected_categories
 
+    @mock.patch("pcapi.core.bookings.repository.random_token")
+    def test_retry_with_another_token_if_token_is_already_used(self, mocked_random_token):
+        factories.BookingFactory(token="ABCDEF")
+        mocked_random_token.side_effect = ["ABCDEF", "GHJKLM"]
+        beneficiary = users_factories.BeneficiaryFactory()
+        stock = offers_factories.StockFactory(price=10, dnBookedQuantity=5)
+
+        booking = api.book_offer(beneficiary=beneficiary, stock_id=stock.id, quantity=1)
+
+        assert booking.token == "GHJKLM"
+        assert models.Booking.query.filter_by(stockId=stock.id).count() == 1
+        assert stock.dnBookedQuantity == 6
+
+    @mock.patch("pcapi.core.bookings.repository.random_token", return_value="ABCDEF")
+    def test_give_up_if_token_is_always_already_used(self, mocked_random_token):
+        factories.BookingFactory(token="ABCDEF")
+        beneficiary = users_factories.BeneficiaryFactory()
+        stock = offers_factories.StockFactory(price=10)
+
+        with pytest.raises(api_errors.ApiErrors) as error:
+            api.book_offer(beneficiary=beneficiary, stock_id=stock.id, quantity=1)
+
+        assert "token" in error.value.errors
+        assert mocked_random_token.call_count == 5
+        assert models.Booking.query.filter_by(stockId=stock.id).count() == 0
+
     @override_features(AUTO_ACTIVATE_DIGITAL_BOOKINGS=True, ENABLE_ACTIVATION_CODES=True)
     def test_booking_on_digital_offer_with_activation_stock(self):
         offer = offers_factories.OfferFactory(product=offers_factories.DigitalProductFactory())
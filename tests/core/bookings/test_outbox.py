@@ -0,0 +1,67 @@
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+
+from pcapi.core.bookings import factories
+from pcapi.core.bookings import outbox
+from pcapi.core.bookings.models import BookingOutboxEvent
+from pcapi.core.bookings.models import BookingOutboxEventType
+import pcapi.core.mails.testing as mails_testing
+import pcapi.core.users.factories as users_factories
+from pcapi.models.db import db
+import pcapi.notifications.push.testing as push_testing
+
+
+@pytest.mark.usefixtures("db_session")
+class ProcessBookingOutboxTest:
+    @mock.patch("pcapi.core.search.async_index_offer_ids")
+    def test_process_events_by_batch(self, mocked_async_index_offer_ids):
+        user = users_factories.BeneficiaryFactory()
+        booking1 = factories.BookingFactory(user=user, stock__offer__bookingEmail="offerer@example.com")
+        booking2 = factories.BookingFactory(user=user, stock__offer__bookingEmail="offerer@example.com")
+        outbox.add_event(booking1, BookingOutboxEventType.BOOKED)
+        outbox.add_event(booking2, BookingOutboxEventType.BOOKED)
+        db.session.commit()
+
+        assert outbox.process_booking_outbox() == 2
+
+        assert BookingOutboxEvent.query.count() == 0
+        assert len(mails_testing.outbox) == 4
+        # The user is updated once for both bookings.
+        assert len(push_testing.requests) == 1
+        mocked_async_index_offer_ids.assert_called_once_with(sorted([booking1.stock.offerId, booking2.stock.offerId]))
+
+    def test_do_not_send_emails_of_cancelled_bookings(self):
+        booking = factories.CancelledBookingFactory(stock__offer__bookingEmail="offerer@example.com")
+        outbox.add_event(booking, BookingOutboxEventType.BOOKED)
+        db.session.commit()
+
+        assert outbox.process_booking_outbox() == 1
+
+        assert BookingOutboxEvent.query.count() == 0
+        assert len(mails_testing.outbox) == 0
+
+    def test_skip_claimed_events(self):
+        booking = factories.BookingFactory()
+        outbox.add_event(booking, BookingOutboxEventType.BOOKED)
+        event = BookingOutboxEvent.query.one()
+        event.lockedUntil = datetime.utcnow() + timedelta(minutes=1)
+        db.session.commit()
+
+        assert outbox.process_booking_outbox() == 0
+
+        assert BookingOutboxEvent.query.count() == 1
+        assert len(mails_testing.outbox) == 0
+
+    def test_process_events_whose_claim_has_expired(self):
+        booking = factories.BookingFactory()
+        outbox.add_event(booking, BookingOutboxEventType.BOOKED)
+        event = BookingOutboxEvent.query.one()
+        event.lockedUntil = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+
+        assert outbox.process_booking_outbox() == 1
+
+        assert BookingOutboxEvent.query.count() == 0
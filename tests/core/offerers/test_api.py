@@ -36,7 +36,7 @@ class EditVenueTest:
         offerers_api.update_venue(venue, **json_data)
 
         # Then
-        mocked_async_index_venue_ids.assert_called_once_with([venue.id])
+        mocked_async_index_venue_ids.assert_called_once_with([venue.id], venue_fields_only=True)
 
     @patch("pcapi.core.search.async_index_venue_ids")
     def when_changes_on_public_name_algolia_indexing_is_triggered(self, mocked_async_index_venue_ids):
@@ -52,7 +52,7 @@ class EditVenueTest:
         offerers_api.update_venue(venue, **json_data)
 
         # Then
-        mocked_async_index_venue_ids.called_once_with([venue.id])
+        mocked_async_index_venue_ids.called_once_with([venue.id], venue_fields_only=True)
 
     @patch("pcapi.core.search.async_index_venue_ids")
     def when_changes_on_city_algolia_indexing_is_triggered(self, mocked_async_index_venue_ids):
@@ -68,7 +68,7 @@ class EditVenueTest:
         offerers_api.update_venue(venue, **json_data)
 
         # Then
-        mocked_async_index_venue_ids.assert_called_once_with([venue.id])
+        mocked_async_index_venue_ids.assert_called_once_with([venue.id], venue_fields_only=True)
 
     @patch("pcapi.core.search.async_index_venue_ids")
     def when_changes_are_not_on_algolia_fields_it_should_not_trigger_indexing(self, mocked_async_index_venue_ids):
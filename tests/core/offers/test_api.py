@@ -8,6 +8,7 @@ from freezegun import freeze_time
 import pytest
 
 from pcapi import models
+from pcapi.core import search
 import pcapi.core.bookings.factories as bookings_factories
 from pcapi.core.bookings.models import Booking
 from pcapi.core.bookings.models import BookingCancellationReasons
@@ -1274,7 +1275,9 @@ class DeactivateInappropriateProductTest:
 
         assert not any(product.isGcuCompatible for product in products)
         assert not any(offer.isActive for offer in offers)
-        mocked_async_index_offer_ids.assert_called_once_with([o.id for o in offers])
+        mocked_async_index_offer_ids.assert_called_once_with(
+            [o.id for o in offers], priority=search.IndexationPriority.BULK
+        )
 
 
 class ComputeOfferValidationTest:
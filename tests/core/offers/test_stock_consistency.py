@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+import pcapi.core.bookings.factories as bookings_factories
+from pcapi.core.offers import stock_consistency
+import pcapi.core.offers.factories as offers_factories
+from pcapi.core.offers.models import Stock
+from pcapi.core.offers.models import StockConsistencyCheck
+from pcapi.models.db import db
+
+
+def _make_inconsistent(stock):
+    stock.dnBookedQuantity += 3
+    db.session.commit()
+
+
+@pytest.mark.usefixtures("db_session")
+class CheckRecentStockConsistencyTest:
+    def test_first_run_initializes_watermark(self):
+        booking = bookings_factories.BookingFactory()
+        _make_inconsistent(booking.stock)
+
+        assert stock_consistency.check_recent_stock_consistency() == []
+
+        check = StockConsistencyCheck.query.one()
+        assert check.lastBookingId == booking.id
+
+    def test_check_stocks_booked_since_previous_check(self):
+        two_hours_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+        old_booking = bookings_factories.BookingFactory(dateCreated=two_hours_ago)
+        stock_consistency.check_recent_stock_consistency()
+        _make_inconsistent(old_booking.stock)  # not touched by a booking, ignored
+        new_booking = bookings_factories.BookingFactory()
+        _make_inconsistent(new_booking.stock)
+
+        assert stock_consistency.check_recent_stock_consistency() == [new_booking.stock.id]
+
+        check = StockConsistencyCheck.query.one()
+        assert check.lastBookingId == new_booking.id
+
+    def test_check_stocks_booked_shortly_before_previous_check(self):
+        # The booking may have been committed after the previous check,
+        # even though its id is lower than the watermark.
+        booking = bookings_factories.BookingFactory()
+        stock_consistency.check_recent_stock_consistency()
+        _make_inconsistent(booking.stock)
+
+        assert stock_consistency.check_recent_stock_consistency() == [booking.stock.id]
+
+    def test_check_stocks_of_bookings_cancelled_since_previous_check(self):
+        booking = bookings_factories.BookingFactory()
+        stock_consistency.check_recent_stock_consistency()
+        booking.isCancelled = True
+        booking.cancellationDate = datetime.datetime.utcnow()
+        db.session.commit()  # dnBookedQuantity is not updated
+
+        assert stock_consistency.check_recent_stock_consistency() == [booking.stock.id]
+
+    def test_repair(self):
+        stock_consistency.check_recent_stock_consistency()
+        booking = bookings_factories.BookingFactory(quantity=2)
+        _make_inconsistent(booking.stock)
+
+        assert stock_consistency.check_recent_stock_consistency(repair=True) == [booking.stock.id]
+
+        assert Stock.query.get(booking.stock.id).dnBookedQuantity == 2
+
+
+@pytest.mark.usefixtures("db_session")
+class CheckAllStocksConsistencyTest:
+    def test_check_all_stocks_by_chunks(self):
+        stocks = offers_factories.StockFactory.create_batch(5)
+        for stock in stocks:
+            bookings_factories.BookingFactory(stock=stock)
+        _make_inconsistent(stocks[0])
+        _make_inconsistent(stocks[3])
+
+        inconsistent_stock_ids = stock_consistency.check_all_stocks_consistency(batch_size=2)
+
+        assert inconsistent_stock_ids == [stocks[0].id, stocks[3].id]
+
+    def test_repair(self):
+        booking = bookings_factories.BookingFactory()
+        _make_inconsistent(booking.stock)
+
+        stock_consistency.check_all_stocks_consistency(repair=True)
+
+        assert Stock.query.get(booking.stock.id).dnBookedQuantity == 1
+        assert stock_consistency.check_all_stocks_consistency() == []
@@ -4,6 +4,7 @@ from unittest import mock
 from freezegun.api import freeze_time
 import pytest
 
+from pcapi.core import search
 from pcapi.core.bookings.factories import BookingFactory
 from pcapi.core.categories import subcategories
 import pcapi.core.offerers.factories as offerers_factories
@@ -131,7 +132,8 @@ class SynchronizeStocksTest:
 
         # Test offer reindexation
         mock_async_index_offer_ids.assert_called_with(
-            {stock.offer.id, offer.id, stock_with_booking.offer.id, created_offer.id, second_created_offer.id}
+            {stock.offer.id, offer.id, stock_with_booking.offer.id, created_offer.id, second_created_offer.id},
+            priority=search.IndexationPriority.BULK,
         )
 
     def test_build_new_offers_from_stock_details(self, db_session):
@@ -208,87 +210,96 @@ class SynchronizeStocksTest:
         assert new_offer.subcategoryId == subcategories.LIVRE_PAPIER.id
         assert new_offer.withdrawalDetails == venue.withdrawalDetails
 
-    def test_get_stocks_to_upsert(self):
+    def test_get_stock_rows_to_upsert(self):
         # Given
         spec = [
-            {  # existing, will update
+            {  # will be upserted
                 "offers_provider_reference": "offer_ref1",
                 "available_quantity": 15,
                 "price": 15.78,
                 "products_provider_reference": "product_ref1",
                 "stocks_provider_reference": "stock_ref1",
             },
-            {  # new, will be added
-                "available_quantity": 17,
+            {  # no offer (no quantity), must be ignored
+                "available_quantity": 0,
                 "offers_provider_reference": "offer_ref2",
                 "price": 28.989,
                 "products_provider_reference": "product_ref2",
                 "stocks_provider_reference": "stock_ref2",
             },
-            {  # no quantity, must be ignored
-                "available_quantity": 0,
+            {  # negative quantity, must be ignored
+                "available_quantity": -1,
                 "offers_provider_reference": "offer_ref3",
                 "price": 28.989,
                 "products_provider_reference": "product_ref3",
                 "stocks_provider_reference": "stock_ref3",
             },
-            {  # existing, will update but set product's price
+            {  # will be upserted with product's price
                 "offers_provider_reference": "offer_ref4",
-                "available_quantity": 15,
+                "available_quantity": 0,
                 "price": None,
                 "products_provider_reference": "product_ref4",
                 "stocks_provider_reference": "stock_ref4",
             },
         ]
-
-        stocks_by_provider_reference = {
-            "stock_ref1": {"id": 1, "booking_quantity": 3, "price": 18.0, "quantity": 2},
-            "stock_ref4": {"id": 2, "booking_quantity": 3, "price": 18.0, "quantity": 2},
-        }
-        offers_by_provider_reference = {"offer_ref1": 123, "offer_ref2": 134, "offer_ref4": 123}
+        offers_by_provider_reference = {"offer_ref1": 123, "offer_ref3": 134, "offer_ref4": 145}
         products_by_provider_reference = {
             "product_ref1": Product(extraData={"prix_livre": 7.01}),
             "product_ref2": Product(extraData={"prix_livre": 9.02}),
             "product_ref3": Product(extraData={"prix_livre": 11.03}),
             "product_ref4": Product(extraData={"prix_livre": 7.01}),
         }
-        provider_id = 1
 
         # When
-        update_stock_mapping, new_stocks, offer_ids = api._get_stocks_to_upsert(
-            spec,
-            stocks_by_provider_reference,
-            offers_by_provider_reference,
-            products_by_provider_reference,
-            provider_id,
-        )
+        rows = api._get_stock_rows_to_upsert(spec, offers_by_provider_reference, products_by_provider_reference)
 
-        assert update_stock_mapping == [
+        # Then
+        assert rows == [
             {
-                "id": 1,
-                "quantity": 15 + 3,
+                "idAtProviders": "stock_ref1",
+                "offerId": 123,
+                "quantity": 15,
                 "price": 15.78,
-                "rawProviderQuantity": 15,
-                "lastProviderId": 1,
+                "isProductPrice": False,
             },
             {
-                "id": 2,
-                "quantity": 15 + 3,
+                "idAtProviders": "stock_ref4",
+                "offerId": 145,
+                "quantity": 0,
                 "price": 7.01,
-                "rawProviderQuantity": 15,
-                "lastProviderId": 1,
+                "isProductPrice": True,
             },
         ]
 
-        new_stock = new_stocks[0]
-        assert new_stock.quantity == 17
-        assert new_stock.bookingLimitDatetime is None
-        assert new_stock.offerId == 134
-        assert new_stock.price == 28.989
-        assert new_stock.idAtProviders == "stock_ref2"
-        assert new_stock.lastProviderId == 1
+    @pytest.mark.usefixtures("db_session")
+    @mock.patch("pcapi.core.search.async_index_offer_ids")
+    def test_does_not_update_unchanged_stocks(self, mock_async_index_offer_ids):
+        # Given
+        venue = VenueFactory()
+        provider = offerers_factories.ProviderFactory()
+        stock_kwargs = {"quantity": 6, "rawProviderQuantity": 6, "price": 12, "lastProviderId": provider.id}
+        unchanged_stock = create_stock("3010000101789", venue.siret, **stock_kwargs)
+        changed_stock = create_stock("3010000101797", venue.siret, **stock_kwargs)
+        BookingFactory(stock=changed_stock)
+        stock_kwargs.update(quantity=0, rawProviderQuantity=0)
+        empty_stock = create_stock("3010000103769", venue.siret, **stock_kwargs)
+        spec = [
+            {"ref": "3010000101789", "available": 6, "price": 12},
+            {"ref": "3010000101797", "available": 4, "price": 12},
+            {"ref": "3010000103769", "available": 0, "price": 12},
+        ]
+        stock_details = synchronize_provider_api._build_stock_details_from_raw_stocks(spec, venue.siret, provider)
 
-        assert offer_ids == set([123, 134])
+        # When
+        operations = api.synchronize_stocks(stock_details, venue, provider_id=provider.id)
+
+        # Then
+        assert operations == {"new_offers": 0, "new_stocks": 0, "updated_stocks": 1}
+        assert changed_stock.quantity == 4 + 1
+        assert changed_stock.rawProviderQuantity == 4
+        assert unchanged_stock.quantity == 6
+        assert empty_stock.quantity == 0
+        mock_async_index_offer_ids.assert_called_once_with(set(), priority=search.IndexationPriority.BULK)
 
     @pytest.mark.parametrize(
         "new_quantity,new_price,existing_stock,expected_result",
@@ -1,10 +1,13 @@
 from unittest import mock
 
 import pytest
+import requests_mock
 
 from pcapi.core import search
 import pcapi.core.offers.factories as offers_factories
+from pcapi.core.search import IndexationPriority
 import pcapi.core.search.testing as search_testing
+from pcapi.core.testing import assert_num_queries
 from pcapi.core.testing import override_settings
 
 
@@ -33,6 +36,61 @@ def test_async_index_venue_ids(app):
     assert set(app.redis_client.lrange("venue_ids", 0, 5)) == {b"1", b"2"}
 
 
+def test_backends_are_instantiated_once():
+    assert search._get_backends()[0] is search._get_backends()[0]
+
+
+class BufferedIndexationRequestsTest:
+    def test_enqueue_when_leaving_block(self, app):
+        with search.buffered_indexation_requests():
+            search.async_index_offer_ids({1, 2})
+            search.async_index_offer_ids({2, 3}, priority=IndexationPriority.BULK)
+            search.async_index_offer_ids({4}, priority=IndexationPriority.BULK)
+            search.async_index_venue_ids({1})
+            search.async_index_venue_ids({1, 2})
+            assert app.redis_client.llen("offer_ids") == 0
+            assert app.redis_client.llen("venue_ids") == 0
+
+        assert set(app.redis_client.lrange("offer_ids", 0, 5)) == {b"1", b"2"}
+        # Offer 2 is already in the realtime lane.
+        assert set(app.redis_client.lrange("offer_ids:bulk", 0, 5)) == {b"3", b"4"}
+        assert sorted(app.redis_client.lrange("venue_ids", 0, 5)) == [b"1", b"2"]
+
+    def test_nested_blocks(self, app):
+        with search.buffered_indexation_requests():
+            with search.buffered_indexation_requests():
+                search.async_index_offer_ids({1})
+            assert app.redis_client.llen("offer_ids") == 0
+        assert app.redis_client.lrange("offer_ids", 0, 5) == [b"1"]
+
+    def test_enqueue_in_one_round_trip(self, app):
+        with mock.patch("redis.client.Pipeline.execute") as mocked_execute:
+            with search.buffered_indexation_requests():
+                search.async_index_offer_ids({1})
+                search.async_index_offer_ids({2})
+                search.async_index_venue_ids({1})
+        assert mocked_execute.call_count == 1
+
+    @mock.patch("pcapi.core.search.INDEXATION_BUFFER_MAX_SIZE", 3)
+    def test_enqueue_when_buffer_is_full(self, app):
+        with search.buffered_indexation_requests():
+            search.async_index_offer_ids({1, 2})
+            assert app.redis_client.llen("offer_ids") == 0
+            search.async_index_venue_ids({1})
+            assert set(app.redis_client.lrange("offer_ids", 0, 5)) == {b"1", b"2"}
+            assert app.redis_client.lrange("venue_ids", 0, 5) == [b"1"]
+            search.async_index_offer_ids({3})
+            assert app.redis_client.llen("offer_ids") == 2
+        assert set(app.redis_client.lrange("offer_ids", 0, 5)) == {b"1", b"2", b"3"}
+
+    def test_enqueue_even_if_block_fails(self, app):
+        with pytest.raises(ValueError):
+            with search.buffered_indexation_requests():
+                search.async_index_offer_ids({1})
+                fail()
+        assert app.redis_client.lrange("offer_ids", 0, 5) == [b"1"]
+
+
 @override_settings(REDIS_VENUE_IDS_CHUNK_SIZE=1)
 def test_index_venues_in_queue(app):
     bookable_offer = make_bookable_offer()
@@ -52,6 +110,41 @@ def test_index_venues_in_queue(app):
     assert unbookable_offer.id not in search_testing.search_store
 
 
+@override_settings(SEARCH_BACKEND="pcapi.core.search.backends.appsearch.AppSearchBackend")
+@override_settings(APPSEARCH_HOST="https://appsearch.example.com/", APPSEARCH_API_KEY="fake-key")
+def test_update_venue_fields_in_queue(app):
+    offer = offers_factories.OfferFactory(venue__name="New name")
+    offers_factories.OfferFactory(venue=offer.venue, isActive=False)
+    other_offer = offers_factories.OfferFactory()
+    search.async_index_venue_ids([offer.venueId], venue_fields_only=True)
+
+    with requests_mock.Mocker() as mocker:
+        patched = mocker.patch(
+            "https://appsearch.example.com/api/as/v1/engines/offers/documents",
+            json=[{"id": offer.id, "errors": []}],
+        )
+        # select venue fields + select offer ids (until an empty batch)
+        with assert_num_queries(3):
+            search.index_venues_in_queue()
+
+    assert patched.call_count == 1
+    [document] = patched.last_request.json()
+    assert document["id"] == offer.id
+    assert document["venue_name"] == "New name"
+    assert "name" not in document
+    assert other_offer.id not in {document["id"] for document in patched.last_request.json()}
+    assert app.redis_client.scard("search:appsearch:venue-ids-to-partially-index") == 0
+
+
+def test_update_venue_fields_in_queue_with_backend_without_partial_update(app):
+    offer = make_bookable_offer()
+    search.async_index_venue_ids([offer.venueId], venue_fields_only=True)
+
+    search.index_venues_in_queue()
+
+    assert offer.id in search_testing.search_store
+
+
 class ReindexOfferIdsTest:
     def test_index_new_offer(self):
         offer = make_bookable_offer()
@@ -72,6 +165,16 @@ class ReindexOfferIdsTest:
         search.reindex_offer_ids([offer.id])
         assert offer.id in search_testing.search_store  # still there, not unindexed
 
+    def test_number_of_sql_queries_does_not_depend_on_number_of_offers(self):
+        offers = [make_bookable_offer() for _i in range(3)]
+        offers.append(offers_factories.EventStockFactory().offer)
+        offer_ids = [offer.id for offer in offers]
+
+        with assert_num_queries(1):
+            search.reindex_offer_ids(offer_ids)
+
+        assert set(search_testing.search_store) == set(offer_ids)
+
     @mock.patch("pcapi.core.search.backends.testing.FakeClient.save_objects", fail)
     def test_handle_indexation_error(self):
         offer = make_bookable_offer()
@@ -102,9 +205,11 @@ class IndexOffersInQueueTest:
     def test_cron_behaviour(self, mocked_reindex_offer_ids):
         queue = list(range(1, 9))  # 8 items: 1..8
 
-        def fake_pop(self, count, from_error_queue):
+        def fake_pop(self, count, from_error_queue=False, priority=IndexationPriority.REALTIME):
             assert count == 3  # overriden REDIS_OFFER_IDS_CHUNK_SIZE
             assert not from_error_queue
+            if priority != IndexationPriority.REALTIME:
+                return set()
             popped = set()
             for _i in range(count):
                 try:
@@ -113,11 +218,13 @@ class IndexOffersInQueueTest:
                     break
             return popped
 
-        def fake_len(self, queue_name):
+        def fake_count(self, from_error_queue=False, priority=None):
             return len(queue)
 
         with mock.patch("pcapi.core.search.backends.testing.TestingBackend.pop_offer_ids_from_queue", fake_pop):
-            with mock.patch("redis.Redis.llen", fake_len):
+            with mock.patch(
+                "pcapi.core.search.backends.testing.TestingBackend.count_offers_to_index_from_queue", fake_count
+            ):
                 search.index_offers_in_queue()
 
         # First run pops and indexes 1, 2, 3. Second run pops and
@@ -134,9 +241,11 @@ class IndexOffersInQueueTest:
     def test_command_behaviour(self, mocked_reindex_offer_ids):
         queue = list(range(1, 9))  # 8 items: 1..8
 
-        def fake_pop(self, count, from_error_queue):
+        def fake_pop(self, count, from_error_queue=False, priority=IndexationPriority.REALTIME):
             assert count == 3  # overriden REDIS_OFFER_IDS_CHUNK_SIZE
             assert not from_error_queue
+            if priority != IndexationPriority.REALTIME:
+                return set()
             popped = set()
             for _i in range(count):
                 try:
@@ -145,11 +254,13 @@ class IndexOffersInQueueTest:
                     break
             return popped
 
-        def fake_len(self, queue_name):
+        def fake_count(self, from_error_queue=False, priority=None):
             return len(queue)
 
         with mock.patch("pcapi.core.search.backends.testing.TestingBackend.pop_offer_ids_from_queue", fake_pop):
-            with mock.patch("redis.Redis.llen", fake_len):
+            with mock.patch(
+                "pcapi.core.search.backends.testing.TestingBackend.count_offers_to_index_from_queue", fake_count
+            ):
                 search.index_offers_in_queue(stop_only_when_empty=True)
 
         # First run pops and indexes 1, 2, 3. Second run pops and
@@ -162,6 +273,31 @@ class IndexOffersInQueueTest:
         ]
         assert queue == []
 
+    def test_drain_realtime_lane_first(self, mocked_reindex_offer_ids):
+        search.async_index_offer_ids([1, 2], priority=IndexationPriority.BULK)
+        search.async_index_offer_ids([3])
+
+        search.index_offers_in_queue(stop_only_when_empty=True)
+
+        assert mocked_reindex_offer_ids.mock_calls == [
+            mock.call(mock.ANY, {3}),
+            mock.call(mock.ANY, {1, 2}),
+        ]
+
+
+def test_get_offer_queue_stats(app):
+    search.async_index_offer_ids([1, 2], priority=IndexationPriority.BULK)
+    search.async_index_offer_ids([3])
+
+    stats = search.get_offer_queue_stats()
+
+    assert stats == {
+        "TestingBackend": {
+            "realtime": {"count": 1, "oldest_age": None},
+            "bulk": {"count": 2, "oldest_age": None},
+        }
+    }
+
 
 def test_unindex_offer_ids(app):
     search_testing.search_store[1] = "dummy"
@@ -5,6 +5,7 @@ import requests_mock
 
 import pcapi.core.offers.factories as offers_factories
 from pcapi.core.search.backends import algolia
+from pcapi.core.search.backends.base import IndexationPriority
 from pcapi.core.testing import override_settings
 
 
@@ -26,6 +27,18 @@ def test_enqueue_offer_ids(app):
     assert set(app.redis_client.lrange("offer_ids", 0, 5)) == {b"1", b"2", b"3"}
 
 
+def test_enqueue_offer_ids_with_bulk_priority(app):
+    backend = get_backend()
+    backend.enqueue_offer_ids([1, 2], priority=IndexationPriority.BULK)
+
+    assert app.redis_client.llen("offer_ids") == 0
+    assert set(app.redis_client.lrange("offer_ids:bulk", 0, 5)) == {b"1", b"2"}
+    assert backend.count_offers_to_index_from_queue() == 2
+    assert backend.count_offers_to_index_from_queue(priority=IndexationPriority.BULK) == 2
+    assert backend.pop_offer_ids_from_queue(count=5) == set()
+    assert backend.pop_offer_ids_from_queue(count=5, priority=IndexationPriority.BULK) == {1, 2}
+
+
 def test_enqueue_offer_ids_in_error(app):
     backend = get_backend()
     backend.enqueue_offer_ids_in_error([1])
@@ -134,6 +147,23 @@ def test_index_offers(app):
     assert backend.check_offer_is_indexed(offer)
 
 
+@pytest.mark.usefixtures("db_session")
+def test_index_offers_skips_unchanged_offers(app):
+    backend = get_backend()
+    offer = offers_factories.StockFactory().offer
+    with requests_mock.Mocker() as mock:
+        posted = mock.post("https://fake-id.algolia.net/1/indexes/fake-index/batch", json={})
+        assert backend.index_offers([offer]) == 0
+        assert posted.call_count == 1
+
+        assert backend.index_offers([offer]) == 1
+        assert posted.call_count == 1
+
+        offer.name = "New name"
+        assert backend.index_offers([offer]) == 0
+        assert posted.call_count == 2
+
+
 def test_unindex_offer_ids(app):
     backend = get_backend()
     app.redis_client.hset("indexed_offers", "1", "")
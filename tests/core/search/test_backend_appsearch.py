@@ -1,11 +1,14 @@
 import dataclasses
+from unittest import mock
 
 import pytest
 import requests_mock
 
 import pcapi.core.offers.factories as offers_factories
 from pcapi.core.search.backends import appsearch
+from pcapi.core.search.backends.base import IndexationPriority
 from pcapi.core.testing import override_settings
+from pcapi.repository import venue_queries
 
 
 @override_settings(APPSEARCH_HOST="https://appsearch.example.com/", APPSEARCH_API_KEY="fake-key")
@@ -24,8 +27,28 @@ def test_enqueue_offer_ids(app):
     backend.enqueue_offer_ids({2, 3})
     backend.enqueue_offer_ids([])
 
-    in_queue = app.redis_client.smembers("search:appsearch:offer-ids-to-index")
-    assert in_queue == {b"1", b"2", b"3"}
+    in_queue = app.redis_client.zrange("search:appsearch:offer-ids-to-index:realtime", 0, -1)
+    assert set(in_queue) == {b"1", b"2", b"3"}
+
+
+def test_enqueue_offer_ids_with_bulk_priority(app):
+    backend = get_backend()
+    backend.enqueue_offer_ids([1, 2], priority=IndexationPriority.BULK)
+
+    assert app.redis_client.zcard("search:appsearch:offer-ids-to-index:realtime") == 0
+    in_queue = app.redis_client.zrange("search:appsearch:offer-ids-to-index:bulk", 0, -1)
+    assert set(in_queue) == {b"1", b"2"}
+
+
+def test_enqueue_offer_ids_keeps_oldest_date(app):
+    backend = get_backend()
+    with mock.patch("time.time", return_value=1000):
+        backend.enqueue_offer_ids([1])
+    with mock.patch("time.time", return_value=2000):
+        backend.enqueue_offer_ids([1, 2])
+
+    in_queue = app.redis_client.zrange("search:appsearch:offer-ids-to-index:realtime", 0, -1, withscores=True)
+    assert in_queue == [(b"1", 1000), (b"2", 2000)]
 
 
 def test_enqueue_offer_ids_in_error(app):
@@ -48,26 +71,51 @@ def test_enqueue_venue_ids(app):
     assert in_queue == {b"1", b"2", b"3"}
 
 
+def test_enqueue_venue_ids_fields_only(app):
+    backend = get_backend()
+    backend.enqueue_venue_ids([1, 2], venue_fields_only=True)
+
+    assert app.redis_client.scard("search:appsearch:venue-ids-to-index") == 0
+    in_queue = app.redis_client.smembers("search:appsearch:venue-ids-to-partially-index")
+    assert in_queue == {b"1", b"2"}
+
+
 def test_pop_offer_ids_from_queue(app):
     backend = get_backend()
-    app.redis_client.sadd("search:appsearch:offer-ids-to-index", 1, 2, 3)
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:realtime", {1: 30, 2: 10, 3: 20})
 
-    popped = set()
     offer_ids = backend.pop_offer_ids_from_queue(count=2)
-    popped |= offer_ids
-    assert len(offer_ids) == 2
-    assert offer_ids.issubset({1, 2, 3})
+    assert offer_ids == {2, 3}  # oldest first
 
     offer_ids = backend.pop_offer_ids_from_queue(count=2)
-    popped |= offer_ids
-    assert len(offer_ids) == 1
-    assert offer_ids.issubset({1, 2, 3})
-    assert popped == {1, 2, 3}
+    assert offer_ids == {1}
 
     offer_ids = backend.pop_offer_ids_from_queue(count=2)
     assert offer_ids == set()
 
 
+def test_pop_offer_ids_from_bulk_queue(app):
+    backend = get_backend()
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:bulk", {1: 10})
+
+    assert backend.pop_offer_ids_from_queue(count=2) == set()
+    assert backend.pop_offer_ids_from_queue(count=2, priority=IndexationPriority.BULK) == {1}
+
+
+def test_pop_offer_ids_from_legacy_queue(app):
+    backend = get_backend()
+    app.redis_client.sadd("search:appsearch:offer-ids-to-index", 1, 2)
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:realtime", {3: 10})
+
+    assert backend.count_offers_to_index_from_queue() == 3
+    assert backend.count_offers_to_index_from_queue(priority=IndexationPriority.REALTIME) == 3
+    assert backend.count_offers_to_index_from_queue(priority=IndexationPriority.BULK) == 0
+    assert backend.pop_offer_ids_from_queue(count=2, priority=IndexationPriority.BULK) == set()
+    assert backend.pop_offer_ids_from_queue(count=2) == {1, 2}
+    assert backend.pop_offer_ids_from_queue(count=2) == {3}
+    assert backend.count_offers_to_index_from_queue() == 0
+
+
 def test_pop_offer_ids_from_error_queue(app):
     backend = get_backend()
     app.redis_client.sadd("search:appsearch:offer-ids-in-error-to-index", 1, 2, 3)
@@ -113,8 +161,24 @@ def test_delete_venue_ids_from_queue(app):
 def test_count_offers_to_index_from_queue(app):
     backend = get_backend()
     assert backend.count_offers_to_index_from_queue() == 0
-    app.redis_client.sadd("search:appsearch:offer-ids-to-index", 1, 2, 3)
-    assert backend.count_offers_to_index_from_queue() == 3
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:realtime", {1: 10, 2: 10, 3: 10})
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:bulk", {4: 10})
+    assert backend.count_offers_to_index_from_queue() == 4
+    assert backend.count_offers_to_index_from_queue(priority=IndexationPriority.REALTIME) == 3
+    assert backend.count_offers_to_index_from_queue(priority=IndexationPriority.BULK) == 1
+
+
+def test_get_offer_queue_stats(app):
+    backend = get_backend()
+    app.redis_client.zadd("search:appsearch:offer-ids-to-index:realtime", {1: 1000, 2: 1500})
+
+    with mock.patch("time.time", return_value=1600):
+        stats = backend.get_offer_queue_stats()
+
+    assert stats == {
+        "realtime": {"count": 2, "oldest_age": 600},
+        "bulk": {"count": 0, "oldest_age": None},
+    }
 
 
 def test_count_offers_to_index_from_error_queue(app):
@@ -143,6 +207,115 @@ def test_index_offers(app):
         assert posted_json[0]["description"] == offer.description
 
 
+@pytest.mark.usefixtures("db_session")
+@override_settings(APPSEARCH_MAX_CONCURRENT_REQUESTS=2)
+def test_index_offers_with_failing_batch(app):
+    backend = get_backend()
+    offer1 = offers_factories.StockFactory().offer
+    offer2 = offers_factories.StockFactory().offer
+
+    def respond(request, context):
+        document = request.json()[0]
+        if document["id"] == offer2.id:
+            context.status_code = 503
+            return {}
+        return [{"id": document["id"], "errors": []}]
+
+    with mock.patch("pcapi.core.search.backends.appsearch.DOCUMENTS_PER_REQUEST_LIMIT", 1):
+        with requests_mock.Mocker() as mocker:
+            posted = mocker.post("https://appsearch.example.com/api/as/v1/engines/offers/documents", json=respond)
+            backend.index_offers([offer1, offer2])
+
+    assert posted.call_count == 2
+    in_error_queue = app.redis_client.smembers("search:appsearch:offer-ids-in-error-to-index")
+    assert in_error_queue == {str(offer2.id).encode()}
+    fingerprints = app.redis_client.hkeys("search:appsearch:indexed-offer-fingerprints")
+    assert fingerprints == [str(offer1.id).encode()]
+
+
+@pytest.mark.usefixtures("db_session")
+def test_index_offers_skips_unchanged_offers(app):
+    backend = get_backend()
+    offer = offers_factories.StockFactory().offer
+    url = "https://appsearch.example.com/api/as/v1/engines/offers/documents"
+    with requests_mock.Mocker() as mocker:
+        posted = mocker.post(url, json=[{"item": offer.id, "errors": []}])
+        mocker.delete(url)
+        assert backend.index_offers([offer]) == 0
+        assert posted.call_count == 1
+
+        assert backend.index_offers([offer]) == 1
+        assert posted.call_count == 1
+
+        backend.unindex_offer_ids([offer.id])
+        assert backend.index_offers([offer]) == 0
+        assert posted.call_count == 2
+
+
+@pytest.mark.usefixtures("db_session")
+def test_index_offers_without_skipping_unchanged_offers(app):
+    backend = get_backend()
+    offer = offers_factories.StockFactory().offer
+    url = "https://appsearch.example.com/api/as/v1/engines/offers/documents"
+    with requests_mock.Mocker() as mocker:
+        posted = mocker.post(url, json=[{"item": offer.id, "errors": []}])
+        assert backend.index_offers([offer]) == 0
+        assert backend.index_offers([offer], skip_unchanged=False) == 0
+        assert posted.call_count == 2
+
+
+@pytest.mark.usefixtures("db_session")
+def test_update_venue_fields(app):
+    backend = get_backend()
+    venue = offers_factories.VenueFactory(
+        name="Le Grand Rex",
+        publicName="Rex",
+        latitude=48.87004,
+        longitude=2.3785,
+        departementCode="75",
+        managingOfferer__name="Rex SA",
+    )
+    [venue_fields] = venue_queries.get_indexed_fields_by_ids([venue.id])
+    app.redis_client.hset("search:appsearch:indexed-offer-fingerprints", mapping={1: "abc", 3: "def"})
+    with requests_mock.Mocker() as mocker:
+        patched = mocker.patch(
+            "https://appsearch.example.com/api/as/v1/engines/offers/documents",
+            json=[{"id": 1, "errors": []}, {"id": 2, "errors": ["Document not found"]}],
+        )
+        backend.update_venue_fields(venue_fields, [1, 2])
+
+    assert patched.last_request.json() == [
+        {
+            "id": offer_id,
+            "offerer_name": "Rex SA",
+            "venue_department_code": "75",
+            "venue_name": "Le Grand Rex",
+            "venue_position": "48.87004,2.37850",
+            "venue_public_name": "Rex",
+        }
+        for offer_id in (1, 2)
+    ]
+    assert app.redis_client.scard("search:appsearch:offer-ids-in-error-to-index") == 0
+    fingerprints = app.redis_client.hkeys("search:appsearch:indexed-offer-fingerprints")
+    assert fingerprints == [b"3"]
+
+
+@pytest.mark.usefixtures("db_session")
+def test_update_venue_fields_with_failing_batch(app):
+    backend = get_backend()
+    venue = offers_factories.VenueFactory()
+    [venue_fields] = venue_queries.get_indexed_fields_by_ids([venue.id])
+    app.redis_client.hset("search:appsearch:indexed-offer-fingerprints", mapping={1: "abc", 2: "def"})
+    with requests_mock.Mocker() as mocker:
+        mocker.patch("https://appsearch.example.com/api/as/v1/engines/offers/documents", status_code=503)
+        backend.update_venue_fields(venue_fields, [1])
+
+    in_error_queue = app.redis_client.smembers("search:appsearch:offer-ids-in-error-to-index")
+    assert in_error_queue == {b"1"}
+    fingerprints = app.redis_client.hkeys("search:appsearch:indexed-offer-fingerprints")
+    assert fingerprints == [b"2"]
+
+
 def test_unindex_offer_ids(app):
     backend = get_backend()
     app.redis_client.sadd("search:appsearch:indexed-offer-ids", "1")
@@ -153,5 +326,30 @@ def test_unindex_offer_ids(app):
         assert deleted_json == [1]
 
 
+@override_settings(APPSEARCH_MAX_CONCURRENT_REQUESTS=2)
+def test_unindex_offer_ids_with_failing_batch(app):
+    backend = get_backend()
+
+    def respond(request, context):
+        if request.json() == [2]:
+            context.status_code = 503
+        return {}
+
+    with mock.patch("pcapi.core.search.backends.appsearch.DOCUMENTS_PER_REQUEST_LIMIT", 1):
+        with requests_mock.Mocker() as mocker:
+            deleted = mocker.delete("https://appsearch.example.com/api/as/v1/engines/offers/documents", json=respond)
+            backend.unindex_offer_ids([1, 2, 3])
+
+    assert deleted.call_count == 3
+    in_error_queue = app.redis_client.smembers("search:appsearch:offer-ids-in-error-to-index")
+    assert in_error_queue == {b"2"}
+
+
 def test_unindex_all_offers(app):
-    pass  # FIXME (dbaty): this feature is not implemented yet.
+    backend = get_backend()
+    app.redis_client.hset("search:appsearch:indexed-offer-fingerprints", mapping={1: "abc"})
+    with mock.patch.object(backend.appsearch_client, "delete_all_documents") as mocked_delete_all_documents:
+        backend.unindex_all_offers()
+    mocked_delete_all_documents.assert_called_once_with()
+    # Otherwise, offers would not be pushed again.
+    assert not app.redis_client.exists("search:appsearch:indexed-offer-fingerprints")
@@ -3,12 +3,10 @@ import decimal
 import json
 
 import pytest
-from sqlalchemy.orm import joinedload
 
+from pcapi.core import search
 from pcapi.core.categories import subcategories
-import pcapi.core.offerers.models as offerers_models
 import pcapi.core.offers.factories as offers_factories
-import pcapi.core.offers.models as offers_models
 from pcapi.core.search.backends import appsearch
 from pcapi.core.testing import assert_num_queries
 from pcapi.utils.human_ids import humanize
@@ -127,19 +125,7 @@ def test_app_search_json_encoder_dates():
 
 def test_check_number_of_sql_queries():
     offer = offers_factories.OfferFactory()
-    # FIXME (dbaty, 2021-07-05): we should put these `joinedload` in a
-    # function, and call that function from `_reindex_offer_ids()`
-    # where we fetch offers.
-    offer = (
-        offers_models.Offer.query.options(
-            joinedload(offers_models.Offer.venue).joinedload(offerers_models.Venue.managingOfferer)
-        )
-        .options(joinedload(offers_models.Offer.criteria))
-        .options(joinedload(offers_models.Offer.mediations))
-        .options(joinedload(offers_models.Offer.product))
-        .options(joinedload(offers_models.Offer.stocks))
-        .one()
-    )
+    offer = search.get_base_query_for_offer_indexation().one()
 
     # Make sure that the JOINs above are enough to avoid any extra SQL
     # query below where serializing an offer.
@@ -1,9 +1,15 @@
+import concurrent.futures
+import threading
 from unittest.mock import MagicMock
 from unittest.mock import Mock
 
+import pytest
+
+from pcapi.connectors.api_allocine import AllocineException
 from pcapi.domain.allocine import _exclude_movie_showtimes_with_special_event_type
 from pcapi.domain.allocine import get_movie_poster
 from pcapi.domain.allocine import get_movies_showtimes
+from pcapi.domain.allocine import movie_posters_cache
 
 
 class GetMovieShowtimeListFromAllocineTest:
@@ -81,6 +87,58 @@ class GetMoviePosterTest:
         assert movie_poster == bytes()
 
 
+class MoviePostersCacheTest:
+    def test_downloads_each_poster_once(self):
+        mock_get_movie_poster_from_allocine = MagicMock(side_effect=lambda url: url.encode())
+
+        with movie_posters_cache():
+            posters = [
+                get_movie_poster(url, get_movie_poster_from_api=mock_get_movie_poster_from_allocine)
+                for url in ("http://url.com/1", "http://url.com/2", "http://url.com/1")
+            ]
+
+        assert posters == [b"http://url.com/1", b"http://url.com/2", b"http://url.com/1"]
+        assert mock_get_movie_poster_from_allocine.call_count == 2
+
+    def test_downloads_poster_once_for_concurrent_requests(self):
+        download_started = threading.Event()
+        release_download = threading.Event()
+
+        def slow_download(url):
+            download_started.set()
+            release_download.wait(timeout=5)
+            return b"poster"
+
+        mock_get_movie_poster_from_allocine = MagicMock(side_effect=slow_download)
+        with movie_posters_cache():
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                first = executor.submit(get_movie_poster, "http://url.com", mock_get_movie_poster_from_allocine)
+                assert download_started.wait(timeout=5)
+                second = executor.submit(get_movie_poster, "http://url.com", mock_get_movie_poster_from_allocine)
+                release_download.set()
+                assert first.result() == second.result() == b"poster"
+
+        mock_get_movie_poster_from_allocine.assert_called_once_with("http://url.com")
+
+    def test_does_not_cache_errors(self):
+        mock_get_movie_poster_from_allocine = MagicMock(side_effect=[AllocineException("oops"), b"poster"])
+
+        with movie_posters_cache():
+            with pytest.raises(AllocineException):
+                get_movie_poster("http://url.com", get_movie_poster_from_api=mock_get_movie_poster_from_allocine)
+            poster = get_movie_poster("http://url.com", get_movie_poster_from_api=mock_get_movie_poster_from_allocine)
+
+        assert poster == b"poster"
+
+    def test_does_not_cache_outside_of_context(self):
+        mock_get_movie_poster_from_allocine = MagicMock(return_value=b"poster")
+
+        get_movie_poster("http://url.com", get_movie_poster_from_api=mock_get_movie_poster_from_allocine)
+        get_movie_poster("http://url.com", get_movie_poster_from_api=mock_get_movie_poster_from_allocine)
+
+        assert mock_get_movie_poster_from_allocine.call_count == 2
+
+
 class RemoveMovieShowsWithSpecialEventTypeTest:
     def test_should_remove_movie_shows_with_special_event_type(self):
         # Given
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import pytest
 from sqlalchemy import Sequence
 
@@ -127,3 +129,62 @@ class SaveChunksTest:
         assert len(offers) == 2
         assert any(offer.isDuo for offer in offers)
         assert Stock.query.count() == 1
+
+    @pytest.mark.usefixtures("db_session")
+    def test_save_chunks_only_updates_changed_objects(self, app):
+        # Given
+        offerer = create_offerer()
+        venue = create_venue(offerer)
+        product = create_product_with_thing_subcategory()
+        offer1 = create_offer_with_thing_product(venue, product=product, id_at_providers="1%12345678912345")
+        offer2 = create_offer_with_thing_product(venue, product=product, id_at_providers="2%12345678912345")
+        offer1.name = offer2.name = "Old name"
+        offer1.description = offer2.description = "Old description"
+        repository.save(venue, product, offer1, offer2)
+
+        offer1.name = "New name"
+        offer2.name = "Old name"
+        offer2.dateModifiedAtLastProvider = datetime.utcnow()
+        chunk_to_update = {
+            "1|Offer": offer1,
+            "2|Offer": offer2,
+        }
+
+        # When
+        unchanged_keys = save_chunks({}, chunk_to_update)
+
+        # Then
+        assert unchanged_keys == {"2|Offer"}
+        assert Offer.query.filter_by(name="New name").count() == 1
+        assert Offer.query.filter_by(name="Old name").count() == 1
+
+    @pytest.mark.usefixtures("db_session")
+    def test_save_chunks_detects_changes_when_inserting_and_updating(self, app):
+        # Given
+        offerer = create_offerer()
+        venue = create_venue(offerer)
+        product = create_product_with_thing_subcategory()
+        offer1 = create_offer_with_thing_product(venue, product=product, id_at_providers="1%12345678912345")
+        offer2 = create_offer_with_thing_product(venue, product=product, id_at_providers="2%12345678912345")
+        offer1.name = offer2.name = "Old name"
+        repository.save(venue, product, offer1, offer2)
+
+        new_offer = create_offer_with_thing_product(venue, product=product, id_at_providers="3%12345678912345")
+        new_offer.venueId = venue.id
+        new_offer.name = "Old name"
+        db.session.expunge(new_offer)
+        offer1.name = "New name"
+        offer2.dateModifiedAtLastProvider = datetime.utcnow()
+        chunk_to_insert = {"3|Offer": new_offer}
+        chunk_to_update = {
+            "1|Offer": offer1,
+            "2|Offer": offer2,
+        }
+
+        # When
+        unchanged_keys = save_chunks(chunk_to_insert, chunk_to_update)
+
+        # Then
+        assert unchanged_keys == {"2|Offer"}
+        assert Offer.query.count() == 3
+        assert Offer.query.filter_by(name="New name").count() == 1
@@ -6,6 +6,7 @@ import pytest
 from pcapi.core.categories import subcategories
 import pcapi.core.offerers.factories as offerers_factories
 import pcapi.core.offers.factories as offers_factories
+from pcapi.core.testing import override_settings
 from pcapi.local_providers.local_provider import _save_same_thumb_from_thumb_count_to_index
 from pcapi.model_creators.provider_creators import create_providable_info
 from pcapi.models import ApiErrors
@@ -89,6 +90,58 @@ class UpdateObjectsTest:
         assert product.type == str(ThingType.LIVRE_EDITION)
         assert product.dateModifiedAtLastProvider == providable_info.date_modified_at_provider
 
+    @patch("tests.local_providers.provider_test_utils.TestLocalProvider.__next__")
+    def test_skips_existing_object_when_nothing_has_changed(self, next_function):
+        # Given
+        provider = offerers_factories.AllocineProviderFactory(localClass="TestLocalProvider")
+        providable_info = create_providable_info(date_modified=datetime(2018, 1, 1))
+        offers_factories.ThingProductFactory(
+            dateModifiedAtLastProvider=datetime(2000, 1, 1),
+            lastProvider=provider,
+            idAtProviders=providable_info.id_at_providers,
+            name="New Product",
+            subcategoryId=subcategories.LIVRE_PAPIER.id,
+            type=str(ThingType.LIVRE_EDITION),
+        )
+        local_provider = provider_test_utils.TestLocalProvider()
+        next_function.side_effect = [[providable_info]]
+
+        # When
+        local_provider.updateObjects()
+
+        # Then
+        product = Product.query.one()
+        assert product.dateModifiedAtLastProvider == datetime(2000, 1, 1)
+        assert local_provider.updatedObjects == 1
+        assert local_provider.unchangedObjects == 1
+
+    @patch("pcapi.local_providers.chunk_manager.get_existing_object")
+    @patch("tests.local_providers.provider_test_utils.TestLocalProvider.__next__")
+    def test_looks_up_existing_objects_by_window(self, next_function, mocked_get_existing_object):
+        # Given
+        provider = offerers_factories.AllocineProviderFactory(localClass="TestLocalProvider")
+        providable_info1 = create_providable_info(id_at_providers="1", date_modified=datetime(2018, 1, 1))
+        providable_info2 = create_providable_info(id_at_providers="2")
+        offers_factories.ThingProductFactory(
+            dateModifiedAtLastProvider=datetime(2000, 1, 1),
+            lastProvider=provider,
+            idAtProviders="1",
+            name="Old product name",
+        )
+        local_provider = provider_test_utils.TestLocalProvider()
+        next_function.side_effect = [[providable_info1], [providable_info2], [providable_info2]]
+
+        # When
+        local_provider.updateObjects()
+
+        # Then
+        mocked_get_existing_object.assert_not_called()
+        products = Product.query.order_by(Product.idAtProviders).all()
+        assert [product.idAtProviders for product in products] == ["1", "2"]
+        assert [product.name for product in products] == ["New Product", "New Product"]
+        assert local_provider.createdObjects == 1
+        assert local_provider.updatedObjects == 1
+
     @patch("tests.local_providers.provider_test_utils.TestLocalProvider.__next__")
     def test_does_not_update_existing_object_when_date_is_older_than_last_modified_date(self, next_function):
         # Given
@@ -113,6 +166,46 @@ class UpdateObjectsTest:
         assert product.type == str(ThingType.INSTRUMENT)
         assert product.dateModifiedAtLastProvider == datetime(2020, 1, 1)
 
+    @patch("tests.local_providers.provider_test_utils.TestLocalProviderWithApiErrors.__next__")
+    def test_aggregates_errors_in_provider_events(self, next_function):
+        # Given
+        offerers_factories.AllocineProviderFactory(localClass="TestLocalProviderWithApiErrors")
+        providable_info1 = create_providable_info(id_at_providers="1")
+        providable_info2 = create_providable_info(id_at_providers="2")
+        local_provider = provider_test_utils.TestLocalProviderWithApiErrors()
+        next_function.side_effect = [[providable_info1], [providable_info2]]
+
+        # When
+        local_provider.updateObjects()
+
+        # Then
+        provider_events = LocalProviderEvent.query.order_by(LocalProviderEvent.id.asc()).all()
+        assert [(event.type, event.payload) for event in provider_events] == [
+            (LocalProviderEventType.SyncStart, "None"),
+            (LocalProviderEventType.SyncError, "ApiErrors (x2)"),
+            (LocalProviderEventType.SyncEnd, "None"),
+        ]
+        assert local_provider.erroredObjects == 2
+
+    @patch("tests.local_providers.provider_test_utils.TestLocalProviderWithApiErrors.__next__")
+    def test_saves_provider_events_when_synchronization_fails(self, next_function):
+        # Given
+        offerers_factories.AllocineProviderFactory(localClass="TestLocalProviderWithApiErrors")
+        providable_info = create_providable_info(id_at_providers="1")
+        local_provider = provider_test_utils.TestLocalProviderWithApiErrors()
+        next_function.side_effect = [[providable_info], ValueError("It does not work")]
+
+        # When
+        with pytest.raises(ValueError):
+            local_provider.updateObjects()
+
+        # Then
+        provider_events = LocalProviderEvent.query.order_by(LocalProviderEvent.id.asc()).all()
+        assert [(event.type, event.payload) for event in provider_events] == [
+            (LocalProviderEventType.SyncStart, "None"),
+            (LocalProviderEventType.SyncError, "ApiErrors"),
+        ]
+
     @patch("tests.local_providers.provider_test_utils.TestLocalProvider.__next__")
     def test_does_not_update_objects_when_venue_provider_is_not_active(self, next_function):
         # Given
@@ -173,6 +266,31 @@ class UpdateObjectsTest:
         assert new_product.name == "New Product"
         assert new_product.type == str(ThingType.LIVRE_EDITION)
 
+    @override_settings(THUMBS_PIPELINE_PROCESSES=1)
+    @patch("tests.local_providers.provider_test_utils.TestLocalProviderWithThumb.__next__")
+    def test_creates_thumbs_in_pipeline(self, next_function):
+        # Given
+        provider = offerers_factories.AllocineProviderFactory(localClass="TestLocalProviderWithThumb")
+        providable_info = create_providable_info(date_modified=datetime(2018, 1, 1))
+        product = offers_factories.ThingProductFactory(
+            dateModifiedAtLastProvider=datetime(2020, 1, 1),
+            lastProvider=provider,
+            idAtProviders=providable_info.id_at_providers,
+            thumbCount=0,
+        )
+        local_provider = provider_test_utils.TestLocalProviderWithThumb()
+        next_function.side_effect = [[providable_info]]
+
+        # When
+        local_provider.updateObjects()
+
+        # Then
+        assert Product.query.one().thumbCount == 1
+        assert local_provider.checkedThumbs == 1
+        assert local_provider.createdThumbs == 1
+        assert local_provider.erroredThumbs == 0
+        assert local_provider.thumbs_pipeline is None
+
 
 @pytest.mark.usefixtures("db_session")
 class CreateObjectTest:
@@ -207,6 +325,7 @@ class CreateObjectTest:
             "Une offre de type Vente et location d’instruments de musique ne peut pas être numérique"
         ]
         assert Product.query.count() == 0
+        local_provider.flush_provider_events()
         provider_event = LocalProviderEvent.query.one()
         assert provider_event.type == LocalProviderEventType.SyncError
 
@@ -254,6 +373,7 @@ class HandleUpdateTest:
         assert api_errors.value.errors["url"] == [
             "Une offre de type Vente et location d’instruments de musique ne peut pas être numérique"
         ]
+        local_provider.flush_provider_events()
         provider_event = LocalProviderEvent.query.one()
         assert provider_event.type == LocalProviderEventType.SyncError
 
@@ -300,6 +420,28 @@ class HandleThumbTest:
         assert local_provider.createdThumbs == 4
         assert product.thumbCount == 4
 
+    @patch("pcapi.local_providers.local_provider.create_thumb")
+    def test_skip_thumb_when_source_image_has_not_changed(self, mocked_create_thumb):
+        # Given
+        provider = offerers_factories.AllocineProviderFactory(localClass="TestLocalProviderWithThumb")
+        providable_info = create_providable_info()
+        product = offers_factories.ThingProductFactory(
+            idAtProviders=providable_info.id_at_providers,
+            lastProvider=provider,
+        )
+        local_provider = provider_test_utils.TestLocalProviderWithThumb()
+        local_provider._handle_thumb(product)
+
+        # When
+        local_provider._handle_thumb(product)
+
+        # Then
+        mocked_create_thumb.assert_called_once()
+        assert local_provider.checkedThumbs == 2
+        assert local_provider.createdThumbs == 1
+        assert local_provider.updatedThumbs == 0
+        assert product.thumbCount == 1
+
 
 @pytest.mark.usefixtures("db_session")
 class SaveThumbFromThumbCountToIndexTest:
@@ -1,3 +1,6 @@
+from collections import Counter
+import threading
+import time
 from unittest.mock import call
 from unittest.mock import patch
 
@@ -5,6 +8,7 @@ import pytest
 
 import pcapi.core.offerers.factories as offerers_factories
 from pcapi.core.offerers.factories import VenueProviderFactory
+from pcapi.local_providers.provider_api.provider_api_stocks import run_in_pool
 from pcapi.local_providers.provider_api.provider_api_stocks import synchronize_stocks
 
 
@@ -34,3 +38,28 @@ class ProviderApiStocksTest:
         # Then
         assert mocked_synchronize_venue_provider.call_count == len(correct_venue_providers)
         mocked_synchronize_venue_provider.assert_has_calls(call(v) for v in correct_venue_providers)
+
+
+class RunInPoolTest:
+    def test_limit_number_of_workers_per_key(self):
+        lock = threading.Lock()
+        running = Counter()
+        max_running = Counter()
+        processed = []
+
+        def func(item):
+            key, _ = item
+            with lock:
+                running[key] += 1
+                max_running[key] = max(max_running[key], running[key])
+            time.sleep(0.01)
+            with lock:
+                running[key] -= 1
+                processed.append(item)
+
+        items_by_key = {"a": [("a", i) for i in range(6)], "b": [("b", i) for i in range(3)]}
+        run_in_pool(func, items_by_key, pool_size=4, max_workers_per_key=2)
+
+        assert sorted(processed) == sorted(items_by_key["a"] + items_by_key["b"])
+        assert max_running["a"] <= 2
+        assert max_running["b"] <= 2
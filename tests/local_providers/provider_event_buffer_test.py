@@ -0,0 +1,33 @@
+from pcapi.core.providers.models import Provider
+from pcapi.local_providers.provider_event_buffer import ProviderEventBuffer
+from pcapi.local_providers.provider_event_buffer import format_payload
+from pcapi.models.local_provider_event import LocalProviderEventType
+
+
+def test_format_payload():
+    assert format_payload("ApiErrors", 1) == "ApiErrors"
+    assert format_payload("ApiErrors", 12) == "ApiErrors (x12)"
+    long_payload = "Error parsing movie for theater 12345678901234 of venue"
+    assert format_payload(long_payload, 1) == long_payload[:50]
+    assert format_payload(long_payload, 12) == long_payload[:44] + " (x12)"
+
+
+def test_aggregates_events_by_type_and_payload(caplog):
+    provider = Provider(id=1)
+    buffer = ProviderEventBuffer()
+    for i in range(12):
+        buffer.add(LocalProviderEventType.SyncError, "ApiErrors", sample_id=str(i))
+    buffer.add(LocalProviderEventType.SyncError, "number of elements mismatch")
+
+    events = buffer.pop_events(provider)
+
+    assert [(event.type, event.payload, event.providerId) for event in events] == [
+        (LocalProviderEventType.SyncError, "ApiErrors (x12)", 1),
+        (LocalProviderEventType.SyncError, "number of elements mismatch", 1),
+    ]
+    assert caplog.records[0].count == 12
+    assert caplog.records[0].sample_ids == [str(i) for i in range(10)]
+    assert caplog.records[1].count == 1
+    assert caplog.records[1].sample_ids == []
+    assert len(buffer) == 0
+    assert buffer.pop_events(provider) == []
@@ -6,6 +6,7 @@ import pytest
 
 from pcapi.core.offerers.factories import APIProviderFactory
 from pcapi.core.offerers.factories import AllocineProviderFactory
+from pcapi.core.testing import override_settings
 from pcapi.local_providers.provider_manager import do_update
 from pcapi.local_providers.provider_manager import synchronize_data_for_provider
 from pcapi.local_providers.provider_manager import synchronize_venue_provider
@@ -36,10 +37,11 @@ class DoUpdateTest:
         provider_mock.updateObjects = MagicMock()
 
         # When
-        do_update(provider_mock, 10)
+        synchronized = do_update(provider_mock, 10)
 
         # Then
         provider_mock.updateObjects.assert_called_once_with(10)
+        assert synchronized
 
     @patch("pcapi.local_providers.provider_manager.build_cron_log_message")
     def test_should_call_remove_worker_id_when_exception_is_raised(self, mock_build_cron_log_message, app):
@@ -48,10 +50,11 @@ class DoUpdateTest:
         provider_mock.updateObjects = mock_update_objects
 
         # When
-        do_update(provider_mock, 10)
+        synchronized = do_update(provider_mock, 10)
 
         # Then
         mock_build_cron_log_message.assert_called_once_with(name="MagicMock", status=ANY)
+        assert not synchronized
 
 
 class SynchronizeVenueProviderTest:
@@ -194,6 +197,35 @@ class SynchronizeVenueProvidersForProviderTest:
         # Then
         mock_synchronize_venue_provider.assert_called_once()
 
+    @override_settings(IS_RUNNING_TESTS=False)  # otherwise the pool is not used
+    @patch("pcapi.local_providers.provider_manager.synchronize_venue_provider")
+    @pytest.mark.usefixtures("db_session")
+    def test_retry_failed_venue_providers_after_pool(self, mock_synchronize_venue_provider, app):
+        # Given
+        provider = AllocineProviderFactory()
+        offerer = create_offerer()
+        venue_providers = [
+            create_venue_provider(create_venue(offerer, siret=f"1234567890000{i}"), provider) for i in range(2)
+        ]
+        repository.save(*venue_providers)
+        failing_venue_provider_id = venue_providers[0].id
+        calls = []
+
+        def synchronize(venue_provider, limit):
+            calls.append(venue_provider.id)
+            if venue_provider.id == failing_venue_provider_id and calls.count(venue_provider.id) == 1:
+                raise Exception("Could not create product")
+            return True
+
+        mock_synchronize_venue_provider.side_effect = synchronize
+
+        # When
+        synchronize_venue_providers_for_provider(provider.id, 10, pool_size=2)
+
+        # Then
+        assert sorted(calls[:2]) == sorted(venue_provider.id for venue_provider in venue_providers)
+        assert calls[2:] == [failing_venue_provider_id]
+
 
 class SynchronizeDataForProviderTest:
     @patch("pcapi.local_providers.provider_manager.do_update")
@@ -5,6 +5,7 @@ from freezegun.api import freeze_time
 import pytest
 import requests_mock
 
+from pcapi.core import search
 from pcapi.core.bookings.factories import BookingFactory
 from pcapi.core.categories import subcategories
 import pcapi.core.offerers.factories as offerers_factories
@@ -168,8 +169,8 @@ class ProviderAPICronTest:
 
         # Test it adds offer in redis
         assert mocked_async_index_offer_ids.mock_calls == [
-            mock.call({offer.id, created_offer.id, stock.offer.id}),
-            mock.call({stock_with_booking.offer.id, second_created_offer.id}),
+            mock.call({offer.id, created_offer.id, stock.offer.id}, priority=search.IndexationPriority.BULK),
+            mock.call({stock_with_booking.offer.id, second_created_offer.id}, priority=search.IndexationPriority.BULK),
         ]
 
         # Ensure next synchronisation is done with modifiedSince parameter
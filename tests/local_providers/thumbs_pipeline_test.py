@@ -0,0 +1,102 @@
+from pathlib import Path
+from unittest.mock import patch
+
+from pcapi.connectors import thumb_storage
+from pcapi.local_providers.thumbs_pipeline import ThumbsPipeline
+from pcapi.local_providers.thumbs_pipeline import get_thumb_indexes_to_create
+import pcapi.sandboxes
+
+
+def _get_thumb():
+    file_path = Path(pcapi.sandboxes.__path__[0]) / "providers" / "titelive_mocks" / "provider_thumb.jpeg"
+    return file_path.read_bytes()
+
+
+class FakeObjectWithThumb:
+    def __init__(self, name, thumb_count=0):
+        self.name = name
+        self.thumbCount = thumb_count
+
+    def get_thumb_storage_id(self, index):
+        return f"{self.name}_{index}"
+
+
+class GetThumbIndexesToCreateTest:
+    def test_replace_existing_thumb(self):
+        assert get_thumb_indexes_to_create(4, 1) == ([0], 4)
+        assert get_thumb_indexes_to_create(4, 4) == ([3], 4)
+
+    def test_create_missing_thumbs(self):
+        assert get_thumb_indexes_to_create(None, 3) == ([0, 1, 2], 3)
+        assert get_thumb_indexes_to_create(1, 3) == ([1, 2], 3)
+
+
+class ThumbsPipelineTest:
+    @patch("pcapi.local_providers.thumbs_pipeline.object_storage.store_public_object")
+    def test_create_and_upload_thumbs(self, mocked_store_public_object):
+        pipeline = ThumbsPipeline(processes=2, upload_threads=2, max_pending=2)
+        objects = [FakeObjectWithThumb(f"object{i}") for i in range(5)]
+        try:
+            for obj in objects:
+                pipeline.submit(obj, obj.name, _get_thumb(), 1)
+            # A second thumb for the same object starts from the thumb
+            # count that it will have after its first thumb.
+            pipeline.submit(objects[0], objects[0].name, _get_thumb(), 3)
+            results = pipeline.join()
+        finally:
+            pipeline.shutdown()
+
+        assert [(job.key, job.indexes, job.new_thumb_count, exception) for job, exception in results] == [
+            ("object0", [0], 1, None),
+            ("object1", [0], 1, None),
+            ("object2", [0], 1, None),
+            ("object3", [0], 1, None),
+            ("object4", [0], 1, None),
+            ("object0", [1, 2], 3, None),
+        ]
+        # The pipeline does not update objects itself.
+        assert all(obj.thumbCount == 0 for obj in objects)
+        uploaded_ids = sorted(call.kwargs["object_id"] for call in mocked_store_public_object.call_args_list)
+        assert uploaded_ids == [
+            "object0_0",
+            "object0_1",
+            "object0_2",
+            "object1_0",
+            "object2_0",
+            "object3_0",
+            "object4_0",
+        ]
+        blob = mocked_store_public_object.call_args_list[0].kwargs["blob"]
+        assert blob.startswith(b"\xff\xd8")  # JPEG
+
+    @patch("pcapi.local_providers.thumbs_pipeline.object_storage.store_public_object")
+    def test_return_errors(self, mocked_store_public_object):
+        pipeline = ThumbsPipeline(processes=1, upload_threads=1, max_pending=10)
+        try:
+            pipeline.submit(FakeObjectWithThumb("invalid"), "invalid", b"not an image", 1)
+            pipeline.submit(FakeObjectWithThumb("valid"), "valid", _get_thumb(), 1)
+            results = pipeline.join()
+        finally:
+            pipeline.shutdown()
+
+        assert results[0][1] is not None
+        assert results[1][1] is None
+        mocked_store_public_object.assert_called_once()
+        assert pipeline.join() == []
+
+    @patch("pcapi.local_providers.thumbs_pipeline.object_storage.store_public_object")
+    def test_skip_thumbs_whose_source_image_has_not_changed(self, mocked_store_public_object):
+        thumb = _get_thumb()
+        obj = FakeObjectWithThumb("object", thumb_count=2)
+        thumb_storage.set_source_hashes({"object_0": thumb_storage.get_source_hash(thumb)})
+        pipeline = ThumbsPipeline(processes=1, upload_threads=1, max_pending=10)
+        try:
+            pipeline.submit(obj, "object", thumb, 1)  # same image
+            pipeline.submit(obj, "object", thumb, 2)  # new image for this index
+            results = pipeline.join()
+        finally:
+            pipeline.shutdown()
+
+        assert [(job.indexes, exception) for job, exception in results] == [([], None), ([1], None)]
+        mocked_store_public_object.assert_called_once()
+        assert mocked_store_public_object.call_args.kwargs["object_id"] == "object_1"
@@ -402,7 +402,7 @@ class TiteliveThingsTest:
         # Then
         assert Product.query.count() == 1
         provider_log_error = LocalProviderEvent.query.filter_by(type=LocalProviderEventType.SyncError).one()
-        assert provider_log_error.payload == "Error deleting product with ISBN: 9782895026310"
+        assert provider_log_error.payload == "Error deleting product with bookings"
 
     @pytest.mark.usefixtures("db_session")
     @patch("pcapi.local_providers.titelive_things.titelive_things.get_files_to_process_from_titelive_ftp")
@@ -22,10 +22,11 @@ from pcapi.models import Offer
 from pcapi.models import Stock
 from pcapi.repository import repository
 from pcapi.repository.offer_queries import _build_bookings_quantity_subquery
+from pcapi.repository.offer_queries import get_offer_ids_by_venue_id_in_batches
+from pcapi.repository.offer_queries import get_offer_ids_in_batches
 from pcapi.repository.offer_queries import get_offers_by_ids
 from pcapi.repository.offer_queries import get_offers_by_venue_id
 from pcapi.repository.offer_queries import get_paginated_active_offer_ids
-from pcapi.repository.offer_queries import get_paginated_offer_ids_by_venue_id
 
 
 class FindOffersTest:
@@ -252,33 +253,34 @@ class GetPaginatedActiveOfferIdsTest:
         assert offer_ids == [offer4.id]
 
 
-class GetPaginatedOfferIdsByVenueIdTest:
+class GetOfferIdsInBatchesTest:
     @pytest.mark.usefixtures("db_session")
-    def test_should_return_one_offer_id_in_two_offers_from_first_page_when_limit_is_one(self, app):
-        # Given
-        offerer = create_offerer()
-        venue = create_venue(offerer=offerer)
-        offer1 = create_offer_with_event_product(venue=venue)
-        offer2 = create_offer_with_event_product(venue=venue)
-        repository.save(offer1, offer2)
+    def test_yield_batches(self, app):
+        offer1 = ThingOfferFactory()
+        ThingOfferFactory(isActive=False)
+        offer3 = ThingOfferFactory()
+        offer4 = ThingOfferFactory()
 
-        # When
-        offer_ids = get_paginated_offer_ids_by_venue_id(venue_id=venue.id, limit=1, page=0)
+        query = Offer.query.filter(Offer.isActive.is_(True))
+        batches = list(get_offer_ids_in_batches(query, batch_size=2))
 
-        # Then
-        assert offer_ids == [offer1.id]
+        assert batches == [[offer1.id, offer3.id], [offer4.id]]
 
     @pytest.mark.usefixtures("db_session")
-    def test_should_return_one_offer_id_in_two_offers_from_second_page_when_limit_is_one(self, app):
-        # Given
-        offerer = create_offerer()
-        venue = create_venue(offerer=offerer)
-        offer1 = create_offer_with_event_product(venue=venue)
-        offer2 = create_offer_with_event_product(venue=venue)
-        repository.save(offer1, offer2)
+    def test_yield_nothing_when_no_offers(self, app):
+        query = Offer.query.filter(Offer.isActive.is_(True))
 
-        # When
-        offer_ids = get_paginated_offer_ids_by_venue_id(venue_id=venue.id, limit=1, page=1)
+        assert list(get_offer_ids_in_batches(query, batch_size=2)) == []
 
-        # Then
-        assert offer_ids == [offer2.id]
+
+class GetOfferIdsByVenueIdInBatchesTest:
+    @pytest.mark.usefixtures("db_session")
+    def test_yield_batches_of_offers_of_venue(self, app):
+        venue = VenueFactory()
+        offer1 = ThingOfferFactory(venue=venue)
+        offer2 = ThingOfferFactory(venue=venue)
+        ThingOfferFactory()  # other venue
+
+        batches = list(get_offer_ids_by_venue_id_in_batches(venue_id=venue.id, batch_size=1))
+
+        assert batches == [[offer1.id], [offer2.id]]
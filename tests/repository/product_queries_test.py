@@ -1,6 +1,12 @@
+from unittest.mock import patch
+
 import pytest
 
+from pcapi.core import search
+from pcapi.core.bookings.factories import BookingFactory
 from pcapi.core.categories import subcategories
+import pcapi.core.offers.factories as offers_factories
+from pcapi.core.offers.models import ActivationCode
 from pcapi.core.offers.models import Mediation
 from pcapi.core.users import factories as users_factories
 from pcapi.model_creators.generic_creators import create_booking
@@ -11,12 +17,15 @@ from pcapi.model_creators.generic_creators import create_stock
 from pcapi.model_creators.generic_creators import create_venue
 from pcapi.model_creators.specific_creators import create_offer_with_thing_product
 from pcapi.model_creators.specific_creators import create_product_with_thing_subcategory
+from pcapi.models import Criterion
 from pcapi.models import Favorite
 from pcapi.models import Offer
+from pcapi.models import OfferCriterion
 from pcapi.models import Product
 from pcapi.models import Stock
 from pcapi.repository import repository
 from pcapi.repository.product_queries import delete_unwanted_existing_product
+from pcapi.repository.product_queries import delete_unwanted_existing_products
 from pcapi.repository.product_queries import find_active_book_product_by_isbn
 
 
@@ -156,6 +165,71 @@ class DeleteUnwantedExistingProductTest:
         assert Favorite.query.count() == 0
 
 
+class DeleteUnwantedExistingProductsTest:
+    @pytest.mark.usefixtures("db_session")
+    @patch("pcapi.core.search.async_index_offer_ids")
+    @patch("pcapi.core.search.unindex_offer_ids")
+    def test_delete_or_deactivate_all_products_at_once(self, mocked_unindex_offer_ids, mocked_async_index_offer_ids):
+        # Given
+        product_to_delete = offers_factories.ThingProductFactory(
+            idAtProviders="1111111111111", subcategoryId=subcategories.LIVRE_PAPIER.id
+        )
+        offer_to_delete = offers_factories.ThingOfferFactory(product=product_to_delete)
+        offers_factories.ThingStockFactory(offer=offer_to_delete)
+        offers_factories.MediationFactory(offer=offer_to_delete)
+        product_with_bookings = offers_factories.ThingProductFactory(
+            idAtProviders="2222222222222", subcategoryId=subcategories.LIVRE_PAPIER.id
+        )
+        booked_offer = offers_factories.ThingOfferFactory(product=product_with_bookings, isActive=True)
+        BookingFactory(stock__offer=booked_offer)
+        other_product = offers_factories.ThingProductFactory(
+            idAtProviders="3333333333333", subcategoryId=subcategories.LIVRE_PAPIER.id
+        )
+        offer_to_delete_id = offer_to_delete.id
+
+        # When
+        isbns_with_bookings = delete_unwanted_existing_products(["1111111111111", "2222222222222", "9999999999999"])
+
+        # Then
+        assert isbns_with_bookings == {"2222222222222"}
+        assert set(Product.query.all()) == {product_with_bookings, other_product}
+        assert not product_with_bookings.isGcuCompatible
+        assert other_product.isGcuCompatible
+        assert Offer.query.one() == booked_offer
+        assert not booked_offer.isActive
+        assert Mediation.query.count() == 0
+        mocked_unindex_offer_ids.assert_called_once_with([offer_to_delete_id])
+        mocked_async_index_offer_ids.assert_called_once_with([booked_offer.id], priority=search.IndexationPriority.BULK)
+
+    @pytest.mark.usefixtures("db_session")
+    @patch("pcapi.core.search.unindex_offer_ids")
+    def test_delete_criteria_and_activation_codes(self, mocked_unindex_offer_ids):
+        product = offers_factories.ThingProductFactory(
+            idAtProviders="1111111111111", subcategoryId=subcategories.LIVRE_PAPIER.id
+        )
+        offer = offers_factories.ThingOfferFactory(product=product)
+        stock = offers_factories.ThingStockFactory(offer=offer)
+        offers_factories.ActivationCodeFactory(stock=stock)
+        criterion = offers_factories.OfferCriterionFactory(offer=offer).criterion
+
+        assert delete_unwanted_existing_products(["1111111111111"]) == set()
+
+        assert Product.query.count() == 0
+        assert Offer.query.count() == 0
+        assert Stock.query.count() == 0
+        assert ActivationCode.query.count() == 0
+        assert OfferCriterion.query.count() == 0
+        assert Criterion.query.one() == criterion
+
+    @pytest.mark.usefixtures("db_session")
+    def test_do_nothing_when_no_product_is_found(self):
+        offers_factories.ThingProductFactory(idAtProviders="1111111111111", subcategoryId=subcategories.LIVRE_PAPIER.id)
+
+        assert delete_unwanted_existing_products(["9999999999999"]) == set()
+
+        assert Product.query.count() == 1
+
+
 class FindActiveBookProductByIsbnTest:
     @pytest.mark.usefixtures("db_session")
     def test_should_return_active_book_product_when_existing_isbn_is_given(self, app):
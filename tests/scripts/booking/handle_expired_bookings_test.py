@@ -22,13 +22,16 @@ class CancelExpiredBookingsTest:
         book = ProductFactory(subcategoryId=subcategories.LIVRE_PAPIER.id)
         old_book_booking = BookingFactory(stock__offer__product=book, dateCreated=two_months_ago)
 
-        handle_expired_bookings.cancel_expired_bookings()
+        expired_bookings = handle_expired_bookings.cancel_expired_bookings()
 
         assert old_book_booking.isCancelled
         assert old_book_booking.status is BookingStatus.CANCELLED
         assert old_book_booking.cancellationDate.timestamp() == pytest.approx(datetime.utcnow().timestamp(), rel=1)
         assert old_book_booking.cancellationReason == BookingCancellationReasons.EXPIRED
         assert old_book_booking.stock.dnBookedQuantity == 0
+        assert expired_bookings == [
+            (old_book_booking.id, old_book_booking.stockId, old_book_booking.userId, old_book_booking.offererId)
+        ]
 
     def should_not_cancel_new_thing_that_can_expire_booking(self, app) -> None:
         book = ProductFactory(subcategoryId=subcategories.LIVRE_PAPIER.id)
@@ -118,20 +121,11 @@ class CancelExpiredBookingsTest:
         two_months_ago = now - timedelta(days=60)
         book = ProductFactory(subcategoryId=subcategories.LIVRE_PAPIER.id)
         BookingFactory.create_batch(size=10, stock__offer__product=book, dateCreated=two_months_ago)
-        n_queries = (
-            1  # select count
-            + 1  # select initial booking ids
+        n_queries = 1  # release savepoint/COMMIT
+        n_queries += 4 * (  # batches
+            3  # find expiring bookings ; lock their stocks ; cancel bookings and update stocks
             + 1  # release savepoint/COMMIT
-            + 4
-            * (
-                1  # update
-                + 1  # release savepoint/COMMIT
-                + 1  # select stock
-                + 1  # recompute dnBookedQuantity
-                + 1  # select next ids
-            )
         )
-
         with assert_num_queries(n_queries):
             handle_expired_bookings.cancel_expired_bookings(batch_size=3)
 
@@ -176,6 +170,18 @@ class NotifyUsersOfExpiredBookingsTest:
             [expired_today_cd_booking],
         )
 
+    @mock.patch("pcapi.scripts.booking.handle_expired_bookings.send_expired_bookings_recap_email_to_beneficiary")
+    def should_notify_of_given_expired_bookings(self, mocked_send_email_recap, app) -> None:
+        booking = CancelledBookingFactory(cancellationReason=BookingCancellationReasons.EXPIRED)
+        CancelledBookingFactory(cancellationReason=BookingCancellationReasons.EXPIRED)
+        expired_booking = handle_expired_bookings.ExpiredBooking(
+            booking.id, booking.stockId, booking.userId, booking.offererId
+        )
+
+        handle_expired_bookings.notify_users_of_expired_bookings(expired_bookings=[expired_booking])
+
+        mocked_send_email_recap.assert_called_once_with(booking.user, [booking])
+
 
 @pytest.mark.usefixtures("db_session")
 class NotifyOfferersOfExpiredBookingsTest:
@@ -216,3 +222,15 @@ class NotifyOfferersOfExpiredBookingsTest:
             expired_today_cd_booking.stock.offer.venue.managingOfferer,
             [expired_today_cd_booking],
         )
+
+    @mock.patch("pcapi.scripts.booking.handle_expired_bookings.send_expired_bookings_recap_email_to_offerer")
+    def should_notify_of_given_expired_bookings(self, mocked_send_email_recap, app) -> None:
+        booking = CancelledBookingFactory(cancellationReason=BookingCancellationReasons.EXPIRED)
+        CancelledBookingFactory(cancellationReason=BookingCancellationReasons.EXPIRED)
+        expired_booking = handle_expired_bookings.ExpiredBooking(
+            booking.id, booking.stockId, booking.userId, booking.offererId
+        )
+
+        handle_expired_bookings.notify_offerers_of_expired_bookings(expired_bookings=[expired_booking])
+
+        mocked_send_email_recap.assert_called_once_with(booking.stock.offer.venue.managingOfferer, [booking])
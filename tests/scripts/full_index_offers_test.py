@@ -0,0 +1,66 @@
+from unittest import mock
+
+import pytest
+
+import pcapi.core.offers.factories as offers_factories
+from pcapi.scripts import full_index_offers
+
+
+def test_get_shards():
+    assert full_index_offers._get_shards(1, 10, 3) == [(1, 3), (4, 6), (7, 10)]
+    assert full_index_offers._get_shards(1, 2, 4) == [(1, 1), (2, 2)]
+    assert full_index_offers._get_shards(5, 5, 1) == [(5, 5)]
+
+
+@pytest.mark.usefixtures("db_session")
+@mock.patch("pcapi.scripts.full_index_offers.appsearch.AppSearchBackend")
+class IndexShardTest:
+    def test_resume_from_checkpoint(self, mocked_backend_class, app):
+        offers = [offers_factories.StockFactory().offer for _ in range(3)]
+        checkpoints_name = full_index_offers._get_checkpoints_name(1, 1000)
+        shard_key = f"{offers[0].id}-{offers[-1].id}"
+        app.redis_client.hset(checkpoints_name, shard_key, offers[0].id)
+        mocked_backend_class.return_value.index_offers.return_value = 0
+
+        processed, skipped = full_index_offers.index_shard(checkpoints_name, offers[0].id, offers[-1].id)
+
+        assert (processed, skipped) == (2, 0)
+        indexed = mocked_backend_class.return_value.index_offers.call_args[0][0]
+        assert [offer.id for offer in indexed] == [offers[1].id, offers[2].id]
+        assert int(app.redis_client.hget(checkpoints_name, shard_key)) == offers[-1].id
+
+    def test_force(self, mocked_backend_class, app):
+        offer = offers_factories.StockFactory().offer
+        checkpoints_name = full_index_offers._get_checkpoints_name(1, 1000)
+        mocked_backend_class.return_value.index_offers.return_value = 0
+
+        full_index_offers.index_shard(checkpoints_name, offer.id, offer.id, skip_unchanged=False)
+
+        mocked_backend_class.return_value.index_offers.assert_called_once_with([offer], skip_unchanged=False)
+
+    @mock.patch("pcapi.scripts.full_index_offers.BATCH_SIZE", 1)
+    def test_failed_batch_does_not_move_checkpoint(self, mocked_backend_class, app):
+        offers = [offers_factories.StockFactory().offer for _ in range(3)]
+        checkpoints_name = full_index_offers._get_checkpoints_name(1, 1000)
+        shard_key = f"{offers[0].id}-{offers[-1].id}"
+        mocked_backend_class.return_value.index_offers.side_effect = [0, ValueError("It does not work")]
+
+        result = full_index_offers._index_shard_in_worker((checkpoints_name, offers[0].id, offers[-1].id, True))
+
+        assert result == (0, 0, True)
+        assert int(app.redis_client.hget(checkpoints_name, shard_key)) == offers[0].id
+
+
+@pytest.mark.usefixtures("db_session")
+@mock.patch("pcapi.scripts.full_index_offers.appsearch.AppSearchBackend")
+class FullIndexOffersTest:
+    def test_refuse_to_resume_with_another_number_of_shards(self, mocked_backend_class, app):
+        full_index_offers.full_index_offers(1, 100, n_shards=2)
+
+        with pytest.raises(ValueError):
+            full_index_offers.full_index_offers(1, 100, n_shards=4)
+
+        full_index_offers.full_index_offers(1, 100, n_shards=2)
+        full_index_offers.full_index_offers(1, 100, n_shards=4, restart=True)
+        checkpoints_name = full_index_offers._get_checkpoints_name(1, 100)
+        assert int(app.redis_client.hget(checkpoints_name, "shards")) == 4
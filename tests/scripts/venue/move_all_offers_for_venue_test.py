@@ -2,6 +2,7 @@ from unittest import mock
 
 import pytest
 
+from pcapi.core import search
 from pcapi.model_creators.generic_creators import create_offerer
 from pcapi.model_creators.generic_creators import create_venue
 from pcapi.model_creators.specific_creators import create_offer_with_thing_product
@@ -27,4 +28,6 @@ class MoveAllOffersFromVenueToOtherVenueTest:
         # Then
         db.session.refresh(destination_venue)
         assert set(destination_venue.offers) == set(offers)
-        mock_async_index_offer_ids.assert_called_with({offer.id for offer in offers})
+        mock_async_index_offer_ids.assert_called_with(
+            {offer.id for offer in offers}, priority=search.IndexationPriority.BULK
+        )
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from pcapi.utils.iterators import prefetch
+
+
+def test_prefetch_yields_all_items_in_order():
+    assert list(prefetch(iter(range(10)), read_ahead=2)) == list(range(10))
+
+
+def test_prefetch_fetches_next_item_while_current_one_is_processed():
+    second_item_fetched = threading.Event()
+
+    def generate():
+        yield 1
+        second_item_fetched.set()
+        yield 2
+
+    items = prefetch(generate())
+    assert next(items) == 1
+    assert second_item_fetched.wait(timeout=5)
+    assert list(items) == [2]
+
+
+def test_prefetch_does_not_read_ahead_more_than_asked():
+    fetched = []
+
+    def generate():
+        for i in range(10):
+            fetched.append(i)
+            yield i
+
+    items = prefetch(generate(), read_ahead=2)
+    assert next(items) == 0
+    items.close()
+    # The first item, 2 items in the queue, and at most one more that
+    # was being put in the queue when iteration stopped.
+    assert len(fetched) <= 4
+
+
+def test_prefetch_raises_errors_after_previous_items():
+    def generate():
+        yield 1
+        raise ValueError("API is down")
+
+    items = prefetch(generate())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="API is down"):
+        next(items)